@@ -43,6 +43,30 @@ def _train():
     src.train.python.train.main(opts)  # run code
 
 
+def _sweep():
+    """Wrapper function to call the random forest parameter sweep."""
+    opts = vars(args)  # create a dictionary for CLI options
+    src.classify.python.sweep.main(opts)
+
+
+def _null():
+    """Wrapper function to build the null distribution from simulations."""
+    opts = vars(args)  # create a dictionary for CLI options
+    src.classify.python.null_distribution.main(opts)
+
+
+def _adaptive():
+    """Wrapper function to add simulations until the null distribution is stable."""
+    opts = vars(args)  # create a dictionary for CLI options
+    src.classify.python.adaptive_null.main(opts)
+
+
+def _rworker():
+    """Wrapper function to start or stop a persistent R worker."""
+    opts = vars(args)  # create a dictionary for CLI options
+    src.classify.python.r_worker.main(opts)
+
+
 def _savedb():
     """Wrapper function to call gene_tsv/gene_features main function.
 
@@ -217,6 +241,13 @@ if __name__ == '__main__':
                               action='store_true',
                               default=False,
                               help='Train a gene hold-out cross-validated classifier')
+    parser_train.add_argument('--sharded',
+                              action='store_true',
+                              default=False,
+                              help='With --cv, write the model of each fold to the '
+                              '--output directory as soon as it is trained, instead '
+                              'of keeping all models in memory. The directory is '
+                              'used as the trained classifier by classify')
     parser_train.add_argument('-m', '--min-count',
                               type=int,
                               action='store',
@@ -228,10 +259,60 @@ if __name__ == '__main__':
                               type=int, action='store',
                               default=71,
                               help='Random seed (default: 71)')
+    parser_train.add_argument('-p', '--processes',
+                              type=int, action='store',
+                              default=1,
+                              help='Number of processes used to train the '
+                              'cross-validation folds in parallel (default: 1)')
+    parser_train.add_argument('--engine',
+                              type=str, action='store',
+                              default='r', choices=['r', 'native'],
+                              help='Random forest implementation. "r" uses R\'s '
+                              'randomForest package, while "native" does not '
+                              'require R (default: r)')
+    parser_train.add_argument('--early-stop-tol',
+                              type=float, action='store',
+                              default=None,
+                              help='Grow the forest of each cross-validation fold in '
+                              'batches of trees, and stop once the driver scores of '
+                              'the held-out genes change by less than this amount. '
+                              '--ntrees is then the maximum number of trees (default: None)')
+    parser_train.add_argument('--tree-batch',
+                              type=int, action='store',
+                              default=50,
+                              help='Number of trees added at a time with '
+                              '--early-stop-tol (default: 50)')
+    parser_train.add_argument('--fold-plan',
+                              type=str, action='store',
+                              default=None,
+                              help='Save the randomizations and folds of cross-validation '
+                              'to this .npz file, or reuse them if the file was made for '
+                              'the same genes and settings (default: None)')
+    parser_train.add_argument('--checkpoint',
+                              type=str, action='store',
+                              default=None,
+                              help='Directory where the result (and model) of every '
+                              'finished cross-validation fold is saved, so that an '
+                              'interrupted run can be continued with --resume '
+                              '(default: None)')
+    parser_train.add_argument('--resume',
+                              action='store_true',
+                              default=False,
+                              help='Continue an interrupted run from the folds saved '
+                              'in the --checkpoint directory. Folds saved for other '
+                              'features or settings are run again')
+    parser_train.add_argument('--r-worker',
+                              type=str, action='store',
+                              default=None,
+                              help='Unix socket of a running R worker (see the '
+                              'rworker sub-command). Avoids starting R for '
+                              'every command (default: None)')
     parser_train.add_argument('-r', '--output',
                               type=str, required=True,
                               help="Store the .Rdata file containing the trained"
-                              " random forest classifier")
+                              " random forest classifier. Use a .npz extension "
+                              "to save the portable format, which can be used "
+                              "by classify --engine native without R")
     parser_train.set_defaults(func=_train)
 
     # classify sub-command
@@ -301,8 +382,368 @@ if __name__ == '__main__':
                                  type=int, action='store',
                                  default=71,
                                  help='Random seed (default: 71)')
+    parser_classify.add_argument('-p', '--processes',
+                                 type=int, action='store',
+                                 default=1,
+                                 help='Number of processes used to evaluate the '
+                                 'cross-validation folds in parallel (default: 1)')
+    parser_classify.add_argument('--engine',
+                                 type=str, action='store',
+                                 default='r', choices=['r', 'native'],
+                                 help='Random forest implementation. "r" uses R\'s '
+                                 'randomForest package, while "native" does not '
+                                 'require R. Trained classifiers must be from the same '
+                                 'engine (default: r)')
+    parser_classify.add_argument('--importance',
+                                 action='store_true',
+                                 default=False,
+                                 help='Compute the permutation feature importance '
+                                 'of a cross-validated trained classifier (-t and --cv). '
+                                 'The result is cached next to the trained classifier '
+                                 '(default: False)')
+    parser_classify.add_argument('--prediction-mode',
+                                 type=str, action='store',
+                                 default='cv', choices=['cv', 'oob'],
+                                 help='Score genes by repeated 10-fold gene hold-out '
+                                 'cross-validation ("cv") or by the out-of-bag votes '
+                                 'of forests trained on all genes ("oob"). The oob '
+                                 'mode is faster but should use a larger --ntrees. '
+                                 'A trained classifier (-t) must be trained without '
+                                 '--cv for the oob mode (default: cv)')
+    parser_classify.add_argument('--oob-forests',
+                                 type=int, action='store',
+                                 default=1,
+                                 help='Number of forests (random seeds) averaged '
+                                 'in the oob prediction mode (default: 1)')
+    parser_classify.add_argument('--early-stop-tol',
+                                 type=float, action='store',
+                                 default=None,
+                                 help='Grow the forest of each cross-validation fold in '
+                                 'batches of trees, and stop once the driver scores of '
+                                 'the held-out genes change by less than this amount. '
+                                 '--ntrees is then the maximum number of trees (default: None)')
+    parser_classify.add_argument('--tree-batch',
+                                 type=int, action='store',
+                                 default=50,
+                                 help='Number of trees added at a time with '
+                                 '--early-stop-tol (default: 50)')
+    parser_classify.add_argument('--fold-plan',
+                                 type=str, action='store',
+                                 default=None,
+                                 help='Save the randomizations and folds of cross-validation '
+                                 'to this .npz file, or reuse them if the file was made for '
+                                 'the same genes and settings (default: None)')
+    parser_classify.add_argument('--fdr-method',
+                                 type=str, action='store',
+                                 default='bh', choices=['bh', 'storey'],
+                                 help='Method to compute q-values. "bh" is the '
+                                 'Benjamini-Hochberg method, while "storey" '
+                                 'multiplies it by the estimated fraction of '
+                                 'null genes, which gives more power (default: bh)')
+    parser_classify.add_argument('--tail-model',
+                                 type=str, action='store',
+                                 default='none', choices=['none', 'gpd'],
+                                 help='Model of the tail of the null distribution. '
+                                 '"gpd" fits a generalized Pareto distribution to the '
+                                 'highest null scores, so scores beyond the simulated '
+                                 'scores get small non-zero p-values instead of zero. '
+                                 'The fit is saved to null_tail_fit.txt (default: none)')
+    parser_classify.add_argument('--baseline',
+                                 type=str, action='store',
+                                 default='most_frequent',
+                                 choices=['most_frequent', 'stratified', 'uniform'],
+                                 help='Dummy classifier drawn as the baseline of the '
+                                 'ROC and PR plots. Its curves do not depend on the '
+                                 'strategy, but the logged precision and recall of its '
+                                 'predicted labels do (default: most_frequent)')
+    parser_classify.add_argument('--checkpoint',
+                                 type=str, action='store',
+                                 default=None,
+                                 help='Directory where the result (and model) of every '
+                                 'finished cross-validation fold is saved, so that an '
+                                 'interrupted run can be continued with --resume '
+                                 '(default: None)')
+    parser_classify.add_argument('--resume',
+                                 action='store_true',
+                                 default=False,
+                                 help='Continue an interrupted run from the folds saved '
+                                 'in the --checkpoint directory. Folds saved for other '
+                                 'features or settings are run again')
+    parser_classify.add_argument('--r-worker',
+                                 type=str, action='store',
+                                 default=None,
+                                 help='Unix socket of a running R worker (see the '
+                                 'rworker sub-command). Avoids starting R and '
+                                 're-loading trained classifiers for every '
+                                 'command (default: None)')
+    parser_classify.add_argument('--null-cache',
+                                 type=str, action='store',
+                                 default=None,
+                                 help='Directory caching the scores of simulated features by the '
+                                 'trained classifier, re-used while neither changes (default: None)')
+    parser_classify.add_argument('--null-cache-max-size',
+                                 type=float, action='store',
+                                 default=5000,
+                                 help='Evict the least recently used entries of the null cache '
+                                 'beyond this size in MB (default: 5000)')
+    parser_classify.add_argument('--null-cache-max-age',
+                                 type=float, action='store',
+                                 default=30,
+                                 help='Evict entries of the null cache not used for this many '
+                                 'days (default: 30)')
     parser_classify.set_defaults(func=_classify)
 
+    # sweep sub-command
+    parser_sweep = subparser.add_parser('sweep',
+                                        help='Compare random forest parameters by '
+                                        'cross-validation',
+                                        description='Cross-validate every combination '
+                                        'of the random forest parameters on the same '
+                                        'folds, and report the ROC/PR AUC, runtime and '
+                                        'number of significant genes of each setting')
+    parser_sweep.add_argument('-f', '--features',
+                              type=str,
+                              action='store', required=True,
+                              help='Path to file containing features in tab '
+                              'separated format.')
+    parser_sweep.add_argument('-n', '--ntrees',
+                              type=int, nargs='+',
+                              default=[200],
+                              help='Numbers of decision trees to compare. '
+                              '(default: 200)')
+    parser_sweep.add_argument('-d', '--driver-rate',
+                              type=float, nargs='+',
+                              default=[.7],
+                              help='Sample rates for oncogenes and TSGs to compare. '
+                              '(default: .7)')
+    parser_sweep.add_argument('-o', '--other-ratio',
+                              type=float, nargs='+',
+                              default=[1.],
+                              help='Ratios of sample size for "other" genes to '
+                              'compare. (default: 1.0)')
+    parser_sweep.add_argument('-i', '--iterations',
+                              type=int, action='store',
+                              default=5,
+                              help='Number of cross-validation iterations (default: 5)')
+    parser_sweep.add_argument('-nd', '--null-distribution',
+                              type=str,
+                              default=None,
+                              help='Null distribution from classify --simulated. If '
+                              'given, significant genes have a q-value of at most .1. '
+                              'Otherwise the majority vote predictions are counted '
+                              '(default: None)')
+    parser_sweep.add_argument('-rs', '--random-seed',
+                              type=int, action='store',
+                              default=71,
+                              help='Random seed (default: 71)')
+    parser_sweep.add_argument('-p', '--processes',
+                              type=int, action='store',
+                              default=1,
+                              help='Number of settings evaluated in parallel (default: 1)')
+    parser_sweep.add_argument('--engine',
+                              type=str, action='store',
+                              default='r', choices=['r', 'native'],
+                              help='Random forest implementation (default: r)')
+    parser_sweep.add_argument('--fold-plan',
+                              type=str, action='store',
+                              default=None,
+                              help='Save the randomizations and folds of cross-validation '
+                              'to this .npz file, or reuse them if the file was made for '
+                              'the same genes and settings (default: None)')
+    parser_sweep.add_argument('-r', '--output',
+                              type=str, required=True,
+                              help='Tab separated table with the performance of '
+                              'each setting')
+    parser_sweep.set_defaults(func=_sweep)
+
+    # null sub-command
+    parser_null = subparser.add_parser('null',
+                                       help='Builds the empirical null distribution '
+                                       'one simulation at a time. Each simulated '
+                                       'feature file is scored by a trained classifier '
+                                       'and added to a state file, and state files '
+                                       'can be merged.')
+    parser_null.add_argument('-t', '--trained-classifier',
+                             type=str, action='store',
+                             default=None,
+                             help='Trained classifier from the train sub-command, '
+                             'needed to score simulated features (default: None)')
+    parser_null.add_argument('-c', '--cv',
+                             action='store_true',
+                             default=False,
+                             help='The trained classifier uses gene hold-out '
+                             'cross-validation')
+    parser_null.add_argument('-f', '--features',
+                             type=str, nargs='+', default=None,
+                             help='Simulated feature files (one per simulation). '
+                             'Simulations already in the state are skipped')
+    parser_null.add_argument('-i', '--input-states',
+                             type=str, nargs='+', default=None,
+                             help='State files to merge, e.g. from simulations '
+                             'scored on different machines')
+    parser_null.add_argument('-s', '--state',
+                             type=str, action='store',
+                             default=None,
+                             help='State file with the vote counts of every '
+                             'simulation. Added to if it exists (default: None)')
+    parser_null.add_argument('-nd', '--null-distribution',
+                             type=str, action='store',
+                             default=None,
+                             help='Write the null distribution used by classify '
+                             '--null-distribution (default: None)')
+    parser_null.add_argument('-rs', '--random-seed',
+                             type=int, action='store',
+                             default=71,
+                             help='Random seed (default: 71)')
+    parser_null.add_argument('--engine',
+                             type=str, action='store',
+                             default='r', choices=['r', 'native'],
+                             help='Random forest implementation of the trained '
+                             'classifier (default: r)')
+    parser_null.add_argument('--r-worker',
+                             type=str, action='store',
+                             default=None,
+                             help='Unix socket of a running R worker (default: None)')
+    parser_null.add_argument('--null-cache',
+                             type=str, action='store',
+                             default=None,
+                             help='Directory caching the scores of simulated features by the '
+                             'trained classifier, re-used while neither changes (default: None)')
+    parser_null.add_argument('--null-cache-max-size',
+                             type=float, action='store',
+                             default=5000,
+                             help='Evict the least recently used entries of the null cache '
+                             'beyond this size in MB (default: 5000)')
+    parser_null.add_argument('--null-cache-max-age',
+                             type=float, action='store',
+                             default=30,
+                             help='Evict entries of the null cache not used for this many '
+                             'days (default: 30)')
+    parser_null.set_defaults(func=_null)
+
+    # adaptive sub-command
+    parser_adaptive = subparser.add_parser('adaptive',
+                                           help='Builds the empirical null distribution '
+                                           'by adding simulations one at a time, until '
+                                           'the significant genes of the observed data '
+                                           'are stable.')
+    parser_adaptive.add_argument('-t', '--trained-classifier',
+                                 type=str, required=True,
+                                 help='Trained classifier used to score the simulations')
+    parser_adaptive.add_argument('-c', '--cv',
+                                 action='store_true',
+                                 default=False,
+                                 help='The trained classifier uses gene hold-out '
+                                 'cross-validation')
+    parser_adaptive.add_argument('--observed',
+                                 type=str, required=True,
+                                 help='Classify result of the observed genes (without '
+                                 'a null distribution)')
+    parser_adaptive.add_argument('-f', '--features',
+                                 type=str, required=True,
+                                 help='Path of the simulated features of each iteration, '
+                                 'with {iter} for the iteration number, e.g. '
+                                 'simulated_features{iter}.txt')
+    parser_adaptive.add_argument('--simulate-cmd',
+                                 type=str, required=True,
+                                 help='Shell command that writes the simulated features '
+                                 'of an iteration, with {iter} for the iteration number. '
+                                 'Only run if the features do not exist yet')
+    parser_adaptive.add_argument('-s', '--state',
+                                 type=str, action='store',
+                                 default=None,
+                                 help='State file with the vote counts of every scored '
+                                 'simulation (see the null sub-command), so an '
+                                 'interrupted run is continued (default: None)')
+    parser_adaptive.add_argument('-nd', '--null-distribution',
+                                 type=str, required=True,
+                                 help='Null distribution used by classify')
+    parser_adaptive.add_argument('--max-iter',
+                                 type=int, action='store',
+                                 default=20,
+                                 help='Largest number of simulations (default: 20)')
+    parser_adaptive.add_argument('--min-iter',
+                                 type=int, action='store',
+                                 default=3,
+                                 help='Least number of simulations (default: 3)')
+    parser_adaptive.add_argument('--patience',
+                                 type=int, action='store',
+                                 default=2,
+                                 help='Number of simulations the significant genes must '
+                                 'stay the same (default: 2)')
+    parser_adaptive.add_argument('--max-uncertain',
+                                 type=float, action='store',
+                                 default=.05,
+                                 help='Largest fraction of significant genes whose p-value '
+                                 'confidence interval contains the significance cutoff '
+                                 '(default: .05)')
+    parser_adaptive.add_argument('-q', '--q-value',
+                                 type=float, action='store',
+                                 default=.1,
+                                 help='q-value threshold of significant genes (default: .1)')
+    parser_adaptive.add_argument('--fdr-method',
+                                 type=str, action='store',
+                                 default='bh', choices=['bh', 'storey'],
+                                 help='Method to compute q-values (default: bh)')
+    parser_adaptive.add_argument('--history',
+                                 type=str, action='store',
+                                 default=None,
+                                 help='Save the number of significant genes after '
+                                 'each simulation to this file (default: None)')
+    parser_adaptive.add_argument('-rs', '--random-seed',
+                                 type=int, action='store',
+                                 default=71,
+                                 help='Random seed (default: 71)')
+    parser_adaptive.add_argument('--engine',
+                                 type=str, action='store',
+                                 default='r', choices=['r', 'native'],
+                                 help='Random forest implementation of the trained '
+                                 'classifier (default: r)')
+    parser_adaptive.add_argument('--r-worker',
+                                 type=str, action='store',
+                                 default=None,
+                                 help='Unix socket of a running R worker (default: None)')
+    parser_adaptive.add_argument('--null-cache',
+                                 type=str, action='store',
+                                 default=None,
+                                 help='Directory caching the scores of simulated features by the '
+                                 'trained classifier, re-used while neither changes (default: None)')
+    parser_adaptive.add_argument('--null-cache-max-size',
+                                 type=float, action='store',
+                                 default=5000,
+                                 help='Evict the least recently used entries of the null cache '
+                                 'beyond this size in MB (default: 5000)')
+    parser_adaptive.add_argument('--null-cache-max-age',
+                                 type=float, action='store',
+                                 default=30,
+                                 help='Evict entries of the null cache not used for this many '
+                                 'days (default: 30)')
+    parser_adaptive.set_defaults(func=_adaptive)
+
+    # rworker sub-command
+    parser_rworker = subparser.add_parser('rworker',
+                                          help='Starts a persistent R session '
+                                          'that train and classify can use through '
+                                          'the --r-worker option.')
+    parser_rworker.add_argument('-s', '--socket',
+                                type=str, required=True,
+                                help='Path of the Unix socket the R worker listens on')
+    parser_rworker.add_argument('--idle-timeout',
+                                type=int, action='store',
+                                default=None,
+                                help='Stop the R worker after this many seconds '
+                                'without a request (default: None)')
+    parser_rworker.add_argument('--max-models',
+                                type=int, action='store',
+                                default=4,
+                                help='Largest number of loaded models kept in memory. The '
+                                'least recently used model is dropped beyond it (default: 4)')
+    parser_rworker.add_argument('--stop',
+                                action='store_true',
+                                default=False,
+                                help='Stop the R worker listening on the socket')
+    parser_rworker.set_defaults(func=_rworker)
+
     parser.set_defaults(database='genes')  # by default work on sqlite db
     args = parser.parse_args()  # parse the command line options
 
@@ -326,7 +767,11 @@ if __name__ == '__main__':
     logging.info('Command: {0}'.format(' '.join(sys.argv)))
 
     # import all the modules for 20/20+
+    import src.classify.python.adaptive_null
     import src.classify.python.classifier
+    import src.classify.python.null_distribution
+    import src.classify.python.r_worker
+    import src.classify.python.sweep
     import src.features.python.features
     import src.savedb.python.gene_tsv
     import src.savedb.python.gene_features
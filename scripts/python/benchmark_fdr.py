@@ -0,0 +1,81 @@
+"""This script measures the time of adjusting p-values for multiple testing.
+
+The vectorized Benjamini-Hochberg method of p_value.bh_fdr is compared with
+the previous implementation, which took the cumulative minimum in a python
+loop, and is checked to give exactly the same q-values. Storey's q-values and
+the adjustment within groups (e.g. tumor types) are also timed.
+"""
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '../..'))
+
+import src.utils.python.p_value as p_value
+import numpy as np
+import argparse
+import time
+
+
+def parse_arguments():
+    info = 'Benchmark the adjustment of p-values for multiple testing'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-n', '--num-pvalues',
+                        type=int, default=10**6,
+                        help='Number of p-values (default: 1000000)')
+    parser.add_argument('-g', '--groups',
+                        type=int, default=30,
+                        help='Number of groups (e.g. tumor types) for the '
+                        'grouped adjustment (default: 30)')
+    parser.add_argument('-rs', '--random-seed',
+                        type=int, default=71,
+                        help='Random seed (default: 71)')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def loop_bh_fdr(pval):
+    """Benjamini-Hochberg method with the cumulative minimum in a python
+    loop (previous implementation of p_value.bh_fdr)."""
+    pval_array = np.array(pval)
+    sorted_order = np.argsort(pval_array)
+    original_order = np.argsort(sorted_order)
+    pval_array = pval_array[sorted_order]
+    n = float(len(pval))
+    i = np.arange(1, int(n)+1, dtype=float)[::-1]
+    x = n/i * pval_array[::-1]
+    for j in range(1, len(x)):
+        if x[j-1] < x[j]:
+            x[j] = x[j-1]
+    pval_adj = np.minimum(1, x)[::-1]
+    return pval_adj[original_order]
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def main(opts):
+    prng = np.random.RandomState(opts['random_seed'])
+    # mostly null p-values, with a few small ones (ties are kept by rounding)
+    pval = np.round(prng.uniform(size=opts['num_pvalues']) ** 2, 6)
+    groups = prng.randint(opts['groups'], size=opts['num_pvalues'])
+
+    loop_qval, loop_time = timed(loop_bh_fdr, pval)
+    bh_qval, bh_time = timed(p_value.bh_fdr, pval)
+    storey_qval, storey_time = timed(p_value.storey_qvalue, pval)
+    grouped_qval, grouped_time = timed(p_value.grouped_fdr, pval, groups)
+
+    print('method\ttime (s)')
+    print('loop BH\t{0:.3f}'.format(loop_time))
+    print('vectorized BH\t{0:.3f}'.format(bh_time))
+    print('storey\t{0:.3f}'.format(storey_time))
+    print('grouped BH ({0} groups)\t{1:.3f}'.format(opts['groups'], grouped_time))
+    print('Identical BH q-values: {0}'.format(np.array_equal(loop_qval, bh_qval)))
+
+
+if __name__ == '__main__':
+    opts = parse_arguments()
+    main(opts)
@@ -0,0 +1,89 @@
+"""This script measures the per-fold overhead of cross-validation outside
+of fitting the random forest: randomizing the genes, slicing the training
+and held-out genes, and adding the held-out scores.
+
+Label based lookups (as previously done by generic_classifier) are compared
+with the positional slicing of a precomputed FoldPlan.
+"""
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '../..'))
+
+from src.classify.python.fold_plan import FoldPlan
+import src.features.python.feature_utils as futils
+from sklearn import cross_validation
+import numpy as np
+import pandas as pd
+import argparse
+import time
+
+
+def parse_arguments():
+    info = 'Benchmark the per-fold overhead of cross-validation'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-f', '--features',
+                        type=str, required=True,
+                        help='Feature file from the 2020plus.py features command')
+    parser.add_argument('-i', '--iterations',
+                        type=int, default=10,
+                        help='Number of cross-validation iterations (default: 10)')
+    parser.add_argument('-k', '--folds',
+                        type=int, default=10,
+                        help='Number of cross-validation folds (default: 10)')
+    parser.add_argument('-rs', '--random-seed',
+                        type=int, default=71,
+                        help='Random seed (default: 71)')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def label_lookups(df, num_iter, k, seed):
+    """Per fold work with randomized data frames and gene name lookups."""
+    prng = np.random.RandomState(seed)
+    x = df
+    onco_prob = pd.Series(index=df.index).fillna(0)
+    for i in range(num_iter):
+        x, y = futils.randomize(x, prng)
+        k_fold = cross_validation.StratifiedKFold(y, n_folds=k)
+        for train_ix, test_ix in k_fold:
+            xtrain = x.iloc[train_ix].copy()
+            ytrain = y.iloc[train_ix].copy()
+            xtest = x.iloc[test_ix]
+            tmp_test_ix = x.iloc[test_ix].index
+            onco_prob.ix[tmp_test_ix] += np.zeros(len(test_ix))
+
+
+def fold_plan(df, num_iter, k, seed):
+    """Per fold work with positional slicing of a FoldPlan."""
+    x = df.sort_index()
+    y = x.index.to_series().apply(futils.label_gene)
+    plan = FoldPlan.build(x.index, y.values, num_iter, k, seed)
+    onco_prob = np.zeros(len(x))
+    for i in range(num_iter):
+        for train_ix, test_ix in plan.folds(i):
+            xtrain = x.iloc[train_ix]
+            ytrain = y.iloc[train_ix]
+            xtest = x.iloc[test_ix]
+            onco_prob[test_ix] += np.zeros(len(test_ix))
+
+
+def main(opts):
+    df = pd.read_csv(opts['features'], sep='\t', index_col=0)
+    num_iter, k = opts['iterations'], opts['folds']
+    num_folds = num_iter * k
+
+    print('method\ttotal (s)\tper fold (ms)')
+    for name, func in [('label lookups', label_lookups),
+                       ('fold plan', fold_plan)]:
+        start = time.time()
+        func(df, num_iter, k, opts['random_seed'])
+        elapsed = time.time() - start
+        print('{0}\t{1:.3f}\t{2:.2f}'.format(name, elapsed,
+                                             1000. * elapsed / num_folds))
+
+
+if __name__ == '__main__':
+    opts = parse_arguments()
+    main(opts)
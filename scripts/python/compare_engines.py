@@ -0,0 +1,77 @@
+"""This script compares the run time and driver scores of the R
+and native random forest engines using gene hold-out cross-validation.
+"""
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '../..'))
+
+from src.classify.python.r_random_forest_clf import RRandomForest
+import pandas as pd
+import scipy.stats as stats
+import argparse
+import time
+
+
+def parse_arguments():
+    info = 'Compare run time of the R and native random forest engines'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-f', '--features',
+                        type=str, required=True,
+                        help='Feature file from the 2020plus.py features command')
+    parser.add_argument('-n', '--ntrees',
+                        type=int, default=200,
+                        help='Number of trees (default: 200)')
+    parser.add_argument('-rs', '--random-seed',
+                        type=int, default=71,
+                        help='Random seed (default: 71)')
+    parser.add_argument('-o', '--output',
+                        type=str, default=None,
+                        help='Optional path to save the driver scores of both engines')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def run_engine(df, engine, opts):
+    """Time cross-validation for a single engine."""
+    start = time.time()
+    rrclf = RRandomForest(df,
+                          ntrees=opts['ntrees'],
+                          seed=opts['random_seed'],
+                          engine=engine)
+    onco_prob, tsg_prob, other_prob = rrclf.kfold_validation()
+    run_time = time.time() - start
+    return rrclf, 1 - other_prob, run_time
+
+
+def main(opts):
+    df = pd.read_csv(opts['features'], sep='\t', index_col=0)
+
+    results = {}
+    for engine in ['r', 'native']:
+        results[engine] = run_engine(df, engine, opts)
+    r_clf, r_driver, r_time = results['r']
+    native_clf, native_driver, native_time = results['native']
+    native_driver = native_driver[r_driver.index]
+
+    rho, pval = stats.spearmanr(r_driver, native_driver)
+    print('engine\ttime (s)\tdriver ROC AUC\tdriver PR AUC')
+    print('r\t{0:.1f}\t{1:.3f}\t{2:.3f}'.format(r_time,
+                                                r_clf.driver_mean_roc_auc,
+                                                r_clf.driver_mean_pr_auc))
+    print('native\t{0:.1f}\t{1:.3f}\t{2:.3f}'.format(native_time,
+                                                     native_clf.driver_mean_roc_auc,
+                                                     native_clf.driver_mean_pr_auc))
+    print('Speed up: {0:.1f}x'.format(r_time / native_time))
+    print('Spearman correlation of driver scores: {0:.3f}'.format(rho))
+
+    if opts['output']:
+        score_df = pd.DataFrame({'r driver score': r_driver,
+                                 'native driver score': native_driver})
+        score_df.to_csv(opts['output'], sep='\t')
+
+
+if __name__ == "__main__":
+    opts = parse_arguments()
+    main(opts)
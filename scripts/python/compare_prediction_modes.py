@@ -0,0 +1,106 @@
+"""This script compares the run time and gene scores of the repeated
+10-fold gene hold-out cross-validation ("cv") and the out-of-bag ("oob")
+prediction modes of 2020plus.py classify.
+"""
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '../..'))
+
+from src.classify.python.r_random_forest_clf import RRandomForest
+import pandas as pd
+import scipy.stats as stats
+import argparse
+import time
+
+
+def parse_arguments():
+    info = 'Compare the cross-validation and out-of-bag prediction modes'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-f', '--features',
+                        type=str, required=True,
+                        help='Feature file from the 2020plus.py features command')
+    parser.add_argument('-n', '--ntrees',
+                        type=int, default=200,
+                        help='Number of trees per fold in the cv mode (default: 200)')
+    parser.add_argument('--oob-ntrees',
+                        type=int, default=1000,
+                        help='Number of trees per forest in the oob mode (default: 1000)')
+    parser.add_argument('--oob-forests',
+                        type=int, default=1,
+                        help='Number of forests in the oob mode (default: 1)')
+    parser.add_argument('--engine',
+                        type=str, default='r', choices=['r', 'native'],
+                        help='Random forest implementation (default: r)')
+    parser.add_argument('--top',
+                        type=int, default=100,
+                        help='Number of top scoring genes to compare (default: 100)')
+    parser.add_argument('-rs', '--random-seed',
+                        type=int, default=71,
+                        help='Random seed (default: 71)')
+    parser.add_argument('-o', '--output',
+                        type=str, default=None,
+                        help='Optional path to save the scores of both modes')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def run_mode(df, mode, opts):
+    """Time the scoring of genes for a single prediction mode."""
+    start = time.time()
+    if mode == 'cv':
+        rrclf = RRandomForest(df,
+                              ntrees=opts['ntrees'],
+                              seed=opts['random_seed'],
+                              engine=opts['engine'])
+        onco_prob, tsg_prob, other_prob = rrclf.kfold_validation()
+    else:
+        rrclf = RRandomForest(df,
+                              total_iter=opts['oob_forests'],
+                              ntrees=opts['oob_ntrees'],
+                              seed=opts['random_seed'],
+                              engine=opts['engine'])
+        onco_prob, tsg_prob, other_prob = rrclf.oob_validation()
+    run_time = time.time() - start
+    scores = pd.DataFrame({'oncogene score': onco_prob,
+                           'tsg score': tsg_prob,
+                           'driver score': 1 - other_prob})
+    return rrclf, scores, run_time
+
+
+def main(opts):
+    df = pd.read_csv(opts['features'], sep='\t', index_col=0)
+
+    results = {}
+    for mode in ['cv', 'oob']:
+        results[mode] = run_mode(df, mode, opts)
+    cv_clf, cv_scores, cv_time = results['cv']
+    oob_clf, oob_scores, oob_time = results['oob']
+    oob_scores = oob_scores.loc[cv_scores.index]
+
+    print('mode\ttime (s)\tdriver ROC AUC\tdriver PR AUC')
+    for mode in ['cv', 'oob']:
+        clf, scores, run_time = results[mode]
+        print('{0}\t{1:.1f}\t{2:.3f}\t{3:.3f}'.format(mode, run_time,
+                                                      clf.driver_mean_roc_auc,
+                                                      clf.driver_mean_pr_auc))
+    print('Speed up: {0:.1f}x'.format(cv_time / oob_time))
+
+    # agreement of scores
+    print('score\tSpearman rho\ttop {0} overlap'.format(opts['top']))
+    for col in ['oncogene score', 'tsg score', 'driver score']:
+        rho, pval = stats.spearmanr(cv_scores[col], oob_scores[col])
+        cv_top = set(cv_scores[col].sort_values(ascending=False).index[:opts['top']])
+        oob_top = set(oob_scores[col].sort_values(ascending=False).index[:opts['top']])
+        print('{0}\t{1:.3f}\t{2}'.format(col, rho, len(cv_top & oob_top)))
+
+    if opts['output']:
+        score_df = pd.concat([cv_scores.add_prefix('cv '),
+                              oob_scores.add_prefix('oob ')], axis=1)
+        score_df.to_csv(opts['output'], sep='\t')
+
+
+if __name__ == "__main__":
+    opts = parse_arguments()
+    main(opts)
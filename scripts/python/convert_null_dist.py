@@ -0,0 +1,55 @@
+"""This script converts a null distribution text file from classify
+--simulated into vote histograms (see src/utils/python/vote_histogram.py),
+so that p-values are looked up exactly from vote counts.
+
+By default the histograms are saved next to the null distribution, where
+classify finds them. The total number of votes of each gene (number of
+trees times number of predictions) and the number of simulated genes are
+recovered from the scores and p-values, unless given.
+"""
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '../..'))
+
+from src.utils.python.vote_histogram import VoteHistogram, sidecar_path
+import pandas as pd
+import argparse
+
+
+def parse_arguments():
+    info = 'Convert a null distribution to vote histograms'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-i', '--input',
+                        type=str, required=True,
+                        help='Null distribution from classify --simulated')
+    parser.add_argument('-t', '--total-votes',
+                        type=int, default=None,
+                        help='Number of trees times number of predictions '
+                        'of each gene (default: recovered from the scores)')
+    parser.add_argument('-n', '--num-genes',
+                        type=int, default=None,
+                        help='Number of simulated genes (default: recovered '
+                        'from the p-values)')
+    parser.add_argument('-o', '--output',
+                        type=str, default=None,
+                        help='Vote histograms (default: next to the input)')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def main(opts):
+    null_df = pd.read_csv(opts['input'], sep='\t', index_col=0)
+    null_hist = VoteHistogram.from_null_table(null_df,
+                                              total_votes=opts['total_votes'],
+                                              num_genes=opts['num_genes'])
+    output = opts['output'] or sidecar_path(opts['input'])
+    null_hist.save(output)
+    print('Saved {0} total votes per gene, {1} simulated genes to {2}'.format(
+        null_hist.total_votes, null_hist.counts['driver'].sum(), output))
+
+
+if __name__ == '__main__':
+    opts = parse_arguments()
+    main(opts)
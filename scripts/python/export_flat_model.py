@@ -0,0 +1,63 @@
+"""This script converts a trained classifier from 2020plus.py train
+(.Rdata, native pickle or sharded model directory) into the portable
+.npz format, which can be loaded without R by 2020plus.py classify
+--engine native.
+"""
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '../..'))
+
+import argparse
+import time
+
+
+def parse_arguments():
+    info = 'Convert a trained classifier to the portable .npz format'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-i', '--input',
+                        type=str, required=True,
+                        help='Trained classifier from 2020plus.py train')
+    parser.add_argument('-c', '--cv',
+                        action='store_true', default=False,
+                        help='Input classifier was trained with the --cv option')
+    parser.add_argument('--engine',
+                        type=str, default='r', choices=['r', 'native'],
+                        help='Engine that trained the classifier (default: r)')
+    parser.add_argument('-o', '--output',
+                        type=str, required=True,
+                        help='Path of the .npz output file')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def main(opts):
+    if opts['engine'] == 'r':
+        from src.classify.python.r_random_forest_clf import MyClassifier
+        clf = MyClassifier()
+    else:
+        from src.classify.python.native_random_forest_clf import NativeClassifier
+        clf = NativeClassifier()
+
+    if opts['cv']:
+        clf.load_cv(opts['input'])
+        clf.save_flat_cv(opts['output'])
+    else:
+        clf.load(opts['input'])
+        clf.save_flat(opts['output'])
+
+    # report how quickly the converted model loads
+    from src.classify.python.flat_forest import FlatModelFile
+    start = time.time()
+    saved = FlatModelFile(opts['output'])
+    elapsed = time.time() - start
+    print('Saved {0} random forest(s) with {1} trees to {2} '
+          '(loads in {3:.3f}s)'.format(saved.num_models,
+                                       len(saved.tree_offsets) - 1,
+                                       opts['output'], elapsed))
+
+
+if __name__ == '__main__':
+    opts = parse_arguments()
+    main(opts)
@@ -0,0 +1,60 @@
+"""This script combines the classify results of several tumor types into a
+single table, with q-values adjusted within each tumor type.
+
+Results saved with different --fdr-method options can be given, since the
+q-values are recomputed from the p-values with --fdr-method.
+"""
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '../..'))
+
+import src.utils.python.p_value as p_value
+import pandas as pd
+import argparse
+
+
+def parse_arguments():
+    info = 'Combine classify results of several tumor types'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-i', '--input',
+                        type=str, nargs='+', required=True,
+                        help='Classify results (with p-values) of each tumor type')
+    parser.add_argument('-t', '--tumor-types',
+                        type=str, nargs='+', required=True,
+                        help='Tumor type of each input file')
+    parser.add_argument('--fdr-method',
+                        type=str, default='bh', choices=p_value.fdr_methods,
+                        help='Method to compute q-values (default: bh)')
+    parser.add_argument('-o', '--output',
+                        type=str, required=True,
+                        help='Combined results')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def main(opts):
+    if len(opts['input']) != len(opts['tumor_types']):
+        raise ValueError('Give a tumor type for each input file')
+
+    dfs = []
+    for path, tumor_type in zip(opts['input'], opts['tumor_types']):
+        df = pd.read_csv(path, sep='\t', index_col=0)
+        df.insert(0, 'tumor type', tumor_type)
+        dfs.append(df)
+    result = pd.concat(dfs)
+
+    # adjust p-values within each tumor type
+    for score_col, pval_col in p_value.score_pval_cols:
+        qval_col = pval_col.replace('p-value', 'q-value')
+        result[qval_col] = p_value.grouped_fdr(result[pval_col],
+                                               result['tumor type'],
+                                               opts['fdr_method'])
+
+    result.to_csv(opts['output'], sep='\t', index_label='gene')
+
+
+if __name__ == '__main__':
+    opts = parse_arguments()
+    main(opts)
@@ -0,0 +1,196 @@
+"""Adaptive number of simulations for the empirical null distribution.
+
+Instead of a fixed number of simulated data sets, simulations are added one
+at a time. After each simulation, the null distribution is updated (see
+null_distribution), and the p-values and q-values of the observed genes are
+recomputed. Simulations stop once the significant genes have not changed for
+a number of simulations, and the p-values of few significant genes are still
+uncertain. The p-value of a gene is the fraction of simulated genes scoring
+above it, so its uncertainty is a binomial confidence interval, and it is
+uncertain if the interval contains the p-value cutoff of significance
+(q_threshold * number of significant genes / number of genes, the
+Benjamini-Hochberg line).
+"""
+from src.classify.python.null_distribution import score_simulation, simulation_name
+from src.utils.python.vote_histogram import VoteHistogram, sidecar_path
+from src.utils.python.p_value import compute_p_values, score_pval_cols, fdr_adjust
+from src.utils.python.p_value import estimate_pi0
+import scipy.stats as stats
+import pandas as pd
+import numpy as np
+import subprocess
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def p_value_interval(pvals, num_null, alpha=.05):
+    """Clopper-Pearson confidence interval of empirical p-values.
+
+    Parameters
+    ----------
+    pvals : np.array
+        fraction of the simulated genes scoring above each gene
+    num_null : int
+        number of simulated genes
+    alpha : float
+        1 - confidence level
+
+    Returns
+    -------
+    lower, upper : np.array
+        bounds of the confidence interval
+    """
+    counts = np.rint(np.asarray(pvals, dtype=float) * num_null)
+    with np.errstate(invalid='ignore'):
+        lower = np.where(counts > 0,
+                         stats.beta.ppf(alpha / 2, counts, num_null - counts + 1), 0.)
+        upper = np.where(counts < num_null,
+                         stats.beta.ppf(1 - alpha / 2, counts + 1, num_null - counts), 1.)
+    return lower, upper
+
+
+class NullMonitor(object):
+    """Significant genes and p-value uncertainty as simulations are added.
+
+    Parameters
+    ----------
+    observed_df : pd.DataFrame
+        classify result of the observed genes (scores and vote counts)
+    fdr_method : str
+        method to compute q-values (see p_value.fdr_adjust)
+    q_threshold : float
+        genes with a q-value at most q_threshold are significant
+    min_iter : int
+        least number of simulations
+    patience : int
+        number of simulations the significant genes must stay the same
+    max_uncertain : float
+        largest fraction of significant genes with uncertain p-values
+    """
+
+    def __init__(self, observed_df, fdr_method='bh', q_threshold=.1,
+                 min_iter=3, patience=2, max_uncertain=.05):
+        self.observed_df = observed_df
+        self.fdr_method = fdr_method
+        self.q_threshold = q_threshold
+        self.min_iter = min_iter
+        self.patience = patience
+        self.max_uncertain = max_uncertain
+        self.significant = []  # significant genes after each simulation
+        self.history = []
+
+    def update(self, null_hist):
+        """Recompute the significant genes with the updated null distribution.
+
+        Returns
+        -------
+        row : dict
+            number of simulated genes, significant genes, genes that changed
+            significance and genes with uncertain p-values
+        """
+        pvals = null_hist.p_values(self.observed_df)
+        if pvals is None:
+            pvals = compute_p_values(self.observed_df, null_hist.to_null_table())
+        num_null = int(null_hist.counts['driver'].sum())
+
+        significant = set()
+        num_uncertain = 0
+        for score_col, pval_col in score_pval_cols:
+            pval = pvals[pval_col].values
+            is_sig = fdr_adjust(pval, self.fdr_method) <= self.q_threshold
+            significant |= set((pval_col, gene) for gene in pvals.index[is_sig])
+
+            # p-value cutoff of significance
+            cutoff = self.q_threshold * max(is_sig.sum(), 1) / float(len(pval))
+            if self.fdr_method == 'storey':
+                cutoff /= estimate_pi0(pval)
+            lower, upper = p_value_interval(pval, num_null)
+            num_uncertain += np.sum((lower <= cutoff) & (upper > cutoff))
+
+        previous = self.significant[-1] if self.significant else set()
+        self.significant.append(significant)
+        row = {'simulations': len(null_hist.sources),
+               'simulated genes': num_null,
+               'significant': len(significant),
+               'changed': len(significant ^ previous),
+               'uncertain': int(num_uncertain)}
+        self.history.append(row)
+        return row
+
+    def is_stable(self):
+        """Whether enough simulations were added."""
+        if len(self.history) < max(self.min_iter, self.patience + 1):
+            return False
+        recent = self.history[-self.patience:]
+        is_same = all(row['changed'] == 0 for row in recent)
+        last = self.history[-1]
+        is_precise = last['uncertain'] <= self.max_uncertain * last['significant']
+        return is_same and is_precise
+
+    def history_df(self):
+        cols = ['simulations', 'simulated genes', 'significant', 'changed', 'uncertain']
+        return pd.DataFrame(self.history, columns=cols)
+
+
+def run_simulation(command, num_iter):
+    """Run the command that simulates the features of an iteration."""
+    command = command.format(iter=num_iter)
+    logger.info('Simulating: {0}'.format(command))
+    subprocess.check_call(command, shell=True)
+
+
+def main(cli_opts):
+    observed_df = pd.read_csv(cli_opts['observed'], sep='\t', index_col=0)
+    monitor = NullMonitor(observed_df,
+                          fdr_method=cli_opts.get('fdr_method', 'bh'),
+                          q_threshold=cli_opts['q_value'],
+                          min_iter=cli_opts['min_iter'],
+                          patience=cli_opts['patience'],
+                          max_uncertain=cli_opts['max_uncertain'])
+
+    # simulations scored by a previous run are kept in the state. They are
+    # counted by the monitor as one step, since the state only has their sum.
+    null_hist = None
+    if cli_opts['state'] and os.path.exists(cli_opts['state']):
+        null_hist = VoteHistogram.load(cli_opts['state'])
+        row = monitor.update(null_hist)
+        logger.info('Resumed from {0} simulations: {1} significant, {2} uncertain'.format(
+            row['simulations'], row['significant'], row['uncertain']))
+
+    max_iter = cli_opts['max_iter']
+    for num_iter in range(1, max_iter+1):
+        num_sim = len(null_hist.sources) if null_hist is not None else 0
+        if num_sim >= max_iter or monitor.is_stable():
+            break
+        feature_path = cli_opts['features'].format(iter=num_iter)
+        if (null_hist is not None and os.path.exists(feature_path) and
+                simulation_name(feature_path) in null_hist.sources):
+            continue
+        if not os.path.exists(feature_path):
+            run_simulation(cli_opts['simulate_cmd'], num_iter)
+        logger.info('Scoring simulated genes of {0} . . .'.format(feature_path))
+        sim_hist = score_simulation(feature_path, cli_opts)
+        null_hist = sim_hist if null_hist is None else null_hist.merge(sim_hist)
+        if cli_opts['state']:
+            null_hist.save(cli_opts['state'])
+
+        row = monitor.update(null_hist)
+        logger.info('Simulation {0}: {1} significant, {2} changed, {3} uncertain'.format(
+            row['simulations'], row['significant'], row['changed'], row['uncertain']))
+
+    num_sim = len(null_hist.sources)
+    if monitor.is_stable():
+        logger.info('Stopped after {0} of at most {1} simulations ({2} saved)'.format(
+            num_sim, max_iter, max(max_iter - num_sim, 0)))
+    else:
+        logger.warning('The significant genes were not stable after {0} '
+                       'simulations'.format(num_sim))
+
+    # null distribution used by classify
+    null_hist.to_null_table().to_csv(cli_opts['null_distribution'], sep='\t',
+                                     index_label='score')
+    null_hist.save(sidecar_path(cli_opts['null_distribution']))
+    if cli_opts.get('history'):
+        monitor.history_df().to_csv(cli_opts['history'], sep='\t', index=False)
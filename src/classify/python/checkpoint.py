@@ -0,0 +1,111 @@
+"""Checkpoints of cross-validation folds.
+
+With a checkpoint directory (--checkpoint), the result of every finished
+fold is saved as soon as it is available. The checkpoint directory contains:
+
+    {name}_iter{i}_fold{j}.npz : held-out class probabilities, feature
+        importance and number of trees of a fold
+    models/iter{i}_fold{j}.* : model of a fold (train --cv only)
+
+Fold seeds are derived from the master seed (see seeds), so a fold gives
+the same result no matter which folds were run before it. A resumed run
+(--resume) only runs the folds without a saved result, and gives the same
+output as an uninterrupted run.
+
+Each saved fold also records a fingerprint of the features, class labels
+and classifier settings (see fingerprint). Folds saved for other features
+or settings are run again instead of being reused.
+"""
+import numpy as np
+import hashlib
+import os
+
+MODEL_DIR = 'models'
+
+
+def fold_result_path(checkpoint_dir, name, num_iter, num_fold):
+    """Path of the saved result of a fold (iteration/fold start from 1)."""
+    return os.path.join(checkpoint_dir, '{0}_iter{1}_fold{2}.npz'.format(
+        name, num_iter, num_fold))
+
+
+def fingerprint(x, y, params):
+    """Hash of the data and settings that determine the result of a fold.
+
+    Parameters
+    ----------
+    x : pd.DataFrame
+        features of the genes
+    y : pd.Series
+        class labels of the genes
+    params : dict
+        classifier settings (number of trees, sample rates, engine, ...)
+
+    Returns
+    -------
+    hex_digest : str
+        md5 hash of the genes, features, labels and settings
+    """
+    md5 = hashlib.md5()
+    md5.update('\t'.join(str(g) for g in x.index).encode())
+    md5.update('\t'.join(str(c) for c in x.columns).encode())
+    md5.update(np.ascontiguousarray(x.values, dtype=np.float64).tobytes())
+    md5.update('\t'.join(str(label) for label in y.values).encode())
+    md5.update(repr(sorted(params.items())).encode())
+    return md5.hexdigest()
+
+
+def save_fold_result(path, result, seed, test_ix, fingerprint=''):
+    """Save the result of a fold.
+
+    The file is written under a temporary name and then renamed, so an
+    interrupted write is never mistaken for a finished fold.
+
+    Parameters
+    ----------
+    path : str
+        path from fold_result_path
+    result : tuple
+        (proba_, importance, num_trees) returned by _run_fold
+    seed : int
+        seed of the fold
+    test_ix : np.array
+        row numbers of the held-out genes of the fold
+    fingerprint : str
+        hash of the features and settings of the run (see fingerprint)
+    """
+    proba_, importance, num_trees = result
+    arrays = {'seed': seed, 'test_ix': test_ix, 'fingerprint': fingerprint}
+    if proba_ is not None:
+        arrays['proba'] = proba_
+    if importance is not None:
+        arrays['importance'] = importance
+    if num_trees is not None:
+        arrays['num_trees'] = num_trees
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.rename(tmp_path, path)
+
+
+def load_fold_result(path, seed, test_ix, fingerprint=''):
+    """Load the result of a fold saved by save_fold_result.
+
+    Returns
+    -------
+    result : tuple or None
+        (proba_, importance, num_trees) of the fold. None if the fold
+        was not saved, or was saved for a different seed, held-out genes,
+        features or settings.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as arrays:
+        if int(arrays['seed']) != seed or not np.array_equal(arrays['test_ix'], test_ix):
+            return None
+        saved = str(arrays['fingerprint']) if 'fingerprint' in arrays.files else None
+        if saved != fingerprint:
+            return None
+        get = lambda name: arrays[name] if name in arrays.files else None
+        num_trees = get('num_trees')
+        return (get('proba'), get('importance'),
+                int(num_trees) if num_trees is not None else None)
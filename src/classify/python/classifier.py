@@ -1,11 +1,15 @@
 from __future__ import division
-from src.classify.python.dummy_clf import DummyClf
+from src.classify.python.dummy_clf import BaselineMetrics
 from src.classify.python.r_random_forest_clf import RRandomForest
-from src.utils.python.p_value import score2pval, compute_p_value, bh_fdr
+import src.classify.python.null_cache as null_cache
+from src.utils.python.p_value import compute_p_values, score_pval_cols, fdr_adjust
+from src.utils.python.p_value import fit_tail_models, extrapolate_tail
+from src.utils.python.vote_histogram import VoteHistogram, sidecar_path
 import src.utils.python.util as _utils
 import pandas as pd
 import numpy as np
 import logging
+import os
 
 # skip plotting if they don't have matplotlib
 try:
@@ -16,7 +20,53 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
-def rand_forest_pred(clf, data, result_path, null_dist=None):
+def add_vote_counts(tmp_df, clf):
+    """Add the number of tree votes for each class, and the number of
+    models that scored each gene, from the classifier's last prediction."""
+    if getattr(clf, 'prediction_df', None) is None:
+        return tmp_df
+    cols = ['oncogene votes', 'tsg votes', 'other votes', 'num predictions']
+    return tmp_df.join(clf.prediction_df[cols])
+
+
+def add_p_values(tmp_df, null_dist, fdr_method='bh', null_hist=None,
+                 tail_models=None):
+    """Add the oncogene, tsg and driver p-values and q-values of each gene.
+
+    P-values are looked up exactly from the vote counts when the null
+    distribution has vote histograms (null_hist) and the result has vote
+    counts, otherwise from the scores. Scores beyond the null distribution
+    get p-values from the tail models if given (see p_value.TailModel).
+    q-values are adjusted by fdr_method (see p_value.fdr_adjust)."""
+    pvals = null_hist.p_values(tmp_df) if null_hist is not None else None
+    if pvals is None:
+        pvals = compute_p_values(tmp_df, null_dist)
+    for score_col, pval_col in score_pval_cols:
+        if tail_models is not None:
+            pvals[pval_col] = extrapolate_tail(tmp_df[score_col], pvals[pval_col],
+                                               tail_models[pval_col])
+        tmp_df[pval_col] = pvals[pval_col]
+        tmp_df[pval_col.replace('p-value', 'q-value')] = fdr_adjust(tmp_df[pval_col],
+                                                                    fdr_method)
+    return tmp_df
+
+
+def load_null_hist(null_path, null_pvals):
+    """Load the vote histograms saved next to a null distribution text file,
+    if they belong to it (None otherwise)."""
+    hist_path = sidecar_path(null_path)
+    if not os.path.exists(hist_path):
+        return None
+    null_hist = VoteHistogram.load(hist_path)
+    if not null_hist.matches(null_pvals):
+        logger.warning('The vote counts in {0} do not match the null distribution '
+                       '{1}, so they are not used.'.format(hist_path, null_path))
+        return None
+    return null_hist
+
+
+def rand_forest_pred(clf, data, result_path, null_dist=None, prediction=None,
+                     fdr_method='bh', null_hist=None, tail_models=None):
     """Makes gene predictions using a random forest classifier.
 
     Parameters
@@ -25,19 +75,31 @@ def rand_forest_pred(clf, data, result_path, null_dist=None):
         random forest sub-class of GenericClassifier
     data : pd.DataFrame
         data frame containing feature information
-    result_path : str
-        path to save text file result
+    result_path : str or None
+        path to save text file result (not saved if None)
     null_dist : pd.DataFrame (default: None)
         dataframe relating scores to p values. P values will added
         to the results.
+    prediction : tuple (default: None)
+        held-out (oncogene, tsg, other) scores already computed by
+        kfold_validation. If not provided, kfold_prediction is run.
+    fdr_method : str (default: 'bh')
+        method to compute q-values from p-values (see p_value.fdr_adjust)
+    null_hist : VoteHistogram (default: None)
+        vote histograms of the null distribution, for exact p-values
+    tail_models : dict (default: None)
+        tail model of each p-value column, for scores beyond the null
+        distribution (see p_value.fit_tail_models)
 
     Returns
     -------
     tmp_df : pd.DataFrame
-        random forest results (already saved to file)
+        random forest results (saved to result_path)
     """
     # perform prediction
-    onco_prob, tsg_prob, other_prob = clf.kfold_prediction()
+    if prediction is None:
+        prediction = clf.kfold_prediction()
+    onco_prob, tsg_prob, other_prob = prediction
     true_class = clf.y
 
     # save features/prediction results
@@ -50,37 +112,23 @@ def rand_forest_pred(clf, data, result_path, null_dist=None):
     tmp_df['majority vote class'] = pred_class
     tmp_df['majority vote cancer gene'] = (tmp_df['driver score'] > .5).astype(int)
     tmp_df['training list class'] = true_class
+    tmp_df = add_vote_counts(tmp_df, clf)
     tmp_df = tmp_df.fillna(0)
     tmp_df = tmp_df.sort_values(by=['driver score',], ascending=False)
 
     if null_dist is not None:
-        # add oncogene p-value
-        onco_score = tmp_df['oncogene score'].copy()
-        onco_score.sort_values(inplace=True, ascending=False)
-        tmp_df['oncogene p-value'] = compute_p_value(onco_score,
-                                                     null_dist['oncogene p-value'].dropna())
-        tmp_df['oncogene q-value'] = bh_fdr(tmp_df['oncogene p-value'])
-
-        # add tsg p-value
-        tsg_score = tmp_df['tsg score'].copy()
-        tsg_score.sort_values(inplace=True, ascending=False)
-        tmp_df['tsg p-value'] = compute_p_value(tsg_score,
-                                                null_dist['tsg p-value'].dropna())
-        tmp_df['tsg q-value'] = bh_fdr(tmp_df['tsg p-value'])
-
-        # add driver p-values
-        driver_score = tmp_df['driver score'].copy()
-        driver_score.sort_values(inplace=True, ascending=False)
-        tmp_df['driver p-value'] = compute_p_value(driver_score,
-                                                   null_dist['driver p-value'].dropna())
-        tmp_df['driver q-value'] = bh_fdr(tmp_df['driver p-value'])
-
-    tmp_df.to_csv(result_path, sep='\t')
+        tmp_df = add_p_values(tmp_df, null_dist, fdr_method, null_hist,
+                              tail_models)
+
+    if result_path is not None:
+        tmp_df.to_csv(result_path, sep='\t')
 
     return tmp_df
 
 
-def trained_rand_forest_pred(clf, data, result_path, null_dist=None, is_cv=False):
+def trained_rand_forest_pred(clf, data, result_path, null_dist=None, is_cv=False,
+                             is_oob=False, fdr_method='bh', null_hist=None,
+                             tail_models=None):
     """Makes gene predictions using a previously trained random forest.
 
     Parameters
@@ -89,10 +137,21 @@ def trained_rand_forest_pred(clf, data, result_path, null_dist=None, is_cv=False
         random forest sub-class of GenericClassifier
     data : pd.DataFrame
         data frame containing feature information
-    result_path : str
-        path to save text file result
+    result_path : str or None
+        path to save text file result (not saved if None)
     null_dist : pd.DataFrame (default: None)
         dataframe relating scores to p values
+    is_cv : bool (default: False)
+        classifier was trained with gene hold-out cross-validation
+    is_oob : bool (default: False)
+        use out-of-bag votes for genes in the training data
+    fdr_method : str (default: 'bh')
+        method to compute q-values from p-values (see p_value.fdr_adjust)
+    null_hist : VoteHistogram (default: None)
+        vote histograms of the null distribution, for exact p-values
+    tail_models : dict (default: None)
+        tail model of each p-value column, for scores beyond the null
+        distribution (see p_value.fit_tail_models)
 
     Returns
     -------
@@ -102,6 +161,8 @@ def trained_rand_forest_pred(clf, data, result_path, null_dist=None, is_cv=False
     # perform prediction
     if is_cv:
         onco_prob, tsg_prob, other_prob = clf.predict_cv()
+    elif is_oob:
+        onco_prob, tsg_prob, other_prob = clf.predict_oob()
     else:
         onco_prob, tsg_prob, other_prob = clf.predict()
     true_class = clf.y
@@ -117,36 +178,62 @@ def trained_rand_forest_pred(clf, data, result_path, null_dist=None, is_cv=False
     tmp_df['majority vote class'] = pred_class
     tmp_df['majority vote cancer gene'] = (tmp_df['driver score'] > .5).astype(int)
     tmp_df['training list class'] = true_class
+    tmp_df = add_vote_counts(tmp_df, clf)
     tmp_df = tmp_df.fillna(0)
     tmp_df = tmp_df.sort_values(by=['driver score',], ascending=False)
 
     if null_dist is not None:
-        # add oncogene p-value
-        onco_score = tmp_df['oncogene score'].copy()
-        onco_score.sort_values(inplace=True, ascending=False)
-        tmp_df['oncogene p-value'] = compute_p_value(onco_score,
-                                                     null_dist['oncogene p-value'].dropna())
-        tmp_df['oncogene q-value'] = bh_fdr(tmp_df['oncogene p-value'])
-
-        # add tsg p-value
-        tsg_score = tmp_df['tsg score'].copy()
-        tsg_score.sort_values(inplace=True, ascending=False)
-        tmp_df['tsg p-value'] = compute_p_value(tsg_score,
-                                                null_dist['tsg p-value'].dropna())
-        tmp_df['tsg q-value'] = bh_fdr(tmp_df['tsg p-value'])
-
-        # add driver p-value
-        driver_score = tmp_df['driver score'].copy()
-        driver_score.sort_values(inplace=True, ascending=False)
-        tmp_df['driver p-value'] = compute_p_value(driver_score,
-                                                   null_dist['driver p-value'].dropna())
-        tmp_df['driver q-value'] = bh_fdr(tmp_df['driver p-value'])
-    else:
+        tmp_df = add_p_values(tmp_df, null_dist, fdr_method, null_hist,
+                              tail_models)
+    elif result_path is not None:
         tmp_df.to_csv(result_path, sep='\t')
 
     return tmp_df
 
 
+def permutation_importance(clf, model_path, feature_path):
+    """Permutation feature importance of a trained cross-validated classifier.
+
+    The result is cached next to the trained classifier, and re-used as
+    long as neither the classifier nor the features have changed.
+
+    Parameters
+    ----------
+    clf : GenericClassifier
+        random forest with cross-validated models already loaded
+    model_path : str
+        path of the trained classifier
+    feature_path : str
+        path of the features used for classification
+
+    Returns
+    -------
+    imp_df : pd.DataFrame
+        mean and standard deviation of the decrease in accuracy
+    """
+    # sharded models are a directory, so the cache is kept next to it
+    cache_path = model_path.rstrip(os.sep) + '.importance.txt'
+    features_md5 = _utils.file_hash(feature_path)
+    header = '# features md5: {0}\n'.format(features_md5)
+    if (os.path.exists(cache_path) and
+            os.path.getmtime(cache_path) >= os.path.getmtime(model_path)):
+        with open(cache_path) as handle:
+            is_valid = handle.readline() == header
+        if is_valid:
+            logger.info('Using cached feature importance from {0}'.format(cache_path))
+            return pd.read_csv(cache_path, sep='\t', index_col=0, comment='#')
+
+    logger.info('Computing permutation feature importance . . .')
+    imp_df = clf.permutation_importance()
+    try:
+        with open(cache_path, 'w') as handle:
+            handle.write(header)
+            imp_df.to_csv(handle, sep='\t')
+    except IOError:
+        logger.warning('Could not cache feature importance in {0}'.format(cache_path))
+    return imp_df
+
+
 def main(cli_opts):
     cfg_opts = _utils.get_output_config('classifier')
     in_opts = _utils.get_input_config('classifier')
@@ -162,11 +249,52 @@ def main(cli_opts):
     if not cli_opts['simulated'] and cli_opts['null_distribution']:
         null_pvals = pd.read_csv(cli_opts['null_distribution'], sep='\t',
                                  index_col=0)
+        null_hist = load_null_hist(cli_opts['null_distribution'], null_pvals)
     else:
         null_pvals = None
+        null_hist = None
+    fdr_method = cli_opts.get('fdr_method', 'bh')
+
+    # model the tail of the null distribution beyond the simulated scores
+    if null_pvals is not None and cli_opts.get('tail_model', 'none') == 'gpd':
+        tail_models = fit_tail_models(null_pvals)
+        tail_df = pd.DataFrame({pval_col: tail_models[pval_col].diagnostics()
+                                for score_col, pval_col in score_pval_cols
+                                if tail_models[pval_col] is not None}).T
+        for pval_col in tail_models:
+            if tail_models[pval_col] is None:
+                logger.warning('Too few null scores to fit the tail model of '
+                               'the {0}'.format(pval_col))
+        if len(tail_df):
+            logger.info('Tail model of the null distribution:\n{0}'.format(tail_df))
+            tail_df.to_csv(_utils.clf_result_dir + cfg_opts['null_tail_fit'], sep='\t')
+    else:
+        tail_models = None
 
     # use trained classifier if provided
     if cli_opts['trained_classifier']:
+        # re-use the null distribution of the same classifier and simulations
+        is_cacheable = (cli_opts['simulated'] and cli_opts.get('null_cache') and
+                        not cli_opts.get('importance'))
+        if is_cacheable:
+            cache_key = null_cache.cache_key(cli_opts['trained_classifier'], feature_path,
+                                             cli_opts['cv'],
+                                             cli_opts.get('prediction_mode', 'cv') == 'oob')
+            is_cached = null_cache.fetch_null(cli_opts['null_cache'], cache_key,
+                                              cli_opts['null_distribution'])
+            if is_cached:
+                logger.info('Using cached null distribution {0}'.format(cache_key))
+                null_cache.evict_cache(cli_opts)
+                logger.info('Finished classification.')
+                return
+
+        # out-of-bag votes are only kept in a forest trained without --cv
+        is_cv = cli_opts['cv']
+        is_oob = cli_opts.get('prediction_mode', 'cv') == 'oob'
+        if is_cv and is_oob:
+            raise ValueError('Out-of-bag prediction needs a classifier trained '
+                             'without the --cv option')
+
         # read in features
         df = pd.read_csv(feature_path, sep='\t', index_col=0)
 
@@ -177,17 +305,40 @@ def main(cli_opts):
                               other_sample_ratio=cli_opts['other_ratio'],
                               driver_sample=cli_opts['driver_rate'],
                               ntrees=cli_opts['ntrees'],
-                              seed=cli_opts['random_seed'])
+                              seed=cli_opts['random_seed'],
+                              processes=cli_opts.get('processes', 1),
+                              engine=cli_opts.get('engine', 'r'),
+                              r_worker=cli_opts.get('r_worker'),
+                              early_stop_tol=cli_opts.get('early_stop_tol'),
+                              tree_batch=cli_opts.get('tree_batch', 50),
+                              fold_plan=cli_opts.get('fold_plan'))
         # load classifier depending on whether it uses CV
-        is_cv = cli_opts['cv']
         if is_cv:
             rrclf.clf.load_cv(cli_opts['trained_classifier'])
         else:
             rrclf.clf.load(cli_opts['trained_classifier'])
 
+        # permutation importance is only computed when asked for
+        if cli_opts.get('importance'):
+            if not is_cv:
+                raise ValueError('Feature importance needs a classifier trained '
+                                 'with the --cv option')
+            imp_df = permutation_importance(rrclf, cli_opts['trained_classifier'],
+                                            feature_path)
+            imp_path = _utils.clf_result_dir + cfg_opts['permutation_importance']
+            imp_df.to_csv(imp_path, sep='\t')
+            try:
+                imp_plot_path = _utils.clf_plot_dir + cfg_opts['permutation_importance_plot']
+                plot_data.feature_importance_barplot(imp_df['mean decrease accuracy'],
+                                                     imp_df['std decrease accuracy'],
+                                                     imp_plot_path)
+            except:
+                pass
+
         if cli_opts['simulated']:
             # do classification
-            result_df = trained_rand_forest_pred(rrclf, df, None, null_pvals, is_cv)
+            result_df = trained_rand_forest_pred(rrclf, df, None, null_pvals,
+                                                 is_cv, is_oob)
 
             # driver scores
             driver_score_cts = result_df['driver score'].value_counts()
@@ -217,12 +368,29 @@ def main(cli_opts):
 
             score_pvals.to_csv(cli_opts['null_distribution'], sep='\t',
                                index_label='score')
+
+            # exact vote counts of the null distribution
+            null_hist = VoteHistogram.from_result(result_df)
+            hist_path = sidecar_path(cli_opts['null_distribution'])
+            if null_hist is not None:
+                null_hist.save(hist_path)
+            elif os.path.exists(hist_path):
+                # vote counts of a previous null distribution
+                os.remove(hist_path)
+
+            if is_cacheable:
+                null_cache.store_null(cli_opts['null_cache'], cache_key,
+                                      cli_opts['null_distribution'])
+                null_cache.evict_cache(cli_opts)
         else:
             # do classification
             pred_results_path = _utils.clf_result_dir + cfg_opts['rrand_forest_pred']
             logger.info('Saving results to {0}'.format(pred_results_path))
             result_df = trained_rand_forest_pred(rrclf, df, pred_results_path,
-                                                 null_pvals, is_cv)
+                                                 null_pvals, is_cv, is_oob,
+                                                 fdr_method=fdr_method,
+                                                 null_hist=null_hist,
+                                                 tail_models=tail_models)
             result_df.to_csv(pred_results_path, sep='\t')
 
             # create qq plot
@@ -239,15 +407,34 @@ def main(cli_opts):
 
     # R's random forest
     logger.info('Running Random forest . . .')
+    is_oob = cli_opts.get('prediction_mode', 'cv') == 'oob'
+    if is_oob:
+        # one (or a few) forests scored by their out-of-bag votes
+        total_iter = cli_opts.get('oob_forests', 1)
+    else:
+        total_iter = 5
     # initialize R's random forest
     rrclf = RRandomForest(df,
+                          total_iter=total_iter,
                           other_sample_ratio=cli_opts['other_ratio'],
                           driver_sample=cli_opts['driver_rate'],
                           ntrees=cli_opts['ntrees'],
-                          seed=cli_opts['random_seed'])
-
-    # analyze classification metrics
-    rrclf.kfold_validation()
+                          seed=cli_opts['random_seed'],
+                          processes=cli_opts.get('processes', 1),
+                          engine=cli_opts.get('engine', 'r'),
+                          r_worker=cli_opts.get('r_worker'),
+                          early_stop_tol=cli_opts.get('early_stop_tol'),
+                          tree_batch=cli_opts.get('tree_batch', 50),
+                          fold_plan=cli_opts.get('fold_plan'),
+                          checkpoint=cli_opts.get('checkpoint'),
+                          resume=cli_opts.get('resume', False))
+
+    # analyze classification metrics, and keep the held-out
+    # predictions so the forests do not need to be trained twice
+    if is_oob:
+        cv_prediction = rrclf.oob_validation()
+    else:
+        cv_prediction = rrclf.kfold_validation()
     rrclf_onco_tpr, rrclf_onco_fpr, rrclf_onco_mean_roc_auc = rrclf.get_onco_roc_metrics()
     rrclf_onco_precision, rrclf_onco_recall, rrclf_onco_mean_pr_auc = rrclf.get_onco_pr_metrics()
     rrclf_tsg_tpr, rrclf_tsg_fpr, rrclf_tsg_mean_roc_auc = rrclf.get_tsg_roc_metrics()
@@ -268,7 +455,9 @@ def main(cli_opts):
     # run predictions using R's random forest
     pred_results_path = _utils.clf_result_dir + cfg_opts['rrand_forest_pred']
     result_df = rand_forest_pred(rrclf, df, result_path=pred_results_path,
-                                 null_dist=null_pvals)
+                                 null_dist=null_pvals, prediction=cv_prediction,
+                                 fdr_method=fdr_method, null_hist=null_hist,
+                                 tail_models=tail_models)
 
     # save a list of oncogenes/tsgs in separate files
     if null_pvals is None:
@@ -316,19 +505,18 @@ def main(cli_opts):
                            title='Distribution of TSG Scores (sub-sampled random forest)')
         logger.info('Finished running sub-sampled Random Forest')
 
-        # dummy classifier, predict most frequent
-        logger.debug('Running Dummy Classifier. . .')
-        dclf = DummyClf(df,
-                        strategy='most_frequent',
-                        min_ct=minimum_ct,
-                        weight=False)
-        dclf.kfold_validation()
+        # expected performance of a dummy classifier
+        baseline = cli_opts.get('baseline', 'most_frequent')
+        dclf = BaselineMetrics(df, strategy=baseline)
+        label_df = dclf.get_label_metrics()
+        logger.info('Baseline ({0}) precision and recall of the predicted '
+                    'labels:\n{1}'.format(baseline, label_df.to_string()))
         dclf_onco_tpr, dclf_onco_fpr, dclf_onco_mean_roc_auc = dclf.get_onco_roc_metrics()
         dclf_onco_precision, dclf_onco_recall, dclf_onco_mean_pr_auc = dclf.get_onco_pr_metrics()
         dclf_tsg_tpr, dclf_tsg_fpr, dclf_tsg_mean_roc_auc = dclf.get_tsg_roc_metrics()
         dclf_tsg_precision, dclf_tsg_recall, dclf_tsg_mean_pr_auc = dclf.get_tsg_pr_metrics()
         dclf_driver_tpr, dclf_driver_fpr, dclf_driver_mean_roc_auc = dclf.get_driver_roc_metrics()
-        logger.debug('Finished dummy classifier.')
+        dclf_driver_precision, dclf_driver_recall, dclf_driver_mean_pr_auc = dclf.get_driver_pr_metrics()
 
         # plot oncogene roc figure
         rrandom_forest_str = '20/20+ Classifier (AUC = %0.3f)' % rrclf_onco_mean_roc_auc
@@ -378,7 +566,8 @@ def main(cli_opts):
         dummy_str = 'dummy (AUC = %0.3f)' % dclf_onco_mean_pr_auc
         rrclf_onco_mean_precision = np.mean(rrclf_onco_precision, axis=0)
         dclf_onco_mean_precision = np.mean(dclf_onco_precision, axis=0)
-        df = pd.DataFrame({rrandom_forest_str: rrclf_onco_mean_precision,},
+        df = pd.DataFrame({rrandom_forest_str: rrclf_onco_mean_precision,
+                           dummy_str: dclf_onco_mean_precision},
                           index=rrclf_onco_recall)
         line_style = {dummy_str: '--',
                       rrandom_forest_str: '-',
@@ -395,6 +584,7 @@ def main(cli_opts):
         dclf_tsg_mean_precision = np.mean(dclf_tsg_precision, axis=0)
         df = pd.DataFrame({
                         r_random_forest_str: rrclf_tsg_mean_precision,
+                        dummy_str: dclf_tsg_mean_precision,
                         },
                         index=rrclf_tsg_recall)
         line_style = {dummy_str: '--',
@@ -406,9 +596,12 @@ def main(cli_opts):
 
         # plot driver gene pr figure
         r_random_forest_str = '20/20+ Classifier (AUC = %0.3f)' % rrclf_driver_mean_pr_auc
+        dummy_str = 'dummy (AUC = %0.3f)' % dclf_driver_mean_pr_auc
         rrclf_driver_mean_precision = np.mean(rrclf_driver_precision, axis=0)
+        dclf_driver_mean_precision = np.mean(dclf_driver_precision, axis=0)
         df = pd.DataFrame({
                         r_random_forest_str: rrclf_driver_mean_precision,
+                        dummy_str: dclf_driver_mean_precision,
                         },
                         index=rrclf_driver_recall)
         line_style = {dummy_str: '--',
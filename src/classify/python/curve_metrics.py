@@ -0,0 +1,199 @@
+"""ROC and precision-recall metrics for all cross-validation iterations at once.
+
+The scores of each iteration are sorted only once. The cumulative counts of
+true and false positives along the sorted scores then give the ROC curve,
+the precision-recall curve with its thresholds, and the precision/recall
+at a score cutoff. Every function takes 2-D arrays with one row for each
+iteration, and gives the same curves as sklearn.metrics.roc_curve and
+precision_recall_curve interpolated with numpy.interp.
+"""
+import numpy as np
+
+
+class SortedScores(object):
+    """Scores of each iteration sorted in decreasing order, with the
+    cumulative number of true/false positives at each score.
+
+    Parameters
+    ----------
+    y_true : np.array
+        (iterations x genes) true binary labels
+    scores : np.array
+        (iterations x genes) predicted scores
+    """
+
+    def __init__(self, y_true, scores):
+        y_true = np.asarray(y_true, dtype=float)
+        scores = np.asarray(scores, dtype=float)
+        num_rows, num_genes = scores.shape
+        rows = np.arange(num_rows)[:, np.newaxis]
+
+        order = np.argsort(-scores, axis=1, kind='mergesort')
+        self.scores = scores[rows, order]
+        self.tps = np.cumsum(y_true[rows, order], axis=1)
+        self.fps = np.arange(1, num_genes+1) - self.tps
+        self.num_pos = self.tps[:, -1]
+        self.num_neg = self.fps[:, -1]
+
+        # a threshold includes every gene with a tied score, so each
+        # position takes the counts at the end of its group of ties
+        is_end = np.ones(self.scores.shape, dtype=bool)
+        is_end[:, :-1] = self.scores[:, :-1] != self.scores[:, 1:]
+        end_pos = np.where(is_end, np.arange(num_genes), num_genes)
+        end_pos = np.minimum.accumulate(end_pos[:, ::-1], axis=1)[:, ::-1]
+        self.tie_tps = self.tps[rows, end_pos]
+        self.tie_fps = self.fps[rows, end_pos]
+
+    def roc(self, fpr_grid):
+        """True positive rate at each false positive rate of the grid."""
+        zeros = np.zeros((len(self.tps), 1))
+        fpr = np.hstack([zeros, self.tie_fps / self.num_neg[:, np.newaxis]])
+        tpr = np.hstack([zeros, self.tie_tps / self.num_pos[:, np.newaxis]])
+        return interp_rows(fpr_grid, fpr, tpr)
+
+    def precision_recall(self, recall_grid):
+        """Precision and score threshold at each recall of the grid.
+
+        Returns
+        -------
+        precision : np.array
+            (iterations x grid) interpolated precision
+        threshold : np.array
+            (iterations x grid) interpolated score threshold
+        """
+        num_rows, num_genes = self.scores.shape
+        rows = np.arange(num_rows)[:, np.newaxis]
+        precision = self.tie_tps / (self.tie_tps + self.tie_fps)
+        recall = self.tie_tps / self.num_pos[:, np.newaxis]
+
+        # the curve stops at the first threshold with full recall
+        last_pos = np.argmax(self.tie_tps >= self.num_pos[:, np.newaxis], axis=1)
+        pos = np.minimum(np.arange(num_genes), last_pos[:, np.newaxis])
+        precision = precision[rows, pos]
+        recall = recall[rows, pos]
+        threshold = self.scores[rows, pos]
+
+        # the curve starts at zero recall with a precision of one
+        ones = np.ones((num_rows, 1))
+        recall = np.hstack([0 * ones, recall])
+        precision = np.hstack([ones, precision])
+        threshold = np.hstack([ones, threshold])
+        return (interp_rows(recall_grid, recall, precision),
+                interp_rows(recall_grid, recall, threshold))
+
+    def cutoff(self, cutoff=.5):
+        """Precision and recall of the genes scored above a cutoff.
+
+        Returns
+        -------
+        precision : np.array
+            precision for each iteration (0 if no gene is above the cutoff)
+        recall : np.array
+            recall for each iteration
+        num_above : np.array
+            number of genes above the cutoff for each iteration
+        """
+        num_above = np.sum(self.scores > cutoff, axis=1)
+        rows = np.arange(len(self.scores))
+        tp = np.where(num_above > 0, self.tps[rows, np.maximum(num_above-1, 0)], 0)
+        return (_safe_divide(tp, num_above),
+                _safe_divide(tp, self.num_pos),
+                num_above)
+
+
+def interp_rows(x, xp, fp):
+    """numpy.interp of the same x for every row of xp and fp.
+
+    Parameters
+    ----------
+    x : np.array
+        points to evaluate
+    xp : np.array
+        (rows x points) non-decreasing x-coordinates of each row
+    fp : np.array
+        (rows x points) y-coordinates of each row
+
+    Returns
+    -------
+    values : np.array
+        (rows x len(x)) interpolated values
+    """
+    x = np.asarray(x, dtype=float)
+    num_rows, num_points = xp.shape
+    rows = np.arange(num_rows)[:, np.newaxis]
+
+    # last point at or before each x (searchsorted is only 1-D)
+    lo = np.array([np.searchsorted(xp_row, x, side='right') - 1 for xp_row in xp])
+    lo = np.clip(lo, 0, num_points - 2)
+    hi = lo + 1
+    x_lo, x_hi = xp[rows, lo], xp[rows, hi]
+    y_lo, y_hi = fp[rows, lo], fp[rows, hi]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (y_hi - y_lo) / (x_hi - x_lo)
+        values = slope * (x - x_lo) + y_lo
+
+    # same handling of points on and outside the ends as numpy.interp
+    values = np.where(x == x_lo, y_lo, values)
+    values = np.where(x < xp[:, :1], fp[:, :1], values)
+    values = np.where(x >= xp[:, -1:], fp[:, -1:], values)
+    return values
+
+
+def binary_metrics(y_true, y_pred):
+    """Precision, recall and F1 score of the positive class (label 1).
+
+    Parameters
+    ----------
+    y_true : np.array
+        (iterations x genes) true binary labels
+    y_pred : np.array
+        (iterations x genes) predicted binary labels
+
+    Returns
+    -------
+    precision, recall, f1 : np.array
+        metric for each iteration
+    """
+    y_true = np.asarray(y_true) == 1
+    y_pred = np.asarray(y_pred) == 1
+    tp = np.sum(y_true & y_pred, axis=1)
+    precision = _safe_divide(tp, y_pred.sum(axis=1))
+    recall = _safe_divide(tp, y_true.sum(axis=1))
+    return precision, recall, _f1(precision, recall)
+
+
+def macro_metrics(y_true, y_pred, num_classes):
+    """Precision, recall and F1 score averaged over classes (same as
+    average='macro' in sklearn), for every iteration.
+
+    Only classes found in the true or predicted labels of an
+    iteration are averaged.
+    """
+    y_true = np.asarray(y_true).astype(int)
+    y_pred = np.asarray(y_pred).astype(int)
+    classes = np.arange(num_classes)[:, np.newaxis, np.newaxis]
+    is_true = y_true == classes
+    is_pred = y_pred == classes
+    tp = np.sum(is_true & is_pred, axis=2).T
+    num_true = is_true.sum(axis=2).T
+    num_pred = is_pred.sum(axis=2).T
+    precision = _safe_divide(tp, num_pred)
+    recall = _safe_divide(tp, num_true)
+    f1 = _f1(precision, recall)
+    is_present = (num_true + num_pred) > 0
+    num_present = is_present.sum(axis=1)
+    return ((precision * is_present).sum(axis=1) / num_present,
+            (recall * is_present).sum(axis=1) / num_present,
+            (f1 * is_present).sum(axis=1) / num_present)
+
+
+def _safe_divide(num, denom):
+    """Divide, giving zero where the denominator is zero."""
+    num = np.asarray(num, dtype=float)
+    denom = np.asarray(denom, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denom > 0, num / denom, 0.)
+
+
+def _f1(precision, recall):
+    return _safe_divide(2 * precision * recall, precision + recall)
@@ -1,6 +1,10 @@
 from sklearn.dummy import DummyClassifier
 from src.classify.python.generic_classifier import GenericClassifier
 import src.features.python.feature_utils as futils
+import src.utils.python.util as _utils
+import sklearn.metrics as metrics
+import numpy as np
+import pandas as pd
 import logging
 
 
@@ -22,3 +26,135 @@ class DummyClf(GenericClassifier):
 
         # setup classifier
         self.clf = DummyClassifier(strategy=strategy)
+
+
+class BaselineMetrics(object):
+    """Expected performance of a dummy classifier, computed from the class
+    prevalence instead of running cross-validation with DummyClf.
+
+    None of the dummy strategies rank genes by anything related to their
+    class, so the expected ROC curve is the diagonal and the expected
+    precision is the prevalence at every recall. The strategy only changes
+    the labels that are predicted:
+
+    * most_frequent: always the most frequent class
+    * stratified: a random class drawn with the class prevalence
+    * uniform: a random class, each with equal probability
+
+    The get methods return the same tuples as GenericClassifier, so the
+    baseline can be plotted alongside a cross-validated classifier.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        features of each gene (only the gene names are used)
+    strategy : str
+        most_frequent, stratified or uniform
+    num_points : int
+        number of points of the ROC and PR curves
+    """
+
+    strategies = ['most_frequent', 'stratified', 'uniform']
+    num_classes = 3  # oncogene, tsg and other
+
+    def __init__(self, df,
+                 strategy='most_frequent',
+                 num_points=100):
+        self.logger = logging.getLogger(__name__)
+        if strategy not in self.strategies:
+            raise ValueError('Unknown baseline strategy: {0}'.format(strategy))
+        self.strategy = strategy
+        self.y = df.index.to_series().apply(futils.label_gene)
+
+        # fraction of genes in each class
+        self.onco_prevalence = np.mean(self.y == _utils.onco_label)
+        self.tsg_prevalence = np.mean(self.y == _utils.tsg_label)
+        self.driver_prevalence = self.onco_prevalence + self.tsg_prevalence
+
+        # ROC and PR curves
+        self.fpr_array = np.linspace(0, 1, num_points)
+        self.recall_array = np.linspace(0, 1, num_points)
+        self.tpr_array = self.fpr_array[np.newaxis, :]
+        self.mean_roc_auc = float(metrics.auc(self.fpr_array, self.tpr_array[0]))
+
+        # metrics of the predicted labels
+        self.onco_precision, self.onco_recall = self._label_metrics(_utils.onco_label)
+        self.tsg_precision, self.tsg_recall = self._label_metrics(_utils.tsg_label)
+        self.driver_precision, self.driver_recall = self._label_metrics(None)
+
+    def _pr_metrics(self, prevalence):
+        """Expected precision at each recall (the prevalence)."""
+        precision = np.tile(prevalence, (1, len(self.recall_array)))
+        pr_auc = float(metrics.auc(self.recall_array, precision[0]))
+        return precision, self.recall_array, pr_auc
+
+    def _label_metrics(self, label):
+        """Expected precision and recall of the predicted labels for a class
+        (None for onco or tsg as a driver gene)."""
+        is_driver = label is None
+        if is_driver:
+            prevalence = self.driver_prevalence
+        else:
+            prevalence = np.mean(self.y == label)
+
+        # probability that a gene is predicted to be of the class
+        if self.strategy == 'most_frequent':
+            most_frequent = self.y.value_counts().idxmax()
+            if is_driver:
+                pred_prob = float(most_frequent != _utils.other_label)
+            else:
+                pred_prob = float(most_frequent == label)
+        elif self.strategy == 'stratified':
+            pred_prob = prevalence
+        else:
+            num_pred_classes = self.num_classes - 1 if is_driver else 1
+            pred_prob = num_pred_classes / float(self.num_classes)
+
+        # labels are predicted independently of the true class, so the
+        # precision is the prevalence whenever the class is predicted
+        precision = prevalence if pred_prob > 0 else 0.
+        return precision, pred_prob
+
+    def get_label_metrics(self):
+        """Expected precision and recall of the predicted labels.
+
+        Unlike the curves, these depend on the strategy.
+
+        Returns
+        -------
+        label_df : pd.DataFrame
+            precision and recall for the oncogene, tsg and driver classes
+        """
+        label_df = pd.DataFrame({'precision': [self.onco_precision,
+                                               self.tsg_precision,
+                                               self.driver_precision],
+                                 'recall': [self.onco_recall,
+                                            self.tsg_recall,
+                                            self.driver_recall]},
+                                index=['oncogene', 'tsg', 'driver'],
+                                columns=['precision', 'recall'])
+        return label_df
+
+    def get_onco_roc_metrics(self):
+        """Simple get method for oncogene ROC metrics."""
+        return self.tpr_array, self.fpr_array, self.mean_roc_auc
+
+    def get_tsg_roc_metrics(self):
+        """Simple get method for tumor supressor ROC metrics."""
+        return self.tpr_array, self.fpr_array, self.mean_roc_auc
+
+    def get_driver_roc_metrics(self):
+        """Simple get method for driver gene ROC metrics."""
+        return self.tpr_array, self.fpr_array, self.mean_roc_auc
+
+    def get_onco_pr_metrics(self):
+        """Simple get method for oncogene Precision-Recall metrics."""
+        return self._pr_metrics(self.onco_prevalence)
+
+    def get_tsg_pr_metrics(self):
+        """Simple get method for tumor supressor Precision-Recall metrics"""
+        return self._pr_metrics(self.tsg_prevalence)
+
+    def get_driver_pr_metrics(self):
+        """Simple get method for driver gene Precision-Recall metrics"""
+        return self._pr_metrics(self.driver_prevalence)
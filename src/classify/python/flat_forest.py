@@ -0,0 +1,380 @@
+"""Portable model format for trained random forests.
+
+Every tree is stored as flat node arrays (split feature, threshold,
+left/right child and leaf class), concatenated over all trees of all
+models and saved as an uncompressed numpy .npz file. A file holds
+either a single random forest (train) or all of the cross-validation
+forests (train --cv) together with the table of held-out genes
+(cvFoldDf). Neither R nor scikit-learn is needed to load a model or
+predict with it.
+
+Arrays in the .npz file:
+
+    feature_names : feature used by each split feature number
+    classes : class labels, indexed by leaf_class
+    split_feature, threshold, left, right, leaf_class : node arrays.
+        Genes go to the left child if feature <= threshold. Children are
+        node numbers within the tree, and -1 for leaves.
+    tree_offsets : first node of each tree (plus the total node count)
+    model_offsets : first tree of each model (plus the total tree count)
+    model_iter, model_fold : CV iteration and fold of each model (1-based)
+    float32_split : True if features are compared as float32 (scikit-learn)
+    cv_genes, cv_columns, cv_table : the cvFoldDf table, if any
+"""
+import numpy as np
+import pandas as pd
+import re
+
+_node_arrays = ['split_feature', 'threshold', 'left', 'right', 'leaf_class']
+
+
+def r_make_names(name):
+    """Column name after R's make.names (check.names in data.frame)."""
+    name = re.sub('[^0-9A-Za-z_.]', '.', name)
+    if not re.match(r'[A-Za-z]|\.(?![0-9])', name):
+        name = 'X' + name
+    return name
+
+
+def feature_matrix(x, feature_names, float32_split=False):
+    """Order (and cast) the columns of x as expected by split_feature.
+
+    Columns are matched by name, including the names mangled by R.
+    """
+    if isinstance(x, pd.DataFrame):
+        r_names = {r_make_names(c): c for c in x.columns}
+        cols = [c if c in x.columns else r_names[c]
+                for c in feature_names]
+        x = x[cols].values
+    dtype = np.float32 if float32_split else np.float64
+    return np.asarray(x, dtype=dtype)
+
+
+class FlatForest(object):
+    """Random forest stored as flat node arrays.
+
+    Has the same prediction methods as NativeRandomForest, so it can be
+    used by NativeClassifier.
+
+    Parameters
+    ----------
+    nodes : dict
+        node arrays (see module docstring)
+    tree_offsets : np.array
+        first node of each tree, followed by the number of nodes
+    classes : np.array
+        class labels
+    feature_names : list
+        name of each feature number used by split_feature
+    float32_split : bool
+        compare features as float32, like scikit-learn trees
+    """
+
+    def __init__(self, nodes, tree_offsets, classes, feature_names,
+                 float32_split=False):
+        for name in _node_arrays:
+            setattr(self, name, nodes[name])
+        self.tree_offsets = tree_offsets
+        self.classes_ = np.asarray(classes)
+        self.feature_names = list(feature_names)
+        self.float32_split = float32_split
+        self.ntrees = len(tree_offsets) - 1
+
+    def apply(self, x):
+        """Leaf reached in every tree.
+
+        Returns
+        -------
+        leaves : np.array
+            genes by trees array of (global) node numbers
+        """
+        x = feature_matrix(x, self.feature_names, self.float32_split)
+        rows = np.arange(len(x))
+        leaves = np.empty((len(x), self.ntrees), dtype=np.int64)
+        for t in range(self.ntrees):
+            offset = self.tree_offsets[t]
+            node = np.zeros(len(x), dtype=np.int64)
+            active = self.left[offset + node] >= 0
+            while active.any():
+                ix = offset + node[active]
+                go_left = x[rows[active], self.split_feature[ix]] <= self.threshold[ix]
+                node[active] = np.where(go_left, self.left[ix], self.right[ix])
+                active = self.left[offset + node] >= 0
+            leaves[:, t] = offset + node
+        return leaves
+
+    def predict_votes(self, x):
+        """Count the number of trees voting for each class."""
+        leaf_class = self.leaf_class[self.apply(x)]
+        votes = np.zeros((len(leaf_class), len(self.classes_)), dtype=int)
+        for c in range(len(self.classes_)):
+            votes[:, c] = (leaf_class == c).sum(axis=1)
+        return votes
+
+    def predict_proba(self, x):
+        """Fraction of trees voting for each class."""
+        return self.predict_votes(x) / float(self.ntrees)
+
+
+def concat_trees(trees):
+    """Concatenate the node arrays of several trees.
+
+    Parameters
+    ----------
+    trees : list of dict
+        node arrays of each tree
+
+    Returns
+    -------
+    nodes : dict
+        concatenated node arrays
+    tree_offsets : np.array
+        first node of each tree, followed by the number of nodes
+    """
+    sizes = [len(t['left']) for t in trees]
+    tree_offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    nodes = {}
+    for name in _node_arrays:
+        if trees:
+            nodes[name] = np.concatenate([t[name] for t in trees])
+        else:
+            nodes[name] = np.zeros(0)
+    nodes['threshold'] = nodes['threshold'].astype(np.float64)
+    for name in ['split_feature', 'left', 'right', 'leaf_class']:
+        nodes[name] = nodes[name].astype(np.int32)
+    return nodes, tree_offsets
+
+
+def sklearn_tree_nodes(tree, classes):
+    """Node arrays of a fitted scikit-learn DecisionTreeClassifier."""
+    t = tree.tree_
+    is_leaf = t.children_left < 0
+    # leaves predict the class with the largest (weighted) count
+    tree_class = tree.classes_[t.value[:, 0, :].argmax(axis=1)]
+    leaf_class = np.where(is_leaf, np.searchsorted(classes, tree_class), -1)
+    return {'split_feature': np.where(is_leaf, -1, t.feature),
+            'threshold': np.where(is_leaf, 0, t.threshold),
+            'left': t.children_left,
+            'right': t.children_right,
+            'leaf_class': leaf_class}
+
+
+def flat_arrays(forests, cv_folds=None):
+    """Concatenate the node arrays of several random forests.
+
+    Parameters
+    ----------
+    forests : list
+        (iteration, fold, FlatForest) for each model. Use 0 as iteration
+        and fold for a model trained on all of the data.
+    cv_folds : pd.DataFrame or None
+        table of which fold every gene was held-out in (cvFoldDf)
+
+    Returns
+    -------
+    arrays : dict
+        arrays of the .npz format (see module docstring)
+    """
+    first = forests[0][2]
+    trees = []
+    model_sizes = []
+    for num_iter, num_fold, forest in forests:
+        for t in range(forest.ntrees):
+            start, end = forest.tree_offsets[t], forest.tree_offsets[t+1]
+            trees.append({name: getattr(forest, name)[start:end]
+                          for name in _node_arrays})
+        model_sizes.append(forest.ntrees)
+    nodes, tree_offsets = concat_trees(trees)
+    model_offsets = np.concatenate([[0], np.cumsum(model_sizes)]).astype(np.int64)
+
+    arrays = dict(nodes)
+    arrays['tree_offsets'] = tree_offsets
+    arrays['model_offsets'] = model_offsets
+    arrays['model_iter'] = np.array([f[0] for f in forests], dtype=np.int32)
+    arrays['model_fold'] = np.array([f[1] for f in forests], dtype=np.int32)
+    arrays['classes'] = np.asarray(first.classes_)
+    arrays['feature_names'] = np.array(first.feature_names, dtype='U')
+    arrays['float32_split'] = np.array(first.float32_split)
+    if cv_folds is not None:
+        arrays['cv_genes'] = np.array(cv_folds.index, dtype='U')
+        arrays['cv_columns'] = np.array(cv_folds.columns, dtype='U')
+        arrays['cv_table'] = np.asarray(cv_folds.values, dtype=np.int32)
+    return arrays
+
+
+def save_flat(path, forests, cv_folds=None):
+    """Save random forests in the flat array format.
+
+    Parameters
+    ----------
+    path : str
+        path of the .npz file
+    forests : list
+        (iteration, fold, FlatForest) for each model. Use 0 as iteration
+        and fold for a model trained on all of the data.
+    cv_folds : pd.DataFrame or None
+        table of which fold every gene was held-out in (cvFoldDf)
+    """
+    arrays = flat_arrays(forests, cv_folds)
+    with open(path, 'wb') as handle:
+        np.savez(handle, **arrays)
+
+
+class FlatModelFile(object):
+    """Random forests loaded from the flat array format (see save_flat).
+
+    Parameters
+    ----------
+    path : str or None
+        path of the .npz file
+    arrays : dict or None
+        arrays from flat_arrays, if not loading from a file
+    """
+
+    def __init__(self, path=None, arrays=None):
+        if path is not None:
+            with np.load(path, allow_pickle=False) as saved:
+                arrays = {k: saved[k] for k in saved.files}
+        self.nodes = {name: arrays[name] for name in _node_arrays}
+        self.tree_offsets = arrays['tree_offsets']
+        self.model_offsets = arrays['model_offsets']
+        self.model_iter = arrays['model_iter']
+        self.model_fold = arrays['model_fold']
+        self.classes = arrays['classes']
+        self.feature_names = [str(f) for f in arrays['feature_names']]
+        self.float32_split = bool(arrays['float32_split'])
+        if 'cv_table' in arrays:
+            self.cv_folds = pd.DataFrame(arrays['cv_table'],
+                                         index=[str(g) for g in arrays['cv_genes']],
+                                         columns=[str(c) for c in arrays['cv_columns']])
+        else:
+            self.cv_folds = None
+
+    @classmethod
+    def from_forests(cls, forests, cv_folds=None):
+        """Combine random forests already in memory (see flat_arrays)."""
+        return cls(arrays=flat_arrays(forests, cv_folds))
+
+    @property
+    def num_models(self):
+        return len(self.model_offsets) - 1
+
+    def forest(self, model_num):
+        """Get the FlatForest of a model, by its position in the file."""
+        first_tree = self.model_offsets[model_num]
+        last_tree = self.model_offsets[model_num+1]
+        start = self.tree_offsets[first_tree]
+        end = self.tree_offsets[last_tree]
+        nodes = {name: self.nodes[name][start:end] for name in _node_arrays}
+        tree_offsets = self.tree_offsets[first_tree:last_tree+1] - start
+        return FlatForest(nodes, tree_offsets, self.classes,
+                          self.feature_names, self.float32_split)
+
+    def cv_forests(self):
+        """Nested list of forests indexed by [iteration-1][fold-1]."""
+        num_iter = self.model_iter.max()
+        forests = [[] for i in range(num_iter)]
+        order = np.lexsort((self.model_fold, self.model_iter))
+        for model_num in order:
+            forests[self.model_iter[model_num]-1].append(self.forest(model_num))
+        return forests
+
+    def predict_proba_cv(self, x, num_iter, max_pairs=2**22, return_votes=False):
+        """Gene hold-out cross-validated class probabilities.
+
+        Each gene is evaluated only by the trees of the model for which
+        it was held-out, in every iteration. Genes not found in the CV
+        fold table were never trained on, and use the first fold. All
+        (gene, tree) pairs are descended through their trees together,
+        in chunks of genes holding at most max_pairs pairs.
+
+        Parameters
+        ----------
+        x : pd.DataFrame
+            features of the genes to score
+        num_iter : int
+            number of cross-validation iterations
+        max_pairs : int
+            limit on the number of (gene, tree) pairs evaluated at once
+        return_votes : bool
+            also return the number of tree votes
+
+        Returns
+        -------
+        proba : np.array
+            genes by classes fraction of tree votes, averaged over iterations
+        votes : np.array
+            genes by classes number of tree votes, summed over iterations
+            (only if return_votes)
+        """
+        xmat = feature_matrix(x, self.feature_names, self.float32_split)
+        num_genes = len(xmat)
+        num_classes = len(self.classes)
+
+        # fold each gene was held-out in, for every iteration
+        folds = np.ones((num_genes, num_iter), dtype=np.int64)
+        if self.cv_folds is not None:
+            cols = ['X{0}'.format(i+1) for i in range(num_iter)]
+            row = self.cv_folds.index.get_indexer(x.index)
+            is_cv = row >= 0
+            folds[is_cv] = self.cv_folds[cols].values[row[is_cv]]
+
+        # model number of each (gene, iteration)
+        model_num = np.full((self.model_iter.max()+1, self.model_fold.max()+1), -1,
+                            dtype=np.int64)
+        model_num[self.model_iter, self.model_fold] = np.arange(self.num_models)
+        gene_models = model_num[np.arange(1, num_iter+1), folds]
+        if (gene_models < 0).any():
+            raise ValueError('Missing cross-validation model for some genes')
+        model_ntrees = np.diff(self.model_offsets)
+
+        proba = np.zeros((num_genes, num_classes))
+        votes = np.zeros((num_genes, num_classes), dtype=np.int64)
+        pairs_per_gene = model_ntrees[gene_models].sum(axis=1)
+        chunk_genes = max(1, max_pairs // max(1, pairs_per_gene.max()))
+        for start in range(0, num_genes, chunk_genes):
+            end = min(start + chunk_genes, num_genes)
+            proba[start:end], votes[start:end] = self._chunk_proba(
+                xmat, np.arange(start, end), gene_models[start:end], model_ntrees)
+        if return_votes:
+            return proba / num_iter, votes
+        return proba / num_iter
+
+    def _chunk_proba(self, xmat, genes, gene_models, model_ntrees):
+        """Sum of vote fractions and number of votes over iterations
+        for a chunk of genes."""
+        num_classes = len(self.classes)
+
+        # expand (gene, model) into (gene, tree) pairs
+        models = gene_models.ravel()
+        pair_gene = np.repeat(np.repeat(genes, gene_models.shape[1]),
+                              model_ntrees[models])
+        ntrees = model_ntrees[models]
+        first_pair = np.cumsum(ntrees) - ntrees
+        pair_tree = (np.arange(ntrees.sum()) -
+                     np.repeat(first_pair - self.model_offsets[models], ntrees))
+        pair_weight = 1. / np.repeat(ntrees, ntrees)
+
+        # descend every pair through its tree
+        split_feature = self.nodes['split_feature']
+        threshold = self.nodes['threshold']
+        left = self.nodes['left']
+        right = self.nodes['right']
+        root = self.tree_offsets[pair_tree]
+        node = root.copy()
+        active = np.nonzero(left[node] >= 0)[0]
+        while len(active):
+            nd = node[active]
+            go_left = xmat[pair_gene[active], split_feature[nd]] <= threshold[nd]
+            nd = root[active] + np.where(go_left, left[nd], right[nd])
+            node[active] = nd
+            active = active[left[nd] >= 0]
+
+        # fraction of tree votes for each class
+        pair_class = self.nodes['leaf_class'][node]
+        gene_class = (pair_gene - genes[0]) * num_classes + pair_class
+        size = len(genes) * num_classes
+        frac = np.bincount(gene_class, weights=pair_weight, minlength=size)
+        votes = np.bincount(gene_class, minlength=size)
+        return (frac.reshape(len(genes), num_classes),
+                votes.reshape(len(genes), num_classes))
@@ -0,0 +1,130 @@
+"""Precomputed randomizations and folds of repeated cross-validation.
+
+A FoldPlan holds, for every cross-validation iteration, the random order
+of the genes and the fold of each position as NumPy integer arrays. The
+training and held-out genes of a fold are given as row numbers of the
+(unshuffled) feature matrix, so cross-validation loops slice the data by
+position instead of re-sorting DataFrames and looking up gene names.
+"""
+import src.utils.python.seeds as seeds
+from sklearn import cross_validation
+import numpy as np
+import pandas as pd
+
+
+class FoldPlan(object):
+    """Randomizations, folds and seeds of every cross-validation iteration.
+
+    Parameters
+    ----------
+    genes : np.array
+        gene names, in the row order of the feature matrix
+    labels : np.array
+        true class of each gene
+    permutations : np.array
+        (iterations x genes) random order of the rows in each iteration
+    fold_pos : np.array
+        (iterations x genes) fold (starting from 0) of each position
+        of the randomized rows
+    fold_seeds : np.array
+        (iterations x folds) seed of the classifier for each fold
+    master_seed : int or None
+        seed from which the randomizations and fold seeds were derived
+    """
+
+    def __init__(self, genes, labels, permutations, fold_pos, fold_seeds,
+                 master_seed=None):
+        self.genes = np.asarray(genes)
+        self.labels = np.asarray(labels)
+        self.permutations = np.asarray(permutations, dtype=np.int64)
+        self.fold_pos = np.asarray(fold_pos, dtype=np.int32)
+        self.fold_seeds = np.asarray(fold_seeds, dtype=np.int64)
+        self.master_seed = master_seed
+        self.num_iter, self.num_genes = self.permutations.shape
+        self.num_folds = self.fold_seeds.shape[1]
+
+        # row numbers of the training/held-out genes of each fold. Rows
+        # keep the order of the randomized data.
+        self.train_rows = []
+        self.test_rows = []
+        for perm, pos in zip(self.permutations, self.fold_pos):
+            self.train_rows.append([perm[pos != j] for j in range(self.num_folds)])
+            self.test_rows.append([perm[pos == j] for j in range(self.num_folds)])
+
+    @classmethod
+    def build(cls, genes, labels, num_iter, k, master_seed):
+        """Randomize the genes and split them into stratified folds.
+
+        Parameters
+        ----------
+        genes : array-like
+            gene names, in the row order of the feature matrix
+        labels : array-like
+            true class of each gene
+        num_iter : int
+            number of cross-validation iterations
+        k : int
+            number of folds
+        master_seed : int
+            seed from which each randomization and fold seed is derived
+        """
+        labels = np.asarray(labels)
+        num_genes = len(labels)
+        permutations = np.zeros((num_iter, num_genes), dtype=np.int64)
+        fold_pos = np.zeros((num_iter, num_genes), dtype=np.int32)
+        fold_seeds = np.zeros((num_iter, k), dtype=np.int64)
+        for i in range(num_iter):
+            prng = seeds.derive_prng(master_seed, 'randomize', i)
+            permutations[i] = prng.permutation(num_genes)
+            k_fold = cross_validation.StratifiedKFold(labels[permutations[i]],
+                                                      n_folds=k)
+            for nfold, (train_ix, test_ix) in enumerate(k_fold):
+                fold_pos[i, test_ix] = nfold
+                fold_seeds[i, nfold] = seeds.derive_seed(master_seed, 'fold', i, nfold)
+        return cls(genes, labels, permutations, fold_pos, fold_seeds, master_seed)
+
+    def folds(self, num_iter):
+        """(train rows, held-out rows) of each fold of an iteration."""
+        return list(zip(self.train_rows[num_iter], self.test_rows[num_iter]))
+
+    def cv_folds(self):
+        """Fold (starting from 1) in which each gene was held-out.
+
+        Returns
+        -------
+        cv_folds : pd.DataFrame
+            genes by iterations (columns 1, 2, ...)
+        """
+        folds = np.zeros((self.num_genes, self.num_iter), dtype=int)
+        for i, (perm, pos) in enumerate(zip(self.permutations, self.fold_pos)):
+            folds[perm, i] = pos + 1
+        return pd.DataFrame(folds, index=self.genes,
+                            columns=range(1, self.num_iter+1))
+
+    def matches(self, genes, labels, num_iter, k, master_seed):
+        """Check if the plan was made for these genes, labels and settings."""
+        return (self.num_iter == num_iter and self.num_folds == k and
+                self.master_seed is not None and
+                int(self.master_seed) == int(master_seed) and
+                np.array_equal(self.genes, np.asarray(genes)) and
+                np.array_equal(self.labels, np.asarray(labels)))
+
+    def save(self, path):
+        """Save the plan as a .npz file."""
+        np.savez(path,
+                 genes=np.array(self.genes, dtype='U'),
+                 labels=self.labels,
+                 permutations=self.permutations,
+                 fold_pos=self.fold_pos,
+                 fold_seeds=self.fold_seeds,
+                 master_seed=-1 if self.master_seed is None else self.master_seed)
+
+    @classmethod
+    def load(cls, path):
+        """Load a plan saved by save."""
+        with np.load(path) as arrays:
+            master_seed = None
+            if 'master_seed' in arrays.files and int(arrays['master_seed']) >= 0:
+                master_seed = int(arrays['master_seed'])
+            return cls(arrays['genes'], arrays['labels'], arrays['permutations'],
+                       arrays['fold_pos'], arrays['fold_seeds'], master_seed)
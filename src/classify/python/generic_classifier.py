@@ -2,13 +2,32 @@
 of the classifier predictions."""
 
 import src.utils.python.util as _utils
+import src.utils.python.seeds as seeds
 import src.utils.python.math as mymath
 import src.features.python.feature_utils as futils
+import src.classify.python.model_shards as model_shards
+import src.classify.python.curve_metrics as curve_metrics
+import src.classify.python.checkpoint as checkpoint
+from src.classify.python.fold_plan import FoldPlan
 import numpy as np
-from numpy import interp
-from sklearn import cross_validation
 import sklearn.metrics as metrics
 import pandas as pd
+from multiprocessing import Pool
+import tempfile
+import shutil
+import os
+
+# classifier whose cross-validation folds are currently being evaluated
+# by a pool of worker processes. It is set before the pool is created so
+# that the forked workers inherit it (including a copy of the R session).
+_fold_clf = None
+
+
+@_utils.log_error_decorator
+def _fold_worker(task):
+    """Evaluate a single cross-validation fold inside a worker process."""
+    method, args = task
+    return getattr(_fold_clf, method)(*args)
 
 
 class GenericClassifier(object):
@@ -20,9 +39,20 @@ class GenericClassifier(object):
                  rseed=None):
         self.min_count = 0  # min mutations for a gene
 
-        # set the the state of the prng
-        self.prng = np.random.RandomState(rseed)
-        self.rseed = rseed
+        # set the the state of the prng. Randomizations and folds use
+        # their own streams derived from the master seed (see seeds)
+        self.rseed = seeds.master_seed(rseed)
+        self.prng = np.random.RandomState(self.rseed)
+        self.engine = None  # name of the classifier's engine, e.g. 'r' or 'native'
+        self.num_processes = 1  # number of processes for cv folds
+        self.send_data_once = False  # fit folds by row number (see _send_data)
+        self.data_sent = False
+        self.fold_plan_path = None  # reuse folds saved by a previous run
+        self.checkpoint_dir = None  # save each finished fold (see checkpoint)
+        self.resume = False
+        self.early_stop_tol = None  # grow forests until scores converge
+        self.prediction_df = None  # scores and vote counts of the last prediction
+        self.tree_batch = 50
 
         # set integer codes for classes
         self.set_classes(oncogene=classify_oncogene, tsg=classify_tsg)
@@ -38,6 +68,66 @@ class GenericClassifier(object):
     def set_total_iter(self, myiterations):
         self.total_iter = myiterations
 
+    def set_num_processes(self, num_processes):
+        """Set the number of processes used to evaluate cross-validation folds."""
+        self.num_processes = max(1, num_processes)
+
+    def set_early_stopping(self, tol, tree_batch=50):
+        """Grow the forest of each cross-validation fold in batches of trees,
+        until the driver scores of the held-out genes change by less than tol.
+
+        The number of trees of the classifier becomes the maximum.
+
+        Parameters
+        ----------
+        tol : float or None
+            largest change in driver score to stop adding trees.
+            Early stopping is disabled if None.
+        tree_batch : int
+            number of trees added at a time
+        """
+        self.early_stop_tol = tol
+        self.tree_batch = max(1, tree_batch)
+
+    def set_checkpoint(self, checkpoint_dir, resume=False):
+        """Save the result of every finished cross-validation fold to a
+        checkpoint directory (see checkpoint).
+
+        Parameters
+        ----------
+        checkpoint_dir : str or None
+            checkpoint directory. Checkpoints are disabled if None.
+        resume : bool
+            load the folds already saved in the checkpoint directory,
+            instead of running them again
+        """
+        if resume and checkpoint_dir is None:
+            raise ValueError('Resuming needs a checkpoint directory')
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        if checkpoint_dir is not None and not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+
+    def _randomize(self, *keys):
+        """Randomly order the genes with the random stream of the keys.
+
+        The genes are first sorted, so the order does not depend on
+        previous randomizations.
+        """
+        self._sort_genes()
+        prng = seeds.derive_prng(self.rseed, 'randomize', *keys)
+        order = prng.permutation(len(self.x))
+        self.x, self.y = self.x.iloc[order], self.y.iloc[order]
+        return order
+
+    def _sort_genes(self):
+        """Sort the genes by name, with their true class labels."""
+        if not self.y.index.equals(self.x.index):
+            self.y = self.x.index.to_series().apply(futils.label_gene)
+        if not self.x.index.is_monotonic_increasing:
+            order = np.argsort(self.x.index.values, kind='mergesort')
+            self.x, self.y = self.x.iloc[order], self.y.iloc[order]
+
     def _filter_rows(self, df):
         """Filter out rows with counts less than the minimum."""
         row_sums = df.T.sum()
@@ -46,57 +136,78 @@ class GenericClassifier(object):
 
     def train(self):
         """Train classifier on entire data set provided."""
-        self.x, self.y = futils.randomize(self.x, self.prng)
+        self._randomize('train')
         futils.check_num_classes(self.y) # warn user if not 3 classes
+        if hasattr(self.clf, 'set_seed'):
+            self.clf.set_seed(seeds.derive_seed(self.rseed, 'train'))
         self.clf.fit(self.x, self.y)
 
-    def train_cv(self, k=10):
-        """Train classifier on entire data set provided, but done in cross-validation."""
+    def train_cv(self, k=10, model_dir=None):
+        """Train classifier on entire data set provided, but done in cross-validation.
+
+        Parameters
+        ----------
+        k : int
+            number of cross-validation folds
+        model_dir : str or None
+            if given, the model of each fold is written to this directory
+            as soon as it is trained (see model_shards), instead of keeping
+            all models in memory until they are saved.
+        """
         # generate indices for kfold cross validation
         self.num_pred = 0  # number of predictions
-        self.test_fold_df = pd.DataFrame({l+1: 0 for l in range(self.total_iter)}, index=self.x.index)
-
-        for i in range(self.total_iter):
-            # randomize for another round
-            self.x, self.y = futils.randomize(self.x, self.prng)
-            futils.check_num_classes(self.y) # warn user if not 3 classes
-
-            # set up stratified kfold iterator
-            k_fold = cross_validation.StratifiedKFold(self.y,
-                                                      n_folds=k)
-
-            # obtain predictions from single round of kfold validation
-            for nfold, (train_ix, test_ix) in enumerate(k_fold):
-                # retreive indices from pandas dataframe using row number
-                tmp_train_ix = self.x.iloc[train_ix].index
-
-                # save which genes are in the test fold
-                tmp_test_ix = self.x.iloc[test_ix].index
-                self.test_fold_df.loc[tmp_test_ix, i+1] = nfold + 1
-
-                if self.is_weighted_sample:
-                    # figure out sample weights
-                    num_train = len(train_ix)
-                    sample_weight = np.zeros(num_train)
-                    onco_ix = np.nonzero(self.y.ix[tmp_train_ix]==self.onco_num)[0]
-                    tsg_ix = np.nonzero(self.y.ix[tmp_train_ix]==self.tsg_num)[0]
-                    other_ix = np.nonzero(self.y.ix[tmp_train_ix]==self.other_num)[0]
-                    sample_weight[onco_ix] = 1. / len(onco_ix)
-                    sample_weight[tsg_ix] = 1. / len(tsg_ix)
-                    sample_weight[other_ix] = 1. / len(other_ix)
-
-                    # do training with sample weighting
-                    self.clf.fit(self.x.ix[tmp_train_ix].copy(),
-                                 self.y.ix[tmp_train_ix].copy(),
-                                 sample_weight=sample_weight)
+        plan = self._fold_plan(k)
+        self.test_fold_df = plan.cv_folds()  # which genes are in each test fold
+
+        # trained models are passed back from worker processes as files,
+        # and are kept with the checkpoint so that resumed runs can load them
+        is_parallel = self.num_processes > 1
+        is_sharded = model_dir is not None
+        tmp_dir = None
+        if is_sharded:
+            fold_dir = model_dir
+        elif self.checkpoint_dir is not None:
+            fold_dir = os.path.join(self.checkpoint_dir, checkpoint.MODEL_DIR)
+            if not os.path.isdir(fold_dir):
+                os.makedirs(fold_dir)
+        elif is_parallel:
+            tmp_dir = fold_dir = tempfile.mkdtemp()
+        else:
+            fold_dir = None
+
+        # set up the cross-validation folds
+        tasks = []
+        shards = []
+        for i in range(plan.num_iter):
+            for nfold, (train_ix, test_ix) in enumerate(plan.folds(i)):
+                if fold_dir is not None:
+                    shard = model_shards.shard_name(i+1, nfold+1, self.clf.fold_ext)
+                    shards.append((i+1, nfold+1, shard))
+                    model_path = os.path.join(fold_dir, shard)
                 else:
-                    # do training without weighting
-                    self.clf.fit(self.x.ix[tmp_train_ix].copy(),
-                                 self.y.ix[tmp_train_ix].copy())
+                    model_path = None
+                tasks.append((i, nfold, int(plan.fold_seeds[i, nfold]),
+                              train_ix, test_ix, model_path, False))
+
+        try:
+            # train each fold, keeping the models in cross-validation order
+            results = self._run_checkpointed(tasks, 'train')
+            for task_num, result in enumerate(results):
+                if is_sharded:
+                    # model is already saved to the model directory
+                    continue
+                if fold_dir is not None:
+                    self.clf.load_fold(tasks[task_num][5])
                 self.clf.append_fold_result()  # add the training result from each fold
-            self.clf.append_cv_result()  # add the training result for a single CV to the R variable
-
-            self.num_pred += 1
+                if (task_num + 1) % k == 0:
+                    self.clf.append_cv_result()  # add the training result for a single CV to the R variable
+                    self.num_pred += 1
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        if is_sharded:
+            model_shards.write_manifest(model_dir, shards, self.test_fold_df)
+            self.num_pred = plan.num_iter
         self.clf.set_cv_fold(self.test_fold_df)
 
     def predict(self):
@@ -104,17 +215,13 @@ class GenericClassifier(object):
         self.num_pred = 1  # only one prediction
 
         # initialize predicted results variables
-        num_genes = len(self.y)
+        self._init_predictions()
 
         # do predictions
         proba_ = self.clf.predict_proba(self.x)
+        self._add_predictions(slice(None), proba_, self._num_trees())
 
-        # update information
-        onco_prob = proba_[:, self.onco_num] # predicted oncogenes
-        tsg_prob = proba_[:, self.tsg_num] # predicted oncogenes
-        other_prob = 1 - (onco_prob + tsg_prob)
-
-        return onco_prob, tsg_prob, other_prob
+        return self._prediction_result()
 
     def predict_cv(self, k=10):
         """Predict after using the gene hold-out cross-validated train method."""
@@ -122,101 +229,101 @@ class GenericClassifier(object):
         self.num_pred = 0  # number of predictions
 
         # initialize variables for prediction results
-        prediction = pd.Series(index=self.x.index)  # predicted class
-        onco_prob = pd.Series(index=self.x.index).fillna(0)
-        tsg_prob = pd.Series(index=self.x.index).fillna(0)
-
-        # figure out which genes may have not been trained on before
-        new_genes = self.x.index.difference(self.clf.cv_folds.index)
+        self._init_predictions()
+
+        if hasattr(self.clf, 'predict_proba_cv'):
+            # the classifier evaluates every fold's model in one pass
+            proba_, votes = self.clf.predict_proba_cv(self.x, self.total_iter,
+                                                      return_votes=True)
+            self.num_pred = self.total_iter
+            self.sum_proba += proba_ * self.total_iter
+            self.vote_counts += votes
+            self.num_predictions += self.total_iter
+            return self._prediction_result()
+
+        # fold of each gene (NaN for genes never found in training data)
+        cv_folds = self.clf.cv_folds
+        gene_rows = cv_folds.index.get_indexer(self.x.index)
+        is_new = gene_rows < 0
+        new_rows = np.nonzero(is_new)[0]
 
         # perform total_iter number of cross-validations
         for i in range(self.total_iter):
             # predict on genes never found in training data, so there
             # is no worry about overfitting.
-            test_feat = self.x.ix[new_genes]
-            if not test_feat.empty:
+            if len(new_rows):
                 self.clf.set_model(i+1, 1)
-                tmp_prob = self.clf.predict_proba(test_feat)
-                onco_prob.ix[new_genes] += tmp_prob[:, self.onco_num]
-                tsg_prob.ix[new_genes] += tmp_prob[:, self.tsg_num]
+                tmp_prob = self.clf.predict_proba(self.x.iloc[new_rows])
+                self._add_predictions(new_rows, tmp_prob, self._num_trees())
 
             # obtain predictions from single round of kfold validation
             col = 'X{0}'.format(i+1)
+            gene_fold = np.where(is_new, 0, np.asarray(cv_folds[col])[gene_rows])
             for j in range(k):
-                self.clf.set_model(i+1, j+1)
                 # figure out which genes should be tested
-                good_ix = self.clf.cv_folds[self.clf.cv_folds[col]==j+1].index
-                tmp_test_ix = self.x.index.intersection(good_ix)
+                test_rows = np.nonzero(gene_fold == j+1)[0]
 
                 # predict test data in kfold validation
-                test_feat = self.x.ix[tmp_test_ix]
-                if not test_feat.empty:
-                    tmp_prob = self.clf.predict_proba(test_feat)
-                    onco_prob.ix[tmp_test_ix] += tmp_prob[:, self.onco_num]
-                    tsg_prob.ix[tmp_test_ix] += tmp_prob[:, self.tsg_num]
+                if len(test_rows):
+                    self.clf.set_model(i+1, j+1)
+                    tmp_prob = self.clf.predict_proba(self.x.iloc[test_rows])
+                    self._add_predictions(test_rows, tmp_prob, self._num_trees())
 
             self.num_pred += 1
 
         # convert number of trees to fraction of trees
-        onco_prob /= self.num_pred
-        tsg_prob /= self.num_pred
-        other_prob = 1 - (onco_prob + tsg_prob)
-
-        # return prediction.astype(int), prob
-        return onco_prob, tsg_prob, other_prob
+        return self._prediction_result()
 
     def kfold_validation(self, k=10):
         """Records the performance in terms of ROC and PR AUC for cross-validation.
 
+        The random forest of each fold is only trained once, so the held-out
+        predictions used for the performance metrics are also returned
+        as the cross-validated gene scores (same as kfold_prediction).
+
         Params
         ------
         k : int (10)
             Number of cross-validation folds
+
+        Returns
+        -------
+        onco_prob : pd.Series
+            mean held-out oncogene score
+        tsg_prob : pd.Series
+            mean held-out tsg score
+        other_prob : pd.Series
+            mean held-out score for "other" genes
         """
         self.num_pred = 0  # number of predictions
+        self._init_metrics()  # start over if validated before
+        plan = self._fold_plan(k)
 
-        for i in range(self.total_iter):
-            # randomize for another round
-            self.x, self.y = futils.randomize(self.x, self.prng)
-            futils.check_num_classes(self.y) # warn user if not 3 classes
+        # held-out scores averaged over all iterations
+        num_genes = len(self.y)
+        self._init_predictions()
+
+        # set up the cross-validation folds
+        tasks = []
+        for i in range(plan.num_iter):
+            for nfold, (train_ix, test_ix) in enumerate(plan.folds(i)):
+                tasks.append((i, nfold, int(plan.fold_seeds[i, nfold]),
+                              train_ix, test_ix, None, True, True))
+        results = self._run_checkpointed(tasks, 'validation')
 
+        for i in range(plan.num_iter):
             # initialize predicted results variables
-            num_genes = len(self.y)
             onco_pred = np.zeros(num_genes)
             onco_prob = np.zeros(num_genes)
             tsg_pred = np.zeros(num_genes)
             tsg_prob = np.zeros(num_genes)
             overall_pred = np.zeros(num_genes)
 
-            # set up stratified kfold iterator
-            k_fold = cross_validation.StratifiedKFold(self.y,
-                                                      n_folds=k)
-
             # evaluate k-fold cross validation
-            for train_ix, test_ix in k_fold:
-                if self.is_weighted_sample:
-                    # weight classes by using sample weights
-                    num_train = len(train_ix)
-                    sample_weight = np.zeros(num_train)
-                    onco_ix = np.nonzero(self.y[train_ix]==self.onco_num)[0]
-                    tsg_ix = np.nonzero(self.y[train_ix]==self.tsg_num)[0]
-                    other_ix = np.nonzero(self.y[train_ix]==self.other_num)[0]
-                    sample_weight[onco_ix] = 1. / len(onco_ix)
-                    sample_weight[tsg_ix] = 1. / len(tsg_ix)
-                    sample_weight[other_ix] = 1. / len(other_ix)
-
-                    # do training
-                    self.clf.fit(self.x.iloc[train_ix].copy(),
-                                 self.y.iloc[train_ix].copy(),
-                                 sample_weight=sample_weight)
-                else:
-                    # do training without sample weights
-                    self.clf.fit(self.x.iloc[train_ix].copy(),
-                                 self.y.iloc[train_ix].copy())
-
-                # do prediction
-                y_pred = self.clf.predict(self.x.iloc[test_ix])
-                proba_ = self.clf.predict_proba(self.x.iloc[test_ix])
+            for train_ix, test_ix in plan.folds(i):
+                proba_, importance, num_trees = next(results)
+                self._add_predictions(test_ix, proba_, num_trees)
+                y_pred = proba_.argmax(axis=1)  # majority vote
 
                 # update information
                 overall_pred[test_ix] = y_pred  # prediction including all classes
@@ -225,80 +332,617 @@ class GenericClassifier(object):
                 tsg_pred[test_ix] = (y_pred==self.tsg_num).astype(int)  # predicted oncogenes
                 tsg_prob[test_ix] = proba_[:, self.tsg_num] # predicted oncogenes
 
+            # feature importance is recorded from the last fold
+            if importance is not None:
+                self.clf.feature_importances_ = importance
+
             # update information
-            true_onco = (self.y==self.onco_num).astype(int)
-            self._update_onco_metrics(true_onco,
-                                      onco_pred,
-                                      onco_prob)
-            true_tsg = (self.y==self.tsg_num).astype(int)  # true oncogenes
-            self._update_tsg_metrics(true_tsg,
-                                     tsg_pred,
-                                     tsg_prob)
-            self._update_metrics(self.y,
-                                 overall_pred,
-                                 onco_prob,
-                                 tsg_prob)
+            self._update_iteration_metrics(overall_pred, onco_pred, onco_prob,
+                                           tsg_pred, tsg_prob)
             self.num_pred += 1
 
         self._on_finish()  # update info for kfold cross-validation
 
-    def kfold_prediction(self, k=10):
-        # generate indices for kfold cross validation
+        # convert number of trees to fraction of trees
+        return self._prediction_result()
+
+    def oob_validation(self):
+        """Records the performance in terms of ROC and PR AUC using the
+        out-of-bag votes of random forests trained on all genes.
+
+        A forest is trained for each of the total_iter iterations, which
+        is much faster than k-fold cross-validation. Every gene is scored
+        only by the trees that did not sample it (out-of-bag). The number
+        of out-of-bag votes of each gene is kept in prediction_df.
+
+        Returns
+        -------
+        onco_prob : pd.Series
+            mean out-of-bag oncogene score
+        tsg_prob : pd.Series
+            mean out-of-bag tsg score
+        other_prob : pd.Series
+            mean out-of-bag score for "other" genes
+        """
         self.num_pred = 0  # number of predictions
+        self._init_metrics()  # start over if validated before
 
-        prediction = pd.Series(index=self.y.index)  # predicted class
-        onco_prob = pd.Series(index=self.y.index).fillna(0)
-        tsg_prob = pd.Series(index=self.y.index).fillna(0)
+        # out-of-bag scores are accumulated in the order of the sorted genes
+        self._sort_genes()
+        self._init_predictions()
 
         for i in range(self.total_iter):
-            # randomize for another round
-            self.x, self.y = futils.randomize(self.x, self.prng)
+            # randomize for another round. Row r of the randomized genes
+            # is row rows[r] of the sorted genes.
+            rows = self._randomize(i)
             futils.check_num_classes(self.y) # warn user if not 3 classes
+            seed = seeds.derive_seed(self.rseed, 'oob', i)
+            if hasattr(self.clf, 'set_seed'):
+                self.clf.set_seed(seed)
+
+            # train on all genes
+            self.clf.fit(self.x.copy(), self.y.copy())
+            proba_ = self._oob_proba()
+            is_missing = np.isnan(proba_).any(axis=1)
+            if is_missing.any():
+                self.logger.warning('{0} genes were never out-of-bag, increase the '
+                                    'number of trees'.format(is_missing.sum()))
+                proba_[is_missing] = 0
 
-            # set up stratified kfold iterator
-            k_fold = cross_validation.StratifiedKFold(self.y,
-                                                      n_folds=k)
+            # update information
+            y_pred = proba_.argmax(axis=1)  # majority vote
+            onco_pred = (y_pred==self.onco_num).astype(int)
+            onco_prob = proba_[:, self.onco_num]
+            tsg_pred = (y_pred==self.tsg_num).astype(int)
+            tsg_prob = proba_[:, self.tsg_num]
+            self._update_iteration_metrics(y_pred, onco_pred, onco_prob,
+                                           tsg_pred, tsg_prob)
+            self.num_pred += 1
 
-            # obtain predictions from single round of kfold validation
-            for train_ix, test_ix in k_fold:
-                # retreive indices from pandas dataframe using row number
-                tmp_train_ix = self.x.iloc[train_ix].index
-                tmp_test_ix = self.x.iloc[test_ix].index
-
-                if self.is_weighted_sample:
-                    # figure out sample weights
-                    num_train = len(train_ix)
-                    sample_weight = np.zeros(num_train)
-                    onco_ix = np.nonzero(self.y.ix[tmp_train_ix]==self.onco_num)[0]
-                    tsg_ix = np.nonzero(self.y.ix[tmp_train_ix]==self.tsg_num)[0]
-                    other_ix = np.nonzero(self.y.ix[tmp_train_ix]==self.other_num)[0]
-                    sample_weight[onco_ix] = 1. / len(onco_ix)
-                    sample_weight[tsg_ix] = 1. / len(tsg_ix)
-                    sample_weight[other_ix] = 1. / len(other_ix)
-
-                    # do training with sample weighting
-                    self.clf.fit(self.x.ix[tmp_train_ix].copy(),
-                                 self.y.ix[tmp_train_ix].copy(),
-                                 sample_weight=sample_weight)
-                else:
-                    # do training without weighting
-                    self.clf.fit(self.x.ix[tmp_train_ix].copy(),
-                                 self.y.ix[tmp_train_ix].copy())
+            # add out-of-bag scores and votes of genes that were out-of-bag
+            is_oob = ~is_missing
+            num_trees = self._num_oob_trees()
+            self._add_predictions(rows[is_oob], proba_[is_oob],
+                                  num_trees[is_oob] if num_trees is not None else None)
+
+        self._on_finish()  # update info for out-of-bag validation
+        self._sort_genes()  # same order as the accumulated scores
 
+        # convert number of trees to fraction of trees
+        return self._prediction_result()
+
+    def predict_oob(self):
+        """Predict after using the train method, using the out-of-bag votes
+        for genes that were in the training data.
+
+        Genes that the forest was trained on would otherwise receive
+        over-fitted scores.
+        """
+        self.num_pred = 1  # only one prediction
+        self.prediction_df = None  # out-of-bag votes are not counted
+
+        # do predictions
+        proba_ = np.asarray(self.clf.predict_proba(self.x), dtype=float)
+        oob_proba = self._oob_proba()
+        is_oob = ~np.isnan(oob_proba).any(axis=1)
+        proba_[is_oob] = oob_proba[is_oob]
+
+        # update information
+        onco_prob = proba_[:, self.onco_num]
+        tsg_prob = proba_[:, self.tsg_num]
+        other_prob = 1 - (onco_prob + tsg_prob)
+
+        return onco_prob, tsg_prob, other_prob
+
+    def permutation_importance(self, num_repeats=1):
+        """Permutation feature importance of cross-validated models loaded
+        by load_cv.
+
+        Importance is the decrease in balanced accuracy (mean recall of
+        each class) of the held-out genes of each fold when the values of
+        a feature are randomly permuted (similar to MeanDecreaseAccuracy
+        in R's randomForest, but not dominated by "other" genes). The
+        (fold, feature) pairs are evaluated in parallel by the processes
+        set with set_num_processes.
+
+        Parameters
+        ----------
+        num_repeats : int (default: 1)
+            number of permutations of each feature
+
+        Returns
+        -------
+        importance : pd.DataFrame
+            mean and standard deviation of the decrease in balanced
+            accuracy across folds, for each feature
+        """
+        cv_folds = self.clf.cv_folds
+        k = int(cv_folds.values.max())
+
+        # held-out genes of every model
+        tasks = []
+        for i in range(self.total_iter):
+            col = 'X{0}'.format(i+1)
+            for j in range(k):
+                good_ix = cv_folds[cv_folds[col]==j+1].index
+                test_rows = np.nonzero(self.x.index.isin(good_ix))[0]
+                if not len(test_rows):
+                    continue
+                # no permutation (None) gives the baseline accuracy
+                for feature in [None] + list(range(self.x.shape[1])):
+                    seed = seeds.derive_seed(self.rseed, 'importance', i+1, j+1, feature)
+                    tasks.append((i+1, j+1, test_rows, feature, seed, num_repeats))
+
+        # decrease in accuracy for every fold
+        results = list(self._run_folds(tasks, method='_run_importance'))
+        decrease = []
+        for task, acc in zip(tasks, results):
+            if task[3] is None:
+                base_acc = acc
+                decrease.append(np.zeros(self.x.shape[1]))
+            else:
+                decrease[-1][task[3]] = base_acc - acc
+        decrease = np.array(decrease)
+
+        importance = pd.DataFrame({'mean decrease accuracy': decrease.mean(axis=0),
+                                   'std decrease accuracy': decrease.std(axis=0)},
+                                  index=self.x.columns,
+                                  columns=['mean decrease accuracy',
+                                           'std decrease accuracy'])
+        return importance
+
+    def _run_importance(self, num_iter, num_fold, test_rows, feature, seed,
+                        num_repeats=1):
+        """Balanced accuracy of a cross-validation model on its held-out
+        genes, with one feature randomly permuted.
+
+        Parameters
+        ----------
+        num_iter : int
+            cross-validation iteration of the model (starting from 1)
+        num_fold : int
+            fold of the model (starting from 1)
+        test_rows : np.array
+            row numbers of the held-out genes
+        feature : int or None
+            column number of the permuted feature. None for no permutation.
+        seed : int
+            seed for the permutation
+        num_repeats : int
+            number of permutations to average over
+
+        Returns
+        -------
+        accuracy : float
+            mean over classes of the fraction of held-out genes
+            correctly classified
+        """
+        self.clf.set_model(num_iter, num_fold)
+        xtest = self.x.iloc[test_rows].copy()
+        ytest = self.y.iloc[test_rows].values
+        prng = np.random.RandomState(seed)
+        if feature is None:
+            num_repeats = 1
+        accuracy = []
+        for r in range(num_repeats):
+            if feature is not None:
+                col = xtest.columns[feature]
+                xtest[col] = prng.permutation(self.x[col].values[test_rows])
+            proba_ = np.asarray(self.clf.predict_proba(xtest))
+            is_correct = proba_.argmax(axis=1) == ytest
+            class_recall = [np.mean(is_correct[ytest==c]) for c in np.unique(ytest)]
+            accuracy.append(np.mean(class_recall))
+        return np.mean(accuracy)
+
+    def _num_oob_trees(self):
+        """Number of trees for which each gene was out-of-bag, in the
+        order of self.x (None if the classifier does not count them)."""
+        if not hasattr(self.clf, 'num_oob_trees'):
+            return None
+        oob_trees = self.clf.num_oob_trees()
+        row = oob_trees.index.get_indexer(self.x.index)
+        return np.where(row >= 0, oob_trees.values[row], 0)
+
+    def _oob_proba(self):
+        """Out-of-bag class probabilities of the trained model, in the
+        order of self.x. Genes without out-of-bag votes are NaN."""
+        oob = self.clf.oob_proba()
+        row = oob.index.get_indexer(self.x.index)
+        proba_ = np.full((len(self.x), oob.shape[1]), np.nan)
+        is_train = row >= 0
+        proba_[is_train] = oob.values[row[is_train]]
+        return proba_
+
+    def kfold_prediction(self, k=10):
+        # generate indices for kfold cross validation
+        self.num_pred = 0  # number of predictions
+        plan = self._fold_plan(k)
+        self._init_predictions()
+
+        # set up the cross-validation folds
+        tasks = []
+        for i in range(plan.num_iter):
+            for nfold, (train_ix, test_ix) in enumerate(plan.folds(i)):
+                tasks.append((i, nfold, int(plan.fold_seeds[i, nfold]),
+                              train_ix, test_ix))
+        results = self._run_checkpointed(tasks, 'prediction')
+
+        for i in range(plan.num_iter):
+            # obtain predictions from single round of kfold validation
+            for train_ix, test_ix in plan.folds(i):
                 # predict test data in kfold validation
-                tmp_prob = self.clf.predict_proba(self.x.ix[tmp_test_ix])
-                onco_prob.ix[tmp_test_ix] += tmp_prob[:, self.onco_num]
-                tsg_prob.ix[tmp_test_ix] += tmp_prob[:, self.tsg_num]
+                tmp_prob, _, num_trees = next(results)
+                self._add_predictions(test_ix, tmp_prob, num_trees)
 
             self.num_pred += 1
 
         # convert number of trees to fraction of trees
-        onco_prob /= self.num_pred
-        tsg_prob /= self.num_pred
-        other_prob = 1 - (onco_prob + tsg_prob)
+        return self._prediction_result()
+
+    def _init_predictions(self):
+        """Preallocate the buffers accumulating the predictions of
+        every gene, in the order of self.x."""
+        num_genes = len(self.x)
+        self.sum_proba = np.zeros((num_genes, self.num_classes))
+        self.vote_counts = np.zeros((num_genes, self.num_classes), dtype=np.int64)
+        self.num_predictions = np.zeros(num_genes, dtype=np.int64)
+        self.prediction_df = None
+
+    def _add_predictions(self, rows, proba_, num_trees):
+        """Add the class probabilities predicted by a model.
+
+        Parameters
+        ----------
+        rows : np.array or slice
+            row numbers of the predicted genes
+        proba_ : np.array
+            predicted class probabilities (fraction of tree votes)
+        num_trees : int, np.array or None
+            number of trees of the model (or that voted for each gene),
+            to recover the vote counts
+        """
+        proba_ = np.asarray(proba_)
+        self.sum_proba[rows] += proba_
+        if num_trees is not None:
+            if np.ndim(num_trees):
+                num_trees = np.asarray(num_trees)[:, np.newaxis]
+            self.vote_counts[rows] += np.rint(proba_ * num_trees).astype(np.int64)
+        self.num_predictions[rows] += 1
+
+    def _prediction_result(self):
+        """Convert the accumulated predictions to a data frame.
+
+        The data frame is kept as prediction_df, and has the mean
+        score, the number of tree votes for each class and the number
+        of models that predicted each gene.
+
+        Returns
+        -------
+        onco_prob : pd.Series
+            mean oncogene score
+        tsg_prob : pd.Series
+            mean tsg score
+        other_prob : pd.Series
+            mean score for "other" genes
+        """
+        num_predictions = np.maximum(self.num_predictions, 1)
+        proba_ = self.sum_proba / num_predictions[:, np.newaxis]
+        onco_prob = proba_[:, self.onco_num]
+        tsg_prob = proba_[:, self.tsg_num]
+        cols = ['oncogene score', 'tsg score', 'other score',
+                'oncogene votes', 'tsg votes', 'other votes', 'num predictions']
+        self.prediction_df = pd.DataFrame({
+            'oncogene score': onco_prob,
+            'tsg score': tsg_prob,
+            'other score': 1 - (onco_prob + tsg_prob),
+            'oncogene votes': self.vote_counts[:, self.onco_num],
+            'tsg votes': self.vote_counts[:, self.tsg_num],
+            'other votes': self.vote_counts[:, self.other_num],
+            'num predictions': self.num_predictions},
+            index=self.x.index, columns=cols)
+        return (self.prediction_df['oncogene score'],
+                self.prediction_df['tsg score'],
+                self.prediction_df['other score'])
+
+    def _num_trees(self):
+        """Number of trees of the current model (None if not a forest)."""
+        if hasattr(self.clf, 'num_trees'):
+            return self.clf.num_trees()
+        return None
+
+    def set_fold_plan_path(self, path):
+        """Save the fold plan to this .npz file, or reuse the plan
+        saved there if it was made for the same genes and settings."""
+        self.fold_plan_path = path
+
+    def _fold_plan(self, k):
+        """Randomize the data and split it into folds for every
+        cross-validation iteration.
+
+        All randomization is done up front so that the folds of every
+        iteration can be handed out to worker processes at once. The
+        genes are sorted once, and the folds of every iteration are
+        row numbers of the sorted genes (see FoldPlan).
+
+        Parameters
+        ----------
+        k : int
+            Number of cross-validation folds
 
-        # return prediction.astype(int), prob
-        return onco_prob, tsg_prob, other_prob
+        Returns
+        -------
+        plan : FoldPlan
+            randomizations, folds and fold seeds of every iteration
+        """
+        self._sort_genes()
+        futils.check_num_classes(self.y) # warn user if not 3 classes
+
+        plan = None
+        path = self.fold_plan_path
+        if path and os.path.exists(path):
+            plan = FoldPlan.load(path)
+            if not plan.matches(self.x.index, self.y.values, self.total_iter,
+                                k, self.rseed):
+                self.logger.warning('Fold plan {0} was made for other genes or '
+                                    'settings, so it is not used.'.format(path))
+                plan = None
+        if plan is None:
+            plan = FoldPlan.build(self.x.index, self.y.values,
+                                  self.total_iter, k, self.rseed)
+            if path:
+                plan.save(path)
+        self.fold_plan = plan
+        if self.send_data_once and not self.data_sent:
+            # the sorted genes are the same every time, so data already
+            # sent by a previous cross-validation is reused
+            self._send_data(plan)
+        return plan
+
+    def _send_data(self, plan):
+        """Send the data to the classifier once, instead of converting
+        the training and test genes of every fold.
+
+        The folds are row numbers of the data that was sent.
+
+        Parameters
+        ----------
+        plan : FoldPlan
+            folds from _fold_plan
+        """
+        elapsed = self.clf.set_data(self.x, self.y)
+        self.data_sent = True
+
+        # estimate the time of converting every fold separately
+        num_genes = len(self.x)
+        fold_rows = plan.num_iter * num_genes * plan.num_folds
+        self.logger.info('Sent {0} genes to the classifier in {1:.2f}s, instead of '
+                         'converting {2} rows fold by fold (about {3:.2f}s).'.format(
+                             num_genes, elapsed, fold_rows,
+                             elapsed * fold_rows / float(num_genes)))
+
+    def _run_folds(self, tasks, method='_run_fold'):
+        """Evaluate cross-validation folds, possibly in parallel.
+
+        Parameters
+        ----------
+        tasks : list
+            arguments to the method for each fold
+        method : str
+            name of the method evaluating a single task
+
+        Returns
+        -------
+        results : generator
+            result of the method for each task, in the same order as tasks
+        """
+        global _fold_clf
+        if self.num_processes > 1 and len(tasks) > 1:
+            _fold_clf = self
+            pool = Pool(processes=self.num_processes)
+            try:
+                for result in pool.imap(_fold_worker, [(method, t) for t in tasks]):
+                    yield result
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+                _fold_clf = None
+        else:
+            for task in tasks:
+                yield getattr(self, method)(*task)
+
+    def _run_checkpointed(self, tasks, name):
+        """Evaluate cross-validation folds like _run_folds, and save the
+        result of each fold to the checkpoint directory (if set).
+
+        When resuming, folds with a saved result (and saved model, if the
+        task saves one) are loaded instead of run again.
+
+        Parameters
+        ----------
+        tasks : list
+            arguments to _run_fold for each fold
+        name : str
+            name of the cross-validation run, to tell apart the folds
+            of different runs in the same checkpoint directory
+
+        Returns
+        -------
+        results : generator
+            result of _run_fold for each task, in the same order as tasks
+        """
+        if self.checkpoint_dir is None:
+            for result in self._run_folds(tasks):
+                yield result
+            return
+
+        run_hash = checkpoint.fingerprint(self.x, self.y, self._checkpoint_params())
+        paths, saved = [], []
+        for task in tasks:
+            cv_iter, nfold, seed, train_ix, test_ix = task[:5]
+            path = checkpoint.fold_result_path(self.checkpoint_dir, name,
+                                               cv_iter+1, nfold+1)
+            result = None
+            model_path = task[5] if len(task) > 5 else None
+            if self.resume and (model_path is None or os.path.exists(model_path)):
+                result = checkpoint.load_fold_result(path, seed, test_ix, run_hash)
+            paths.append(path)
+            saved.append(result)
+        todo = [task for task, result in zip(tasks, saved) if result is None]
+        if self.resume:
+            self.logger.info('Resuming from {0}: {1} of {2} folds were already '
+                             'finished.'.format(self.checkpoint_dir,
+                                                len(tasks) - len(todo), len(tasks)))
+
+        results = self._run_folds(todo)
+        for task, path, result in zip(tasks, paths, saved):
+            if result is None:
+                result = next(results)
+                checkpoint.save_fold_result(path, result, task[2], task[4], run_hash)
+            yield result
+
+    def _checkpoint_params(self):
+        """Settings that change the result of a fold, besides its seed and
+        genes (see checkpoint.fingerprint)."""
+        params = {'engine': self.engine or type(self.clf).__name__,
+                  'weighted_sample': self.is_weighted_sample,
+                  'early_stop_tol': self.early_stop_tol,
+                  'tree_batch': self.tree_batch if self.early_stop_tol is not None else None}
+        for attr in ['ntrees', 'driver_sample_rate', 'other_sample_ratio']:
+            params[attr] = getattr(self.clf, attr, None)
+        return params
+
+    def _run_fold(self, cv_iter, nfold, seed, train_ix, test_ix,
+                  model_path=None, predict=True, importance=False):
+        """Train and evaluate a single cross-validation fold.
+
+        Parameters
+        ----------
+        cv_iter : int
+            index of the cross-validation iteration (i.e. randomization)
+        nfold : int
+            index of the fold within the iteration
+        seed : int
+            seed for the classifier's random number generator
+        train_ix : np.array
+            row numbers of the training genes (rows of self.x)
+        test_ix : np.array
+            row numbers of the held-out genes
+        model_path : str or None
+            if provided, save the trained model to this path
+        predict : bool
+            predict the held-out genes
+        importance : bool
+            return the feature importance of the trained model
+
+        Returns
+        -------
+        proba_ : np.array or None
+            predicted class probabilities of held-out genes
+        importance : list or None
+            feature importance of the trained model
+        num_trees : int or None
+            number of trees of the trained model
+        """
+        # set the state of the classifier's random number generator
+        if hasattr(self.clf, 'set_seed'):
+            self.clf.set_seed(seed)
+
+        proba_ = None
+        if self.is_weighted_sample:
+            # weight classes by using sample weights
+            num_train = len(train_ix)
+            sample_weight = np.zeros(num_train)
+            ytrain = self.y.values[train_ix]
+            onco_ix = np.nonzero(ytrain==self.onco_num)[0]
+            tsg_ix = np.nonzero(ytrain==self.tsg_num)[0]
+            other_ix = np.nonzero(ytrain==self.other_num)[0]
+            sample_weight[onco_ix] = 1. / len(onco_ix)
+            sample_weight[tsg_ix] = 1. / len(tsg_ix)
+            sample_weight[other_ix] = 1. / len(other_ix)
+
+            # do training
+            self.clf.fit(self.x.iloc[train_ix],
+                         self.y.iloc[train_ix],
+                         sample_weight=sample_weight)
+        elif self.early_stop_tol is not None:
+            # add trees until the held-out scores converge
+            proba_ = self._fit_early_stop(cv_iter, nfold, train_ix, test_ix)
+        else:
+            self._fit_fold(train_ix)
+
+        # save trained model
+        if model_path is not None:
+            self.clf.save_fold(model_path)
+
+        # do prediction
+        if not predict:
+            proba_ = None
+        elif proba_ is None:
+            proba_ = self._predict_fold(test_ix)
+        if importance:
+            importance = getattr(self.clf, 'feature_importances_', None)
+        else:
+            importance = None
+
+        return proba_, importance, self._num_trees()
+
+    def _fit_fold(self, train_ix, **kwargs):
+        """Train the classifier on the training genes of a fold.
+
+        Keyword arguments are passed to the classifier's fit method.
+        """
+        if self.data_sent:
+            # the data was already sent to the classifier, so
+            # only the row numbers are needed
+            self.clf.fit_rows(train_ix, self.y.iloc[train_ix], **kwargs)
+        else:
+            # do training without sample weights
+            self.clf.fit(self.x.iloc[train_ix],
+                         self.y.iloc[train_ix],
+                         **kwargs)
+
+    def _predict_fold(self, test_ix):
+        """Predict class probabilities of the held-out genes of a fold."""
+        if self.data_sent:
+            return np.asarray(self.clf.predict_proba_rows(test_ix))
+        else:
+            return np.asarray(self.clf.predict_proba(self.x.iloc[test_ix]))
+
+    def _fit_early_stop(self, cv_iter, nfold, train_ix, test_ix):
+        """Grow the random forest of a fold in batches of trees until the
+        driver scores of the held-out genes stop changing.
+
+        Returns
+        -------
+        proba_ : np.array
+            predicted class probabilities of held-out genes
+        """
+        max_trees = self.clf.ntrees
+        num_trees = 0
+        prev_driver = None
+        max_change = np.nan
+        while num_trees < max_trees:
+            batch = min(self.tree_batch, max_trees - num_trees)
+            if num_trees and hasattr(self.clf, 'set_seed'):
+                # later batches use their own random stream
+                self.clf.set_seed(seeds.derive_seed(self.rseed, 'trees', cv_iter,
+                                                    nfold, num_trees))
+            self._fit_fold(train_ix, ntrees=batch, grow=num_trees>0)
+            num_trees += batch
+
+            # compare driver scores with the previous batch
+            proba_ = self._predict_fold(test_ix)
+            driver = 1 - proba_[:, self.other_num]
+            if prev_driver is not None:
+                max_change = np.max(np.abs(driver - prev_driver))
+                if max_change < self.early_stop_tol:
+                    break
+            prev_driver = driver
+        self.logger.info('CV iteration {0}, fold {1}: {2} trees (last change in '
+                         'driver score {3:.4f})'.format(cv_iter+1, nfold+1,
+                                                       num_trees, max_change))
+        return proba_
 
     def _init_metrics(self):
         """Initialize classification diagnostric metrics."""
@@ -343,92 +987,91 @@ class GenericClassifier(object):
         self.precision = np.zeros(self.total_iter)
         self.recall = np.zeros(self.total_iter)
 
+        # predictions of each iteration (see _update_iteration_metrics)
+        self.iteration_results = {}
+
+    def _update_iteration_metrics(self, overall_pred, onco_pred, onco_prob,
+                                  tsg_pred, tsg_prob):
+        """Record the predictions of one iteration.
+
+        The metrics of all iterations are computed together by
+        _compute_metrics once the iterations are finished.
+        """
+        self.onco_gene_pred = pd.Series(onco_pred, self.y.index)
+        self.onco_gene_score = pd.Series(onco_prob, self.y.index)
+        self.tsg_gene_pred = pd.Series(tsg_pred, self.y.index)
+        self.tsg_gene_score = pd.Series(tsg_prob, self.y.index)
+        self.iteration_results[self.num_pred] = (np.asarray(self.y), overall_pred,
+                                                 onco_pred, onco_prob,
+                                                 tsg_pred, tsg_prob)
+        self._update_metrics(self.y,
+                             overall_pred,
+                             onco_prob,
+                             tsg_prob)
+
     def _update_metrics(self, y_true, y_pred,
                         onco_prob, tsg_prob):
         # record which genes were predicted what
         self.driver_gene_pred = pd.Series(y_pred, self.y.index)
         self.driver_gene_score = pd.Series(onco_prob+tsg_prob, self.y.index)
 
-        # evaluate performance
-        prec, recall, fscore, support = metrics.precision_recall_fscore_support(y_true, y_pred,
-                                                                                average='macro')
-        cancer_gene_pred = ((onco_prob + tsg_prob)>.5).astype(int)
-        self.cancer_gene_count[self.num_pred] = np.sum(cancer_gene_pred)
-        self.precision[self.num_pred] = prec
-        self.recall[self.num_pred] = recall
-        self.f1_score[self.num_pred] = fscore
-
-        # compute Precision-Recall curve metrics
-        driver_prob = onco_prob + tsg_prob
+    def _compute_metrics(self):
+        """Compute the classification, ROC and PR metrics of all iterations
+        at once (see curve_metrics)."""
+        iters = sorted(self.iteration_results)
+        y_true, overall_pred, onco_pred, onco_prob, tsg_pred, tsg_prob = [
+            np.array([self.iteration_results[i][n] for i in iters])
+            for n in range(6)]
+
+        # overall metrics
+        prec, recall, fscore = curve_metrics.macro_metrics(y_true, overall_pred,
+                                                           self.num_classes)
+        self.precision[iters] = prec
+        self.recall[iters] = recall
+        self.f1_score[iters] = fscore
+
+        # oncogene metrics
+        true_onco = (y_true==self.onco_num).astype(int)
+        self.onco_gene_count[iters] = onco_pred.sum(axis=1)
+        prec, recall, fscore = curve_metrics.binary_metrics(true_onco, onco_pred)
+        self.onco_precision[iters] = prec
+        self.onco_recall[iters] = recall
+        self.onco_f1_score[iters] = fscore
+        onco_scores = curve_metrics.SortedScores(true_onco, onco_prob)
+        self.onco_tpr_array[iters] = onco_scores.roc(self.onco_fpr_array)
+        prec, thresh = onco_scores.precision_recall(self.onco_recall_array)
+        self.onco_precision_array[iters] = prec
+        self.onco_threshold_array[iters] = thresh
+
+        # tsg metrics
+        true_tsg = (y_true==self.tsg_num).astype(int)
+        self.tsg_gene_count[iters] = tsg_pred.sum(axis=1)
+        prec, recall, fscore = curve_metrics.binary_metrics(true_tsg, tsg_pred)
+        self.tsg_precision[iters] = prec
+        self.tsg_recall[iters] = recall
+        self.tsg_f1_score[iters] = fscore
+        tsg_scores = curve_metrics.SortedScores(true_tsg, tsg_prob)
+        self.tsg_tpr_array[iters] = tsg_scores.roc(self.tsg_fpr_array)
+        self.tsg_precision_array[iters] = tsg_scores.precision_recall(self.tsg_recall_array)[0]
+
+        # driver metrics
         driver_true = (y_true > 0).astype(int)
-        p, r, thresh = metrics.precision_recall_curve(driver_true, driver_prob)
-        p, r, thresh = p[::-1], r[::-1], thresh[::-1]  # reverse order of results
-        thresh = np.insert(thresh, 0, 1.0)
-        self.driver_precision_array[self.num_pred, :] = interp(self.driver_recall_array, r, p)
-        self.driver_threshold_array[self.num_pred, :] = interp(self.driver_recall_array, r, thresh)
-
-        # calculate prediction summary statistics
-        prec, recall, fscore, support = metrics.precision_recall_fscore_support(driver_true, cancer_gene_pred)
-        self.driver_precision[self.num_pred] = prec[1]
-        self.driver_recall[self.num_pred] = recall[1]
-
-        # save driver metrics
-        fpr, tpr, thresholds = metrics.roc_curve(driver_true, driver_prob)
-        self.driver_tpr_array[self.num_pred, :] = interp(self.driver_fpr_array, fpr, tpr)
-
-    def _update_onco_metrics(self, y_true, y_pred, prob):
-        self.onco_gene_pred = pd.Series(y_pred, self.y.index)
-        self.onco_gene_score = pd.Series(prob, self.y.index)
-
-        # compute metrics for classification
-        self.onco_gene_count[self.num_pred] = sum(y_pred)
-        prec, recall, fscore, support = metrics.precision_recall_fscore_support(y_true, y_pred)
-        self.onco_precision[self.num_pred] = prec[self.onco_num]
-        self.onco_recall[self.num_pred] = recall[self.onco_num]
-        self.onco_f1_score[self.num_pred] = fscore[self.onco_num]
-        self.logger.debug('Onco Iter %d: Precission=%s, Recall=%s, f1_score=%s' % (
-                          self.num_pred + 1, str(prec), str(recall), str(fscore)))
-
-        # compute ROC curve metrics
-        fpr, tpr, thresholds = metrics.roc_curve(y_true, prob)
-        self.onco_tpr_array[self.num_pred, :] = interp(self.onco_fpr_array, fpr, tpr)
-        #self.onco_mean_tpr[0] = 0.0
-
-        # compute Precision-Recall curve metrics
-        p, r, thresh = metrics.precision_recall_curve(y_true, prob)
-        p, r, thresh = p[::-1], r[::-1], thresh[::-1]  # reverse order of results
-        thresh = np.insert(thresh, 0, 1.0)
-        self.onco_precision_array[self.num_pred, :] = interp(self.onco_recall_array, r, p)
-        self.onco_threshold_array[self.num_pred, :] = interp(self.onco_recall_array, r, thresh)
-
-    def _update_tsg_metrics(self, y_true, y_pred, prob):
-        self.tsg_gene_pred = pd.Series(y_pred, self.y.index)
-        self.tsg_gene_score = pd.Series(prob, self.y.index)
-
-        # compute metrics for classification
-        self.tsg_gene_count[self.num_pred] = sum(y_pred)
-        prec, recall, fscore, support = metrics.precision_recall_fscore_support(y_true, y_pred)
-        tsg_col = 1  # column for metrics relate to tsg
-        self.tsg_precision[self.num_pred] = prec[tsg_col]
-        self.tsg_recall[self.num_pred] = recall[tsg_col]
-        self.tsg_f1_score[self.num_pred] = fscore[tsg_col]
-        self.logger.debug('Tsg Iter %d: Precission=%s, Recall=%s, f1_score=%s' % (
-                          self.num_pred + 1, str(prec), str(recall), str(fscore)))
-
-        # compute ROC curve metrics
-        fpr, tpr, thresholds = metrics.roc_curve(y_true, prob)
-        self.tsg_tpr_array[self.num_pred, :] = interp(self.tsg_fpr_array, fpr, tpr)
-        #self.tsg_tpr_array[0] = 0.0
-
-        # compute Precision-Recall curve metrics
-        p, r, thresh = metrics.precision_recall_curve(y_true, prob)
-        p, r, thresh = p[::-1], r[::-1], thresh[::-1]  # reverse order of results
-        self.tsg_precision_array[self.num_pred, :] = interp(self.tsg_recall_array, r, p)
+        driver_scores = curve_metrics.SortedScores(driver_true, onco_prob + tsg_prob)
+        self.driver_tpr_array[iters] = driver_scores.roc(self.driver_fpr_array)
+        prec, thresh = driver_scores.precision_recall(self.driver_recall_array)
+        self.driver_precision_array[iters] = prec
+        self.driver_threshold_array[iters] = thresh
+        prec, recall, count = driver_scores.cutoff(.5)
+        self.driver_precision[iters] = prec
+        self.driver_recall[iters] = recall
+        self.cancer_gene_count[iters] = count
 
     def _on_finish(self):
         """Record the mean ROC and PR AUC after all of the cross-validation is finished
         in kfold_validation method.
         """
+        self._compute_metrics()
+
         # ROC curve metrics
         self.onco_mean_roc_auc = float(metrics.auc(self.onco_fpr_array,
                                                    np.mean(self.onco_tpr_array, axis=0)))
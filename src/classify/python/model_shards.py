@@ -0,0 +1,62 @@
+"""Sharded storage of cross-validated random forests.
+
+Instead of a single .Rdata file holding every cross-validation model,
+train --cv --sharded writes each fold's model to its own file as soon
+as it is trained. The model directory contains:
+
+    manifest.txt : iteration, fold and file name of every model
+    cvFoldDf.txt : fold in which each gene was held-out, per iteration
+    iter{i}_fold{j}.* : model of a single fold (format of the engine)
+
+Models are then loaded one at a time by set_model.
+"""
+import pandas as pd
+import os
+
+MANIFEST = 'manifest.txt'
+CV_FOLDS = 'cvFoldDf.txt'
+
+
+def shard_name(num_iter, num_fold, ext):
+    """File name of the model of a fold (iteration/fold start from 1)."""
+    return 'iter{0}_fold{1}{2}'.format(num_iter, num_fold, ext)
+
+
+def write_manifest(model_dir, shards, cv_folds):
+    """Write the manifest and fold table of a sharded model directory.
+
+    Parameters
+    ----------
+    model_dir : str
+        sharded model directory
+    shards : list
+        (iteration, fold, file name) of each model
+    cv_folds : pd.DataFrame
+        fold in which each gene was held-out. Columns are the iterations.
+    """
+    manifest = pd.DataFrame(shards, columns=['iteration', 'fold', 'file'])
+    manifest.to_csv(os.path.join(model_dir, MANIFEST), sep='\t', index=False)
+    cv_folds = cv_folds.rename(columns=lambda x: 'X{0}'.format(x))
+    cv_folds.to_csv(os.path.join(model_dir, CV_FOLDS), sep='\t')
+
+
+def read_manifest(model_dir):
+    """Read the manifest and fold table of a sharded model directory.
+
+    Returns
+    -------
+    shards : dict
+        path of the model for each (iteration, fold)
+    cv_folds : pd.DataFrame
+        fold in which each gene was held-out (columns X1, X2, ...)
+    """
+    manifest = pd.read_csv(os.path.join(model_dir, MANIFEST), sep='\t')
+    shards = {(int(r['iteration']), int(r['fold'])): os.path.join(model_dir, r['file'])
+              for _, r in manifest.iterrows()}
+    cv_folds = pd.read_csv(os.path.join(model_dir, CV_FOLDS), sep='\t', index_col=0)
+    return shards, cv_folds
+
+
+def is_sharded(path):
+    """Check if a trained classifier is a sharded model directory."""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST))
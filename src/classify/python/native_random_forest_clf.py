@@ -0,0 +1,426 @@
+"""Random Forest classifier implemented with numpy and scikit-learn.
+
+The NativeClassifier mimics the sub-sampled random forest from R's
+randomForest library that is used by MyClassifier, but does not need
+R or rpy2. Each tree is trained on a stratified sample (with replacement)
+of sampsize genes from each class, classes are weighted by 1/sampsize,
+and class probabilities are the fraction of tree votes.
+"""
+from sklearn.tree import DecisionTreeClassifier
+import src.classify.python.flat_forest as flat
+import src.classify.python.model_shards as model_shards
+import numpy as np
+import pandas as pd
+import pickle
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class NativeRandomForest(object):
+    """A forest of decision trees using R randomForest's stratified
+    sampling scheme (sampsize/classwt).
+
+    Parameters
+    ----------
+    ntrees : int
+        number of decision trees
+    sample_size : np.array
+        number of genes sampled (with replacement) from each class
+    prng : np.random.RandomState
+        pseudo random number generator state
+    """
+
+    def __init__(self, ntrees, sample_size, prng):
+        self.ntrees = ntrees
+        self.sample_size = np.asarray(sample_size, dtype=int)
+        self.prng = prng
+        self.trees = []
+
+    def fit(self, x, y):
+        """Fit the forest.
+
+        Parameters
+        ----------
+        x : np.array
+            features for training set
+        y : np.array
+            integer class labels for training set
+        """
+        self.classes_ = np.unique(y)
+        self.num_features = x.shape[1]
+        self.trees = []
+        self.oob_votes = np.zeros((len(y), len(self.classes_)), dtype=int)
+        return self.grow(x, y, self.ntrees)
+
+    def grow(self, x, y, ntrees):
+        """Add trees to a fitted forest, using the same training set.
+
+        Parameters
+        ----------
+        x : np.array
+            features for training set
+        y : np.array
+            integer class labels for training set
+        ntrees : int
+            number of trees to add
+        """
+        # same number of features tried at each split as R
+        mtry = max(int(np.floor(np.sqrt(self.num_features))), 1)
+        classwt = 1. / self.sample_size
+        class_rows = [np.nonzero(y==c)[0] for c in self.classes_]
+
+        for i in range(ntrees):
+            # stratified sample of genes with replacement
+            sample_ix = np.concatenate([self.prng.choice(rows, size=n, replace=True)
+                                        for rows, n in zip(class_rows, self.sample_size)])
+            # duplicated genes are represented through the sample weight
+            counts = np.bincount(sample_ix, minlength=len(y))
+            train_ix = np.nonzero(counts)[0]
+            class_ix = np.searchsorted(self.classes_, y[train_ix])
+            sample_weight = counts[train_ix] * classwt[class_ix]
+
+            tree = DecisionTreeClassifier(max_features=mtry,
+                                          random_state=self.prng.randint(0, 2**31 - 1))
+            tree.fit(x[train_ix], y[train_ix], sample_weight=sample_weight)
+            self.trees.append(tree)
+
+            # votes for the genes not sampled by this tree
+            oob_ix = np.nonzero(counts==0)[0]
+            if len(oob_ix):
+                oob_pred = tree.predict(x[oob_ix])
+                self.oob_votes[oob_ix, np.searchsorted(self.classes_, oob_pred)] += 1
+        self.ntrees = len(self.trees)
+        return self
+
+    def predict_votes(self, x):
+        """Count the number of trees voting for each class.
+
+        Returns
+        -------
+        votes : np.array
+            genes by classes array of vote counts
+        """
+        votes = np.zeros((len(x), len(self.classes_)), dtype=int)
+        rows = np.arange(len(x))
+        for tree in self.trees:
+            tree_pred = tree.predict(x)
+            votes[rows, np.searchsorted(self.classes_, tree_pred)] += 1
+        return votes
+
+    def predict_proba(self, x):
+        """Fraction of trees voting for each class."""
+        return self.predict_votes(x) / float(len(self.trees))
+
+    @property
+    def feature_importances_(self):
+        """Mean decrease in the (class weighted) gini index."""
+        imp = np.zeros(self.num_features)
+        for tree in self.trees:
+            tree_imp = tree.tree_.compute_feature_importances(normalize=False)
+            imp += tree_imp * tree.tree_.weighted_n_node_samples[0]
+        return imp / len(self.trees)
+
+    def to_flat(self):
+        """Convert to the portable FlatForest representation."""
+        trees = [flat.sklearn_tree_nodes(tree, self.classes_)
+                 for tree in self.trees]
+        nodes, tree_offsets = flat.concat_trees(trees)
+        return flat.FlatForest(nodes, tree_offsets, self.classes_,
+                               self.feature_names, float32_split=True)
+
+
+class NativeClassifier(object):
+    """
+    The NativeClassifier class is a drop-in replacement for MyClassifier
+    when R is not wanted. It has the same methods as MyClassifier
+    (fit, predict, predict_proba, save, load, etc.) but keeps the
+    trained models in python instead of R.
+    """
+
+    fold_ext = '.pkl'  # file extension of models saved by save_fold
+
+    def __init__(self,
+                 ntrees=200,
+                 other_sample_ratio=1.,
+                 driver_sample=.7):
+        self.ntrees = ntrees
+        self.other_sample_ratio = other_sample_ratio
+        self.driver_sample_rate = driver_sample
+        self.prng = np.random.RandomState()
+
+        # lists holding trained models for cross-validation
+        self.trained_models = []
+        self.tmp_trained_models = []
+        self.rf = None
+        self._feature_importances = None
+        self.flat_cv = None  # all CV models combined for predict_proba_cv
+        self.shards = None  # fold model files of a sharded model directory
+
+    def set_sample_size(self, sampsize):
+        if self.is_onco_pred and self.is_tsg_pred:
+            sampsize[1] = int(sampsize[1] * self.driver_sample_rate)
+            sampsize[2] = int(sampsize[2] * self.driver_sample_rate)
+            tmp_total_driver = sampsize[1] + sampsize[2]
+        else:
+            sampsize[1] = int(sampsize[1] * self.driver_sample_rate)
+            tmp_total_driver = sampsize[1]
+        sampsize[0] = int(self.other_sample_ratio * tmp_total_driver)
+        self.sample_size = np.array(sampsize, dtype=int)
+
+    def fit(self, xtrain, ytrain, ntrees=None, grow=False):
+        """The fit method trains the random forest classifier.
+
+        Parameters
+        ----------
+        xtrain : pd.DataFrame
+            features for training set
+        ytrain : pd.DataFrame
+            true class labels (as integers) for training set
+        ntrees : int or None
+            number of trees to train, instead of self.ntrees
+        grow : bool
+            add the trees to the current forest, instead of replacing it
+        """
+        label_counts = ytrain.value_counts()
+        if self.is_onco_pred and self.is_tsg_pred:
+            sampsize = [label_counts[self.other_num],
+                        label_counts[self.onco_num],
+                        label_counts[self.tsg_num]]
+        elif self.is_onco_pred:
+            sampsize = [label_counts[self.other_num],
+                        label_counts[self.onco_num]]
+        elif self.is_tsg_pred:
+            sampsize = [label_counts[self.other_num],
+                        label_counts[self.tsg_num]]
+
+        self.set_sample_size(sampsize)
+        ntrees = self.ntrees if ntrees is None else ntrees
+        if grow:
+            self.rf.prng = self.prng
+            self.rf.grow(np.asarray(xtrain, dtype=float), np.asarray(ytrain, dtype=int),
+                         ntrees)
+        else:
+            self.rf = NativeRandomForest(ntrees, self.sample_size, self.prng)
+            self.rf.fit(np.asarray(xtrain, dtype=float), np.asarray(ytrain, dtype=int))
+        self.rf.feature_names = list(xtrain.columns)
+        self.rf.train_genes = list(xtrain.index)
+        self._feature_importances = None  # computed when needed
+
+    @property
+    def feature_importances_(self):
+        """Mean decrease in gini index of the current model."""
+        if self._feature_importances is None and hasattr(self.rf, 'trees'):
+            self._feature_importances = self.rf.feature_importances_
+        return self._feature_importances
+
+    @feature_importances_.setter
+    def feature_importances_(self, importance):
+        self._feature_importances = importance
+
+    def _save(self, obj, path):
+        with open(path, 'wb') as handle:
+            pickle.dump(obj, handle, protocol=2)
+
+    def _load(self, path):
+        with open(path, 'rb') as handle:
+            obj = pickle.load(handle)
+        return obj
+
+    def save(self, path):
+        """Save random forest model as a pickle file."""
+        self._save({'rf_clf': self.rf}, path)
+
+    def save_cv(self, path):
+        """Save cross-validated random forest models as a pickle file."""
+        self._save({'trained.models': self.trained_models,
+                    'cvFoldDf': self.cv_folds}, path)
+
+    def save_fold(self, path):
+        """Save the random forest model of a single fold."""
+        self._save(self.rf, path)
+
+    def load_fold(self, path):
+        """Load the random forest model of a single fold saved by save_fold."""
+        self.rf = self._load(path)
+
+    def save_flat(self, path):
+        """Save random forest model in the portable .npz format."""
+        flat.save_flat(path, [(0, 0, self._flat(self.rf))])
+
+    def save_flat_cv(self, path):
+        """Save cross-validated random forest models in the portable .npz format."""
+        flat.save_flat(path, self._cv_forests(), cv_folds=self.cv_folds)
+
+    def _cv_forests(self):
+        """(iteration, fold, FlatForest) of each cross-validation model."""
+        if self.shards is not None:
+            # load one fold model at a time
+            return [(i, j, self._flat(self._load(path)))
+                    for (i, j), path in sorted(self.shards.items())]
+        models = getattr(self, 'rf_cv', self.trained_models)
+        return [(i+1, j+1, self._flat(rf))
+                for i, cv_models in enumerate(models)
+                for j, rf in enumerate(cv_models)]
+
+    def _flat(self, rf):
+        if isinstance(rf, flat.FlatForest):
+            return rf
+        return rf.to_flat()
+
+    def load(self, path):
+        if path.endswith('.npz'):
+            # portable format, possibly exported from a R model
+            self.rf = flat.FlatModelFile(path).forest(0)
+            return
+        self.rf = self._load(path)['rf_clf']
+
+    def load_cv(self, path):
+        self.shards = None
+        if model_shards.is_sharded(path):
+            # fold models are loaded by set_model when needed
+            self.shards, self.cv_folds = model_shards.read_manifest(path)
+            self.rf_cv = None
+            self.flat_cv = None
+            return
+        if path.endswith('.npz'):
+            self.flat_cv = flat.FlatModelFile(path)
+            self.rf_cv = self.flat_cv.cv_forests()
+            self.cv_folds = self.flat_cv.cv_folds
+            return
+        saved = self._load(path)
+        self.rf_cv = saved['trained.models']
+        self.cv_folds = saved['cvFoldDf']
+        self.flat_cv = None
+
+    def num_trees(self):
+        """Number of trees in the current model."""
+        return self.rf.ntrees
+
+    def oob_proba(self):
+        """Fraction of out-of-bag votes for each class of the genes used
+        to train the current model. Genes never out-of-bag are NaN."""
+        if isinstance(self.rf, flat.FlatForest):
+            raise ValueError('Out-of-bag votes are not kept in the .npz format')
+        votes = self.rf.oob_votes.astype(float)
+        total = votes.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            oob = votes / total[:, np.newaxis]
+        return pd.DataFrame(oob, index=self.rf.train_genes,
+                            columns=self.rf.classes_)
+
+    def num_oob_trees(self):
+        """Number of trees for which each gene used to train the current
+        model was out-of-bag."""
+        if isinstance(self.rf, flat.FlatForest):
+            raise ValueError('Out-of-bag votes are not kept in the .npz format')
+        return pd.Series(self.rf.oob_votes.sum(axis=1), index=self.rf.train_genes)
+
+    def predict_proba_cv(self, xtest, num_iter, return_votes=False):
+        """Predicts the gene hold-out cross-validated probability for each
+        class, evaluating the models of all folds at once.
+
+        Parameters
+        ----------
+        xtest : pd.DataFrame
+            features for test set
+        num_iter : int
+            number of cross-validation iterations
+        return_votes : bool
+            also return the number of tree votes summed over iterations
+        """
+        if self.flat_cv is None:
+            self.flat_cv = flat.FlatModelFile.from_forests(self._cv_forests(),
+                                                           self.cv_folds)
+        return self.flat_cv.predict_proba_cv(xtest, num_iter,
+                                             return_votes=return_votes)
+
+    def set_model(self, num_iter, num_fold):
+        """Set which random forest model is currently active.
+
+        Note: indexes start from 1 to be consistent with MyClassifier
+
+        Parameters
+        ----------
+        num_iter : int
+            Iteration index amongst repeated cross-validations
+        num_fold : int
+            The particular fold for each cross-validation
+        """
+        if self.shards is not None:
+            self.load_fold(self.shards[(num_iter, num_fold)])
+            return
+        self.rf = self.rf_cv[num_iter-1][num_fold-1]
+
+    def append_cv_result(self):
+        """Append result for cross-validation."""
+        self.trained_models.append(self.tmp_trained_models)
+        self.tmp_trained_models = []
+
+    def append_fold_result(self):
+        """Append result for each cross-validation fold."""
+        self.tmp_trained_models.append(self.rf)
+
+    def set_cv_fold(self, df):
+        """Save which genes are valid test sets for each CV fold."""
+        # use the same column names as the R data frame
+        self.cv_folds = df.rename(columns=lambda x: 'X{0}'.format(x))
+
+    def set_classes(self, oncogene, tsg):
+        """Sets the integers used to represent classes in classification."""
+        if not oncogene and not tsg:
+            raise ValueError('Classification needs at least two classes')
+        self.is_onco_pred = oncogene
+        self.is_tsg_pred = tsg
+        if oncogene and tsg:
+            self.other_num = 0
+            self.onco_num = 1
+            self.tsg_num = 2
+            self.num_classes = 3
+        else:
+            self.other_num = 0
+            self.num_classes = 2
+            self.onco_num = 1 if oncogene else 0
+            self.tsg_num = 1 if tsg else 0
+
+    def set_params(self, ntrees=None, other_sample_ratio=None, driver_sample=None):
+        """Change the random forest parameters used by the next fit
+        (parameters that are None are kept)."""
+        if ntrees is not None:
+            self.ntrees = ntrees
+        if other_sample_ratio is not None:
+            self.other_sample_ratio = other_sample_ratio
+        if driver_sample is not None:
+            self.driver_sample_rate = driver_sample
+
+    def set_seed(self, seed):
+        if seed is not None:
+            self.prng = np.random.RandomState(seed)
+
+    def predict(self, xtest):
+        """Predicts class via majority vote.
+
+        Parameters
+        ----------
+        xtest : pd.DataFrame
+            features for test set
+        """
+        votes = self.rf.predict_votes(self._features(xtest))
+        pred_class = self.rf.classes_[votes.argmax(axis=1)]
+        return pd.Series(pred_class, index=xtest.index, name='pred_class')
+
+    def predict_proba(self, xtest):
+        """Predicts the probability for each class.
+
+        Parameters
+        ----------
+        xtest : pd.DataFrame
+            features for test set
+        """
+        return self.rf.predict_proba(self._features(xtest))
+
+    def _features(self, xtest):
+        if isinstance(self.rf, flat.FlatForest):
+            # flat models look up the features by name
+            return xtest
+        return np.asarray(xtest, dtype=float)
@@ -0,0 +1,187 @@
+"""Cache of simulated genes scored by a trained classifier.
+
+Scoring simulated features to build a null distribution gives the same
+result as long as neither the trained classifier nor the simulated features
+change. Results are therefore cached under the md5 hash of the classifier,
+the simulated features and the prediction options (--cv, --prediction-mode).
+Each entry is a directory of the cache:
+
+    {key}/ : files of an entry, i.e. the null distribution text file and
+        vote histograms from classify --simulated, or the state of a
+        single simulation from the null sub-command
+
+An entry is written under a temporary name and then renamed, so a partly
+written entry is never used. The modification time of an entry is updated
+whenever it is used, and entries not used for longer than a maximum age, or
+the least recently used entries beyond a maximum total size, are evicted.
+"""
+from src.utils.python.vote_histogram import sidecar_path
+import src.utils.python.util as _utils
+import hashlib
+import tempfile
+import shutil
+import time
+import os
+
+# eviction limits used when none are given
+DEFAULT_MAX_SIZE = 5000  # MB
+DEFAULT_MAX_AGE = 30  # days
+
+
+def model_hash(model_path):
+    """md5 hash of a trained classifier file, or of every file of a
+    sharded model directory."""
+    if not os.path.isdir(model_path):
+        return _utils.file_hash(model_path)
+    md5 = hashlib.md5()
+    for name in sorted(os.listdir(model_path)):
+        path = os.path.join(model_path, name)
+        if os.path.isfile(path):
+            md5.update('{0}:{1}\n'.format(name, _utils.file_hash(path)).encode())
+    return md5.hexdigest()
+
+
+def cache_key(model_path, feature_path, is_cv, is_oob=False, kind='null'):
+    """Key of the scores of simulated features by a trained classifier.
+
+    kind separates entries holding different files for the same scores
+    ('null' for classify --simulated, 'state' for the null sub-command).
+    """
+    parts = [kind, model_hash(model_path), _utils.file_hash(feature_path),
+             'cv' if is_cv else 'oob' if is_oob else 'predict']
+    return hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+
+def fetch(cache_dir, key, names):
+    """Paths of the files of a cache entry.
+
+    Parameters
+    ----------
+    cache_dir : str
+        cache directory
+    key : str
+        key from cache_key
+    names : list
+        file names the entry must contain
+
+    Returns
+    -------
+    paths : dict or None
+        path of each file, or None if the entry is not cached
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    paths = dict((name, os.path.join(entry_dir, name)) for name in names)
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    os.utime(entry_dir, None)  # mark as recently used
+    return paths
+
+
+def store(cache_dir, key, paths):
+    """Copy files into a cache entry.
+
+    Parameters
+    ----------
+    cache_dir : str
+        cache directory
+    key : str
+        key from cache_key
+    paths : dict
+        file to copy for each file name of the entry
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.exists(entry_dir):
+        return
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp')
+    for name, path in paths.items():
+        shutil.copyfile(path, os.path.join(tmp_dir, name))
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # stored at the same time by another process
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def evict(cache_dir, max_size=None, max_age=None):
+    """Remove entries not used for longer than max_age, then the least
+    recently used entries until the cache is at most max_size.
+
+    Parameters
+    ----------
+    cache_dir : str
+        cache directory
+    max_size : float or None
+        largest total size of the cache in bytes
+    max_age : float or None
+        largest time in seconds since an entry was last used
+
+    Returns
+    -------
+    num_evicted : int
+        number of entries removed
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = []
+    for key in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, key)
+        if key.startswith('.') or not os.path.isdir(entry_dir):
+            continue
+        size = sum(os.path.getsize(os.path.join(entry_dir, name))
+                   for name in os.listdir(entry_dir))
+        entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+    entries.sort()  # least recently used first
+
+    now = time.time()
+    total_size = sum(size for _, size, _ in entries)
+    num_evicted = 0
+    for last_used, size, entry_dir in entries:
+        is_old = max_age is not None and now - last_used > max_age
+        is_full = max_size is not None and total_size > max_size
+        if not (is_old or is_full):
+            continue
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+        num_evicted += 1
+    return num_evicted
+
+
+# file names of a null distribution in a cache entry
+NULL_TEXT = 'null_distribution.txt'
+NULL_VOTES = 'null_distribution.npz'
+
+
+def fetch_null(cache_dir, key, null_path):
+    """Copy a cached null distribution (and its vote histograms) to
+    null_path. Returns False if it is not cached."""
+    paths = fetch(cache_dir, key, [NULL_TEXT])
+    if paths is None:
+        return False
+    shutil.copyfile(paths[NULL_TEXT], null_path)
+    votes_path = os.path.join(cache_dir, key, NULL_VOTES)
+    if os.path.exists(votes_path):
+        shutil.copyfile(votes_path, sidecar_path(null_path))
+    elif os.path.exists(sidecar_path(null_path)):
+        os.remove(sidecar_path(null_path))
+    return True
+
+
+def store_null(cache_dir, key, null_path):
+    """Cache a null distribution (and its vote histograms if saved)."""
+    paths = {NULL_TEXT: null_path}
+    if os.path.exists(sidecar_path(null_path)):
+        paths[NULL_VOTES] = sidecar_path(null_path)
+    store(cache_dir, key, paths)
+
+
+def evict_cache(cli_opts):
+    """Evict entries of the --null-cache directory with the
+    --null-cache-max-size (MB) and --null-cache-max-age (days) options
+    (DEFAULT_MAX_SIZE and DEFAULT_MAX_AGE if not given)."""
+    max_size = cli_opts.get('null_cache_max_size', DEFAULT_MAX_SIZE)
+    max_age = cli_opts.get('null_cache_max_age', DEFAULT_MAX_AGE)
+    return evict(cli_opts['null_cache'],
+                 max_size=max_size * 2**20 if max_size is not None else None,
+                 max_age=max_age * 86400 if max_age is not None else None)
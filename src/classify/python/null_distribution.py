@@ -0,0 +1,141 @@
+"""Empirical null distribution built one simulation at a time.
+
+Each simulated feature file is scored by a trained classifier, and the vote
+counts of its genes are added to a state file of vote histograms (see
+src.utils.python.vote_histogram). The state is saved after every
+simulation, and simulations already counted in it are skipped, so
+interrupted runs can be continued.
+
+States made on different machines, or at different times, are merged by
+adding their counts, so simulations can be added later without scoring the
+old ones again. The null distribution text file used by classify
+--null-distribution is written from the merged state, with the histograms
+saved next to it.
+
+With --null-cache, the vote histograms of each simulation are cached under
+the hash of the classifier and simulated features (see null_cache).
+"""
+from src.classify.python.r_random_forest_clf import RRandomForest
+from src.classify.python.classifier import trained_rand_forest_pred
+from src.utils.python.vote_histogram import VoteHistogram, sidecar_path
+import src.classify.python.null_cache as null_cache
+import src.utils.python.util as _utils
+import pandas as pd
+import tempfile
+import logging
+import shutil
+import os
+
+logger = logging.getLogger(__name__)
+
+STATE = 'state.npz'  # file name of the state of a simulation in the cache
+
+
+def simulation_name(feature_path):
+    """Name of a simulation in the state file (md5 hash of its features)."""
+    return _utils.file_hash(feature_path)
+
+
+def score_simulation(feature_path, opts):
+    """Vote histograms of the genes of a simulated feature file.
+
+    Parameters
+    ----------
+    feature_path : str
+        features of the simulated genes
+    opts : dict
+        trained_classifier, cv, random_seed, engine, r_worker and
+        null_cache options
+
+    Returns
+    -------
+    null_hist : VoteHistogram
+        vote counts of the simulated genes
+    """
+    name = simulation_name(feature_path)
+    cache_dir = opts.get('null_cache')
+    if cache_dir:
+        cache_key = null_cache.cache_key(opts['trained_classifier'], feature_path,
+                                         opts['cv'], kind='state')
+        paths = null_cache.fetch(cache_dir, cache_key, [STATE])
+        if paths is not None:
+            logger.info('Using cached scores of {0}'.format(feature_path))
+            cached = VoteHistogram.load(paths[STATE])
+            return VoteHistogram(cached.total_votes, cached.counts, [name])
+
+    df = pd.read_csv(feature_path, sep='\t', index_col=0)
+
+    # simulated genes are renamed so that they are never mistaken for genes
+    # of the training data (same as renumbering concatenated simulations)
+    df.index = ['{0}:{1}'.format(name, gene) for gene in df.index]
+
+    rrclf = RRandomForest(df,
+                          seed=opts['random_seed'],
+                          engine=opts.get('engine', 'r'),
+                          r_worker=opts.get('r_worker'))
+    if opts['cv']:
+        rrclf.clf.load_cv(opts['trained_classifier'])
+    else:
+        rrclf.clf.load(opts['trained_classifier'])
+    result_df = trained_rand_forest_pred(rrclf, df, None, is_cv=opts['cv'])
+
+    null_hist = VoteHistogram.from_result(result_df, sources=[name])
+    if null_hist is None:
+        raise ValueError('The genes of {0} do not all have the same number of '
+                         'tree votes'.format(feature_path))
+
+    if cache_dir:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            null_hist.save(os.path.join(tmp_dir, STATE))
+            null_cache.store(cache_dir, cache_key, {STATE: os.path.join(tmp_dir, STATE)})
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        null_cache.evict_cache(opts)
+    return null_hist
+
+
+def merge_states(paths):
+    """Merge the vote histograms of several state files (None if no file)."""
+    null_hist = None
+    for path in paths:
+        state = VoteHistogram.load(path)
+        null_hist = state if null_hist is None else null_hist.merge(state)
+    return null_hist
+
+
+def main(cli_opts):
+    # previously saved states, including the output state if it exists
+    state_paths = list(cli_opts.get('input_states') or [])
+    if (cli_opts['state'] and os.path.exists(cli_opts['state']) and
+            cli_opts['state'] not in state_paths):
+        state_paths.insert(0, cli_opts['state'])
+    null_hist = merge_states(state_paths)
+
+    # score each simulation, and save the state as soon as it is counted
+    for feature_path in cli_opts.get('features') or []:
+        if null_hist is not None and simulation_name(feature_path) in null_hist.sources:
+            logger.info('Skipping {0}, it is already in the null distribution'.format(feature_path))
+            continue
+        if not cli_opts['trained_classifier']:
+            raise ValueError('Scoring simulations needs a trained classifier (-t)')
+        logger.info('Scoring simulated genes of {0} . . .'.format(feature_path))
+        sim_hist = score_simulation(feature_path, cli_opts)
+        null_hist = sim_hist if null_hist is None else null_hist.merge(sim_hist)
+        if cli_opts['state']:
+            null_hist.save(cli_opts['state'])
+
+    if null_hist is None:
+        raise ValueError('No simulated features (-f) or states (-i) were given')
+    if cli_opts['state']:
+        null_hist.save(cli_opts['state'])
+        logger.info('Saved the state of {0} simulations to {1}'.format(
+            len(null_hist.sources), cli_opts['state']))
+
+    # null distribution used by classify
+    if cli_opts['null_distribution']:
+        null_hist.to_null_table().to_csv(cli_opts['null_distribution'], sep='\t',
+                                         index_label='score')
+        null_hist.save(sidecar_path(cli_opts['null_distribution']))
+        logger.info('Saved the null distribution to {0}'.format(
+            cli_opts['null_distribution']))
@@ -1,21 +1,34 @@
 """Random Forest classifier using R's randomForest library.
 RPy2 is used to interface with R."""
 import readline  # hopefully fix libreadline error
-import rpy2.robjects as ro
-from rpy2.robjects import pandas2ri
 import pandas as pd
 from src.classify.python.generic_classifier import GenericClassifier
+from src.classify.python.native_random_forest_clf import NativeClassifier
+import src.classify.python.flat_forest as flat
+import src.classify.python.model_shards as model_shards
 import src.features.python.feature_utils as futils
+import src.utils.python.util as _utils
+import numpy as np
+import time
 import os
 import logging
 
-# check if old pandas version, if not then use new conversion methods
+# R is not needed when using the native random forest engine
 try:
-    import pandas.rpy.common as com
-    new_pandas_flag = False
-except:
-    new_pandas_flag = True
-    pandas2ri.activate()
+    import rpy2.robjects as ro
+    from rpy2.robjects import pandas2ri
+    has_rpy2 = True
+except ImportError:
+    has_rpy2 = False
+
+# check if old pandas version, if not then use new conversion methods
+if has_rpy2:
+    try:
+        import pandas.rpy.common as com
+        new_pandas_flag = False
+    except:
+        new_pandas_flag = True
+        pandas2ri.activate()
 
 class MyClassifier(object):
     """
@@ -25,16 +38,26 @@ class MyClassifier(object):
     fit, predic_proba). The advantage of R's version of random forest is
     that it allows the sampling rate to be specified.
     """
+    fold_ext = '.rds'  # file extension of models saved by save_fold
 
     def __init__(self,
                  ntrees=200,
                  other_sample_ratio=1.,
-                 driver_sample=.7):
+                 driver_sample=.7,
+                 model_cache=None):
         self.ntrees = ntrees
         # self.other_sample_rate = other_sample
         self.other_sample_ratio = other_sample_ratio
         self.driver_sample_rate = driver_sample
 
+        # loaded .Rdata files, keyed by their file hash. Only used
+        # by long running processes that load the same models repeatedly.
+        self.model_cache = model_cache
+        self.rf = None
+        self._feature_importances = None
+        self.shards = None  # fold model files of a sharded model directory
+        self.flat_cv = None  # all CV models flattened for predict_proba_cv
+
         # Code for R's random forest using rpy2
         ro.r("suppressPackageStartupMessages(library(randomForest))")  # load randomForest library
 
@@ -52,15 +75,31 @@ class MyClassifier(object):
                                         ntree=ntree,
                                         classwt=1/sampSize,
                                         sampsize=sampSize,
-                                        importance=TRUE)
+                                        importance=FALSE)
                 return(rf_clf)
              }''')
         self.rf_fit = ro.r['rf_fit']
 
-        # R function for getting feature importance
+        # R function for fitting a random forest on rows of the data
+        # previously sent to R by set_data
+        ro.r('''rf_fit_rows <- function(ix, ntree, sampSize){
+                return(rf_fit(cvData[ix,], ntree, sampSize))
+             }''')
+        self.rf_fit_rows = ro.r['rf_fit_rows']
+
+        # R function for adding the trees of a new forest to a forest
+        ro.r('''rf_combine <- function(rf, rf_new){
+                rf_clf <<- combine(rf, rf_new)
+                return(rf_clf)
+             }''')
+        self.rf_combine = ro.r['rf_combine']
+
+        # R function for getting feature importance (mean decrease in gini).
+        # Permutation importance is computed separately when requested
+        # (see GenericClassifier.permutation_importance).
         ro.r('''rf_imp <- function(rf){
                 myimp <- importance(rf)
-                return(myimp[,5])
+                return(myimp[,"MeanDecreaseGini"])
              }''')
         self.rf_imp = ro.r['rf_imp']
 
@@ -71,6 +110,14 @@ class MyClassifier(object):
              }''')
         self.rf_pred_prob = ro.r['rf_pred_prob']
 
+        # R function for predicting class probability of rows of the
+        # data previously sent to R by set_data
+        ro.r('''rf_pred_prob_rows <- function(rf, ix){
+                prob <- predict(rf, cvData[ix,], type="prob")
+                return(prob)
+             }''')
+        self.rf_pred_prob_rows = ro.r['rf_pred_prob_rows']
+
         # R function for predicting class
         if new_pandas_flag:
             ro.r('''rf_pred <- function(rf, xtest){
@@ -85,6 +132,33 @@ class MyClassifier(object):
                 return(prob)
              }''')
         self.rf_pred = ro.r['rf_pred']
+        self.r_get = ro.r['get']
+
+        # R function for extracting the node arrays of every tree.
+        # Children of leaves are 0 and nodepred is the 1-based class.
+        ro.r('''rf_flat <- function(rf){
+                f <- rf$forest
+                n <- f$ndbigtree
+                ix <- unlist(lapply(seq_along(n), function(t) (t-1)*f$nrnodes + seq_len(n[t])))
+                return(list(ndbigtree=n,
+                            bestvar=as.vector(f$bestvar)[ix],
+                            xbestsplit=as.vector(f$xbestsplit)[ix],
+                            left=as.vector(f$treemap[,1,])[ix],
+                            right=as.vector(f$treemap[,2,])[ix],
+                            nodepred=as.vector(f$nodepred)[ix],
+                            xnames=rownames(rf$importance),
+                            classes=as.integer(rf$classes)))
+             }''')
+        self.rf_flat = ro.r['rf_flat']
+
+        # R function for the out-of-bag votes of the training genes
+        ro.r('''rf_oob <- function(rf){
+                v <- rf$votes
+                return(list(votes=as.vector(v), genes=rownames(v),
+                            classes=as.integer(colnames(v)),
+                            oob.times=rf$oob.times))
+             }''')
+        self.rf_oob = ro.r['rf_oob']
 
     def set_sample_size(self, sampsize):
         # sampsize[0] *= self.other_sample_rate
@@ -98,7 +172,7 @@ class MyClassifier(object):
         sampsize[0] = int(self.other_sample_ratio * tmp_total_driver)
         self.sample_size = ro.IntVector(sampsize)
 
-    def fit(self, xtrain, ytrain):
+    def fit(self, xtrain, ytrain, ntrees=None, grow=False):
         """The fit method trains R's random forest classifier.
 
         NOTE: the method name ("fit") and method signature were choosen
@@ -110,7 +184,52 @@ class MyClassifier(object):
             features for training set
         ytrain : pd.DataFrame
             true class labels (as integers) for training set
+        ntrees : int or None
+            number of trees to train, instead of self.ntrees
+        grow : bool
+            add the trees to the current forest, instead of replacing it
         """
+        self._set_sample_size_from_labels(ytrain)
+        # add labels without modifying the caller's data frame
+        xtrain = xtrain.assign(true_class=np.asarray(ytrain))
+
+        # convert
+        r_xtrain = self._to_r_dataframe(xtrain)
+        #ro.globalenv['trainData'] = r_xtrain
+        prev_rf = self.rf if grow else None
+        ntrees = self.ntrees if ntrees is None else ntrees
+        self.rf = self.rf_fit(r_xtrain, ntrees, self.sample_size)
+        self._grow(prev_rf)
+
+    def fit_rows(self, train_ix, ytrain, ntrees=None, grow=False):
+        """Train R's random forest on rows of the data sent by set_data.
+
+        Parameters
+        ----------
+        train_ix : np.array
+            row numbers (starting from 0) of the training set
+        ytrain : pd.Series
+            true class labels (as integers) for training set
+        ntrees : int or None
+            number of trees to train, instead of self.ntrees
+        grow : bool
+            add the trees to the current forest, instead of replacing it
+        """
+        self._set_sample_size_from_labels(ytrain)
+        r_ix = ro.IntVector((np.asarray(train_ix) + 1).tolist())
+        prev_rf = self.rf if grow else None
+        ntrees = self.ntrees if ntrees is None else ntrees
+        self.rf = self.rf_fit_rows(r_ix, ntrees, self.sample_size)
+        self._grow(prev_rf)
+
+    def _grow(self, prev_rf):
+        """Combine the newly trained trees with the previous forest."""
+        if prev_rf is not None:
+            self.rf = self.rf_combine(prev_rf, self.rf)
+        self._feature_importances = None  # fetched from R when needed
+
+    def _set_sample_size_from_labels(self, ytrain):
+        """Set the per class sample size from the training labels."""
         label_counts = ytrain.value_counts()
         if self.is_onco_pred and self.is_tsg_pred:
             sampsize = [label_counts[self.other_num],
@@ -124,22 +243,53 @@ class MyClassifier(object):
                         label_counts[self.tsg_num]]
 
         self.set_sample_size(sampsize)
-        ytrain.index = xtrain.index  # ensure indexes match
-        xtrain['true_class'] = ytrain
 
-        # convert
+    @property
+    def feature_importances_(self):
+        """Mean decrease in gini index of the current model, fetched
+        from R only when used."""
+        if self._feature_importances is None and self.rf is not None:
+            r_imp = self.rf_imp(self.rf)  # importance dataframe in R
+            if new_pandas_flag:
+                self._feature_importances = pandas2ri.ri2py(r_imp)
+            else:
+                self._feature_importances = com.convert_robj(r_imp)
+        return self._feature_importances
+
+    @feature_importances_.setter
+    def feature_importances_(self, importance):
+        self._feature_importances = importance
+
+    def _to_r_dataframe(self, df):
         if new_pandas_flag:
-            r_xtrain = pandas2ri.py2ri(xtrain)
+            return pandas2ri.py2ri(df)
         else:
-            r_xtrain = com.convert_to_r_dataframe(xtrain)
-        #ro.globalenv['trainData'] = r_xtrain
-        self.rf = self.rf_fit(r_xtrain, self.ntrees, self.sample_size)
-        r_imp = self.rf_imp(self.rf)  # importance dataframe in R
-        if new_pandas_flag:
-            self.feature_importances_ = pandas2ri.ri2py(r_imp)
-        else:
-            self.feature_importances_ = com.convert_robj(r_imp)
-        #self.feature_importances_ = pandas2ri.ri2py(r_imp)
+            return com.convert_to_r_dataframe(df)
+
+    def set_data(self, x, y):
+        """Send the features and true class labels to R.
+
+        The data is converted to a R data frame only once, after which
+        folds are trained and predicted by row number using fit_rows
+        and predict_proba_rows.
+
+        Parameters
+        ----------
+        x : pd.DataFrame
+            features for all genes
+        y : pd.Series
+            true class labels (as integers) for all genes
+
+        Returns
+        -------
+        elapsed : float
+            seconds spent converting the data to R
+        """
+        start = time.time()
+        df = x.copy()
+        df['true_class'] = y.reindex(x.index)
+        ro.globalenv['cvData'] = self._to_r_dataframe(df)
+        return time.time() - start
 
     def save(self, path):
         """Save random forest model as a Rdata file."""
@@ -151,13 +301,132 @@ class MyClassifier(object):
         ro.r('''save(rf_pred_prob, rf_pred, rf_imp, rf_fit, cvFoldDf,
                      trained.models, file="{0}")'''.format(path))
 
+    def save_fold(self, path):
+        """Save the random forest model of a single fold as a RDS file."""
+        ro.r('saveRDS(rf_clf, file="{0}")'.format(path))
+
+    def load_fold(self, path):
+        """Load the random forest model of a single fold saved by save_fold."""
+        ro.r('rf_clf <- readRDS("{0}")'.format(path))
+        self.rf = ro.r["rf_clf"]
+
+    def _flat(self, rf):
+        """Convert a R random forest to a FlatForest."""
+        r_flat = self.rf_flat(rf)
+        get = lambda name: np.asarray(r_flat.rx2(name))
+        ndbigtree = get('ndbigtree').astype(np.int64)
+        left = get('left').astype(np.int64) - 1
+        is_leaf = left < 0
+        nodes = {'split_feature': np.where(is_leaf, -1, get('bestvar') - 1),
+                 'threshold': np.where(is_leaf, 0, get('xbestsplit')),
+                 'left': left,
+                 'right': get('right').astype(np.int64) - 1,
+                 'leaf_class': np.where(is_leaf, get('nodepred') - 1, -1)}
+        for name in ['split_feature', 'left', 'right', 'leaf_class']:
+            nodes[name] = nodes[name].astype(np.int32)
+        nodes['threshold'] = nodes['threshold'].astype(np.float64)
+        tree_offsets = np.concatenate([[0], np.cumsum(ndbigtree)])
+        return flat.FlatForest(nodes, tree_offsets, get('classes'),
+                               list(r_flat.rx2('xnames')))
+
+    def save_flat(self, path):
+        """Save random forest model in the portable .npz format."""
+        flat.save_flat(path, [(0, 0, self._flat(self.rf))])
+
+    def save_flat_cv(self, path):
+        """Save cross-validated random forest models in the portable .npz format."""
+        flat.save_flat(path, self._cv_forests(), cv_folds=self._cv_fold_df())
+
+    def _cv_forests(self):
+        """(iteration, fold, FlatForest) of each cross-validation model."""
+        rf_cv = getattr(self, 'rf_cv', None)
+        if self.shards is not None:
+            # read one fold model at a time
+            forests = [(i, j, self._flat(ro.r['readRDS'](shard_path)))
+                       for (i, j), shard_path in sorted(self.shards.items())]
+        else:
+            if rf_cv is None:
+                rf_cv = ro.r["trained.models"]
+            forests = [(i, j, self._flat(rf_cv.rx2(i).rx2(j)))
+                       for i in range(1, len(rf_cv)+1)
+                       for j in range(1, len(rf_cv.rx2(i))+1)]
+        return forests
+
+    def _cv_fold_df(self):
+        """Fold in which each gene was held-out, as a DataFrame."""
+        cv_folds = getattr(self, 'cv_folds', None)
+        if cv_folds is None:
+            cv_folds = ro.r["cvFoldDf"]
+        if not isinstance(cv_folds, pd.DataFrame):
+            cv_folds = pandas2ri.ri2py(cv_folds)
+        return cv_folds
+
+    def predict_proba_cv(self, xtest, num_iter, return_votes=False):
+        """Predicts the gene hold-out cross-validated probability for each
+        class, evaluating the models of all folds at once.
+
+        The R models are converted to the flat format once, instead of
+        predicting every fold through rpy2 (see flat_forest).
+
+        Parameters
+        ----------
+        xtest : pd.DataFrame
+            features for test set
+        num_iter : int
+            number of cross-validation iterations
+        return_votes : bool
+            also return the number of tree votes summed over iterations
+        """
+        if self.flat_cv is None:
+            self.flat_cv = flat.FlatModelFile.from_forests(self._cv_forests(),
+                                                           self._cv_fold_df())
+        return self.flat_cv.predict_proba_cv(xtest, num_iter,
+                                             return_votes=return_votes)
+
+    def _load_cached(self, path):
+        """Load a .Rdata file into its own R environment, reusing
+        the environment if the same file was loaded before."""
+        key = _utils.file_hash(path)
+        env = self.model_cache.get(key)
+        if env is None:
+            env = ro.r('new.env()')
+            ro.r['load'](os.path.abspath(path), envir=env)
+            if self.model_cache.put(key, env):
+                ro.r('gc()')  # free the memory of evicted models
+        return env
+
+    def _check_not_flat(self, path):
+        if path.endswith('.npz'):
+            raise ValueError('Models in the portable .npz format are loaded '
+                             'with the native engine (--engine native)')
+
     def load(self, path):
+        self._check_not_flat(path)
+        if self.model_cache is not None:
+            env = self._load_cached(path)
+            self.rf = self.r_get("rf_clf", envir=env)
+            return
         set_wd_str = 'setwd("{0}")'.format(os.getcwd())
         ro.r(set_wd_str)
         ro.r('load("{0}")'.format(path))
         self.rf = ro.r["rf_clf"]
 
     def load_cv(self, path):
+        self._check_not_flat(path)
+        self.shards = None
+        self.flat_cv = None
+        if model_shards.is_sharded(path):
+            # fold models are read by set_model when needed
+            self.shards, self.cv_folds = model_shards.read_manifest(path)
+            self.rf_cv = None
+            return
+        if self.model_cache is not None:
+            env = self._load_cached(path)
+            self.rf_cv = self.r_get("trained.models", envir=env)
+            self.cv_folds = self.r_get("cvFoldDf", envir=env)
+            if not new_pandas_flag:
+                self.cv_folds = com.convert_robj(self.cv_folds)
+            return
         set_wd_str = 'setwd("{0}")'.format(os.getcwd())
         ro.r(set_wd_str)
         ro.r('load("{0}")'.format(path))
@@ -183,6 +452,9 @@ class MyClassifier(object):
         num_fold : int
             The particular fold for each cross-validation
         """
+        if self.shards is not None:
+            self.load_fold(self.shards[(num_iter, num_fold)])
+            return
         self.rf = self.rf_cv.rx2(num_iter).rx2(num_fold)
 
     def append_cv_result(self):
@@ -195,6 +467,7 @@ class MyClassifier(object):
 
     def set_cv_fold(self, df):
         """Send which genes are valid test sets for each CV fold."""
+        self.flat_cv = None  # flattened from the newly trained models when needed
         if new_pandas_flag:
             r_df = pandas2ri.py2ri(df)
         else:
@@ -218,6 +491,16 @@ class MyClassifier(object):
             self.onco_num = 1 if oncogene else 0
             self.tsg_num = 1 if tsg else 0
 
+    def set_params(self, ntrees=None, other_sample_ratio=None, driver_sample=None):
+        """Change the random forest parameters used by the next fit
+        (parameters that are None are kept)."""
+        if ntrees is not None:
+            self.ntrees = ntrees
+        if other_sample_ratio is not None:
+            self.other_sample_ratio = other_sample_ratio
+        if driver_sample is not None:
+            self.driver_sample_rate = driver_sample
+
     def set_seed(self, seed):
         if seed is not None:
             ro.r('set.seed({0})'.format(seed))
@@ -275,6 +558,50 @@ class MyClassifier(object):
         #py_pred_prob = pandas2ri.ri2py(pred_prob)
         return py_pred_prob
 
+    def num_trees(self):
+        """Number of trees in the current model."""
+        return int(self.rf.rx2('ntree')[0])
+
+    def oob_proba(self):
+        """Fraction of out-of-bag votes for each class of the genes used
+        to train the current model. Genes never out-of-bag are NaN.
+
+        Returns
+        -------
+        oob : pd.DataFrame
+            genes by classes out-of-bag vote fractions
+        """
+        r_oob = self.rf_oob(self.rf)
+        genes = [str(g) for g in r_oob.rx2('genes')]
+        classes = list(np.asarray(r_oob.rx2('classes')))
+        votes = np.asarray(r_oob.rx2('votes'), dtype=float)
+        votes = votes.reshape((len(genes), len(classes)), order='F')
+        return pd.DataFrame(votes, index=genes, columns=classes)
+
+    def num_oob_trees(self):
+        """Number of trees for which each gene used to train the current
+        model was out-of-bag."""
+        r_oob = self.rf_oob(self.rf)
+        genes = [str(g) for g in r_oob.rx2('genes')]
+        return pd.Series(np.asarray(r_oob.rx2('oob.times'), dtype=np.int64),
+                         index=genes)
+
+    def predict_proba_rows(self, test_ix):
+        """Predicts the probability for each class of rows of the data
+        sent by set_data.
+
+        Parameters
+        ----------
+        test_ix : np.array
+            row numbers (starting from 0) of the test set
+        """
+        r_ix = ro.IntVector((np.asarray(test_ix) + 1).tolist())
+        pred_prob = self.rf_pred_prob_rows(self.rf, r_ix)
+        if new_pandas_flag:
+            return pandas2ri.ri2py(pred_prob)
+        else:
+            return com.convert_robj(pred_prob).values
+
 
 class RRandomForest(GenericClassifier):
 
@@ -284,7 +611,16 @@ class RRandomForest(GenericClassifier):
                  ntrees=200,
                  other_sample_ratio=1.,
                  driver_sample=.7,
-                 seed=None):
+                 seed=None,
+                 processes=1,
+                 engine='r',
+                 r_worker=None,
+                 send_data_once=True,
+                 early_stop_tol=None,
+                 tree_batch=50,
+                 fold_plan=None,
+                 checkpoint=None,
+                 resume=False):
         self.logger = logging.getLogger(__name__)
         onco_flag, tsg_flag = True, True  # classes to actually classify
         super(RRandomForest, self).__init__(total_iter,
@@ -292,6 +628,10 @@ class RRandomForest(GenericClassifier):
                                             classify_tsg=tsg_flag,
                                             rseed=seed)  # call base constructor
         self.is_weighted_sample = weight
+        self.set_num_processes(processes)
+        self.set_early_stopping(early_stop_tol, tree_batch)
+        self.set_fold_plan_path(fold_plan)
+        self.set_checkpoint(checkpoint, resume)
 
         if 'total' in df.columns:
             # hack to get rid of total mutation count column
@@ -301,13 +641,40 @@ class RRandomForest(GenericClassifier):
         # randomization is mostly done in prediciton methods
         self.x, self.y = futils.randomize(df, self.prng)
 
-        # use the MyClassifier wrapper class around R
-        self.clf = MyClassifier(ntrees=ntrees,
-                                driver_sample=driver_sample,
-                                other_sample_ratio=other_sample_ratio)
+        # in-process R and the R worker give the same folds
+        self.engine = engine
+        if engine == 'native':
+            # use the numpy/scikit-learn implementation
+            self.clf = NativeClassifier(ntrees=ntrees,
+                                        driver_sample=driver_sample,
+                                        other_sample_ratio=other_sample_ratio)
+        elif engine == 'r' and r_worker:
+            # R runs in a separate long-lived worker process
+            from src.classify.python.r_worker import RWorkerClient
+            self.clf = RWorkerClient(r_worker,
+                                     ntrees=ntrees,
+                                     driver_sample=driver_sample,
+                                     other_sample_ratio=other_sample_ratio)
+            if self.num_processes > 1:
+                self.logger.warning('The R worker runs one fold at a time, '
+                                    'so only a single process is used.')
+                self.set_num_processes(1)
+        elif engine == 'r':
+            if not has_rpy2:
+                raise ImportError('rpy2 is needed for the R random forest engine. '
+                                  'Install rpy2 or use the native engine.')
+            # use the MyClassifier wrapper class around R
+            self.clf = MyClassifier(ntrees=ntrees,
+                                    driver_sample=driver_sample,
+                                    other_sample_ratio=other_sample_ratio)
+        else:
+            raise ValueError('Unknown random forest engine: {0}'.format(engine))
         self.clf.set_classes(onco_flag, tsg_flag)
         self.clf.set_seed(seed)
 
+        # convert the data to R only once for cross-validation
+        self.send_data_once = send_data_once and engine == 'r'
+
     def _update_metrics(self, y_true, y_pred, onco_prob, tsg_prob):
         super(RRandomForest, self)._update_metrics(y_true, y_pred, onco_prob, tsg_prob)
 
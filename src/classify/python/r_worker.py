@@ -0,0 +1,251 @@
+"""Long-lived R worker process for the R random forest.
+
+Starting R, loading the randomForest library and reading large .Rdata
+files is repeated by every 2020plus.py call. The worker keeps a single
+R session running and listens on a Unix socket, so consecutive train
+and classify commands can skip R's startup. Loaded models are kept in
+memory keyed by the hash of the .Rdata file, up to a maximum number of
+models (see ModelCache).
+
+Clients authenticate with a random key, written next to the socket
+({socket}.key) and readable only by the user who started the worker.
+
+The RWorkerClient class has the same methods as MyClassifier, and
+forwards each call to the MyClassifier living in the worker process.
+"""
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+from collections import OrderedDict
+import traceback
+import signal
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# methods whose first argument is a file path
+_path_methods = set(['save', 'save_cv', 'save_fold', 'save_flat', 'save_flat_cv',
+                     'load_fold', 'load', 'load_cv'])
+
+# attributes of MyClassifier that are data rather than methods
+_remote_attributes = set(['cv_folds', 'feature_importances_', 'ntrees', 'fold_ext',
+                          'driver_sample_rate', 'other_sample_ratio'])
+
+
+def key_path(address):
+    """Path of the authentication key of the worker listening on address."""
+    return address + '.key'
+
+
+def _write_key(address):
+    """Write a new random authentication key, readable only by the user."""
+    key = os.urandom(32)
+    fd = os.open(key_path(address), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as handle:
+        handle.write(key)
+    return key
+
+
+def _read_key(address):
+    with open(key_path(address), 'rb') as handle:
+        return handle.read()
+
+
+class ModelCache(object):
+    """Loaded models keyed by the hash of their file.
+
+    Only the most recently used max_models models are kept, since a
+    long-lived worker may load many large models.
+    """
+
+    def __init__(self, max_models=4):
+        self.max_models = max(1, max_models)
+        self._models = OrderedDict()
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def get(self, key):
+        """Model of the key (None if not cached), marked as recently used."""
+        if key not in self._models:
+            return None
+        model = self._models.pop(key)
+        self._models[key] = model
+        return model
+
+    def put(self, key, model):
+        """Cache a model, and return the number of models evicted."""
+        self._models.pop(key, None)
+        self._models[key] = model
+        num_evicted = 0
+        while len(self._models) > self.max_models:
+            self._models.popitem(last=False)
+            num_evicted += 1
+        return num_evicted
+
+
+class IdleTimeout(Exception):
+    pass
+
+
+def _raise_idle_timeout(signum, frame):
+    raise IdleTimeout()
+
+
+def handle_connection(conn, model_cache):
+    """Run MyClassifier methods requested by a single client connection."""
+    from src.classify.python.r_random_forest_clf import MyClassifier
+    clf = None
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        kind = msg[0]
+        try:
+            if kind == 'init':
+                clf = MyClassifier(model_cache=model_cache, **msg[1])
+                result = None
+            elif kind == 'getattr':
+                result = getattr(clf, msg[1])
+            elif kind == 'call':
+                name, args, kwargs = msg[1:]
+                result = getattr(clf, name)(*args, **kwargs)
+            elif kind == 'shutdown':
+                conn.send(('ok', None))
+                return False
+            else:
+                raise ValueError('Unknown R worker request: {0}'.format(kind))
+            conn.send(('ok', result))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+    return True
+
+
+def serve(address, idle_timeout=None, max_models=4):
+    """Listen for client connections on a Unix socket.
+
+    Clients are served one at a time, since there is a single R session.
+
+    Parameters
+    ----------
+    address : str
+        path of the Unix socket
+    idle_timeout : int or None
+        stop the worker after this many seconds without a client
+    max_models : int
+        largest number of loaded models kept in memory
+    """
+    # remove stale socket and key from a previous worker
+    for path in [address, key_path(address)]:
+        if os.path.exists(path):
+            os.remove(path)
+    authkey = _write_key(address)
+
+    # the socket is only accessible by the user from the moment it exists
+    old_umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family='AF_UNIX', authkey=authkey)
+    finally:
+        os.umask(old_umask)
+    logger.info('R worker listening on {0}'.format(address))
+
+    model_cache = ModelCache(max_models)
+    if idle_timeout:
+        signal.signal(signal.SIGALRM, _raise_idle_timeout)
+    try:
+        keep_running = True
+        while keep_running:
+            if idle_timeout:
+                signal.alarm(idle_timeout)
+            try:
+                conn = listener.accept()
+            except IdleTimeout:
+                logger.info('R worker was idle for {0} seconds.'.format(idle_timeout))
+                break
+            except (AuthenticationError, EOFError, IOError):
+                logger.warning('Rejected a R worker client that failed to authenticate.')
+                continue
+            finally:
+                if idle_timeout:
+                    signal.alarm(0)
+            try:
+                keep_running = handle_connection(conn, model_cache)
+            finally:
+                conn.close()
+    finally:
+        listener.close()
+        for path in [address, key_path(address)]:
+            if os.path.exists(path):
+                os.remove(path)
+    logger.info('R worker stopped.')
+
+
+def connect(address, timeout=30):
+    """Connect to a R worker, waiting for it to start if needed."""
+    start = time.time()
+    while True:
+        try:
+            return Client(address, family='AF_UNIX', authkey=_read_key(address))
+        except (IOError, OSError):
+            if time.time() - start > timeout:
+                raise
+            time.sleep(.5)
+
+
+class RWorkerClient(object):
+    """
+    Drop-in replacement for MyClassifier that runs R's random forest
+    within a R worker process (see serve).
+    """
+
+    def __init__(self, address, **kwargs):
+        self._conn = connect(address)
+        self._request(('init', kwargs))
+
+    def _request(self, msg):
+        self._conn.send(msg)
+        status, result = self._conn.recv()
+        if status == 'error':
+            raise RuntimeError('R worker error:\n{0}'.format(result))
+        return result
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in _remote_attributes:
+            return self._request(('getattr', name))
+        from src.classify.python.r_random_forest_clf import MyClassifier
+        if not hasattr(MyClassifier, name):
+            # keep hasattr checks of optional methods truthful
+            raise AttributeError(name)
+
+        def remote_method(*args, **kwargs):
+            if name in _path_methods:
+                # the worker may run in another working directory
+                args = (os.path.abspath(args[0]),) + args[1:]
+            return self._request(('call', name, args, kwargs))
+        return remote_method
+
+    def close(self):
+        self._conn.close()
+
+
+def shutdown(address):
+    """Ask a running R worker to stop."""
+    conn = connect(address, timeout=0)
+    conn.send(('shutdown',))
+    conn.recv()
+    conn.close()
+
+
+def main(cli_opts):
+    if cli_opts['stop']:
+        shutdown(cli_opts['socket'])
+    else:
+        serve(cli_opts['socket'], idle_timeout=cli_opts['idle_timeout'],
+              max_models=cli_opts.get('max_models', 4))
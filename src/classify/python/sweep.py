@@ -0,0 +1,162 @@
+"""Hyperparameter sweep of the random forest.
+
+Every combination of --ntrees, --driver-rate and --other-ratio is
+evaluated by cross-validation (kfold_validation), as classify does without
+a trained classifier. All settings use the same fold plan, so they are
+compared on identical folds. Settings are run in a pool of processes, where
+each process sends the data to its classifier once and only changes the
+random forest parameters between settings.
+"""
+from src.classify.python.r_random_forest_clf import RRandomForest
+from src.classify.python.classifier import rand_forest_pred
+from src.classify.python.fold_plan import FoldPlan
+import src.features.python.feature_utils as futils
+import src.utils.python.seeds as seeds
+from multiprocessing import Pool
+import itertools
+import tempfile
+import shutil
+import pandas as pd
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+NUM_FOLDS = 10  # same as classify
+
+# classifier of a sweep process (see _init_sweep)
+_sweep_clf = None
+_sweep_data = None
+
+
+def _init_sweep(df, null_dist, opts):
+    """Create the classifier used for every setting run by this process."""
+    global _sweep_clf, _sweep_data
+    _sweep_clf = RRandomForest(df,
+                               total_iter=opts['iterations'],
+                               seed=opts['random_seed'],
+                               engine=opts.get('engine', 'r'),
+                               fold_plan=opts['fold_plan'])
+    _sweep_data = (df, null_dist)
+
+
+def _run_setting(setting):
+    """Cross-validate a single (ntrees, driver rate, other ratio) setting.
+
+    Returns
+    -------
+    result : list
+        the setting, ROC/PR AUCs, runtime and number of significant genes
+    """
+    ntrees, driver_rate, other_ratio = setting
+    df, null_dist = _sweep_data
+    _sweep_clf.clf.set_params(ntrees=ntrees,
+                              other_sample_ratio=other_ratio,
+                              driver_sample=driver_rate)
+    start = time.time()
+    prediction = _sweep_clf.kfold_validation(k=NUM_FOLDS)
+    runtime = time.time() - start
+    logger.info('ntrees={0}, driver rate={1}, other ratio={2}: {3:.1f}s'.format(
+        ntrees, driver_rate, other_ratio, runtime))
+
+    # significant genes (majority vote without a null distribution)
+    result_df = rand_forest_pred(_sweep_clf, df, None, null_dist=null_dist,
+                                 prediction=prediction)
+    if null_dist is None:
+        num_onco = (result_df['majority vote class'] == _sweep_clf.onco_num).sum()
+        num_tsg = (result_df['majority vote class'] == _sweep_clf.tsg_num).sum()
+        num_driver = result_df['majority vote cancer gene'].sum()
+    else:
+        num_onco = (result_df['oncogene q-value'] <= .1).sum()
+        num_tsg = (result_df['tsg q-value'] <= .1).sum()
+        num_driver = (result_df['driver q-value'] <= .1).sum()
+
+    return [ntrees, driver_rate, other_ratio,
+            _sweep_clf.onco_mean_roc_auc, _sweep_clf.tsg_mean_roc_auc,
+            _sweep_clf.driver_mean_roc_auc, _sweep_clf.onco_mean_pr_auc,
+            _sweep_clf.tsg_mean_pr_auc, _sweep_clf.driver_mean_pr_auc,
+            runtime, num_onco, num_tsg, num_driver]
+
+
+def sweep(df, settings, opts, null_dist=None):
+    """Cross-validate every setting, possibly in parallel.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        features of each gene
+    settings : list
+        (ntrees, driver rate, other ratio) of each setting
+    opts : dict
+        iterations, random_seed, engine, fold_plan and processes options
+    null_dist : pd.DataFrame or None
+        null distribution relating scores to p-values
+
+    Returns
+    -------
+    result_df : pd.DataFrame
+        performance of each setting, in the order of settings
+    """
+    num_processes = min(max(1, opts.get('processes', 1)), len(settings))
+    if num_processes > 1:
+        pool = Pool(processes=num_processes, initializer=_init_sweep,
+                    initargs=(df, null_dist, opts))
+        try:
+            results = pool.map(_run_setting, settings, chunksize=1)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        _init_sweep(df, null_dist, opts)
+        results = [_run_setting(s) for s in settings]
+
+    cols = ['ntrees', 'driver rate', 'other ratio',
+            'oncogene ROC AUC', 'tsg ROC AUC', 'driver ROC AUC',
+            'oncogene PR AUC', 'tsg PR AUC', 'driver PR AUC',
+            'runtime (s)', 'num oncogenes', 'num tsg', 'num drivers']
+    return pd.DataFrame(results, columns=cols)
+
+
+def main(cli_opts):
+    df = pd.read_csv(cli_opts['features'], sep='\t', index_col=0)
+    if 'total' in df.columns:
+        # same as RRandomForest
+        df = df.drop('total', axis=1)
+    if cli_opts.get('null_distribution'):
+        null_dist = pd.read_csv(cli_opts['null_distribution'], sep='\t',
+                                index_col=0)
+    else:
+        null_dist = None
+
+    # every combination of the parameter grid
+    settings = list(itertools.product(cli_opts['ntrees'],
+                                      cli_opts['driver_rate'],
+                                      cli_opts['other_ratio']))
+    logger.info('Sweeping {0} random forest settings . . .'.format(len(settings)))
+
+    # build the folds once, and share them with every process. Every
+    # setting uses the same master seed, so that the plan matches.
+    opts = dict(cli_opts)
+    opts['random_seed'] = seeds.master_seed(opts['random_seed'])
+    tmp_dir = None
+    if not opts.get('fold_plan'):
+        tmp_dir = tempfile.mkdtemp()
+        opts['fold_plan'] = os.path.join(tmp_dir, 'fold_plan.npz')
+    try:
+        genes = df.sort_index().index
+        labels = genes.to_series().apply(futils.label_gene).values
+        if not (os.path.exists(opts['fold_plan']) and
+                FoldPlan.load(opts['fold_plan']).matches(genes, labels, opts['iterations'],
+                                                          NUM_FOLDS, opts['random_seed'])):
+            plan = FoldPlan.build(genes, labels, opts['iterations'], NUM_FOLDS,
+                                  opts['random_seed'])
+            plan.save(opts['fold_plan'])
+        result_df = sweep(df, settings, opts, null_dist)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    result_df.to_csv(cli_opts['output'], sep='\t', index=False)
+    logger.info('Saved sweep results to {0}'.format(cli_opts['output']))
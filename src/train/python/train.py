@@ -1,6 +1,7 @@
 from src.classify.python.r_random_forest_clf import RRandomForest
 import src.utils.python.util as _utils
 import pandas as pd
+import os
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,16 +26,47 @@ def main(cli_opts):
                           other_sample_ratio=cli_opts['other_ratio'],
                           driver_sample=cli_opts['driver_rate'],
                           ntrees=cli_opts['ntrees'],
-                          seed=cli_opts['random_seed'])
+                          seed=cli_opts['random_seed'],
+                          processes=cli_opts.get('processes', 1),
+                          engine=cli_opts.get('engine', 'r'),
+                          r_worker=cli_opts.get('r_worker'),
+                          early_stop_tol=cli_opts.get('early_stop_tol'),
+                          tree_batch=cli_opts.get('tree_batch', 50),
+                          fold_plan=cli_opts.get('fold_plan'),
+                          checkpoint=cli_opts.get('checkpoint'),
+                          resume=cli_opts.get('resume', False))
+
+    # sharded models are written to the output directory while training
+    is_sharded = cli_opts.get('sharded', False)
+    if is_sharded:
+        if not cli_opts['cv']:
+            raise ValueError('The --sharded option requires --cv')
+        if cli_opts['output'].endswith('.npz'):
+            raise ValueError('The --sharded option writes a directory, not a '
+                             '.npz file (see scripts/python/export_flat_model.py)')
+        if not os.path.isdir(cli_opts['output']):
+            os.makedirs(cli_opts['output'])
+
     # train on entire data
-    if cli_opts['cv']:
+    if is_sharded:
+        logger.info('Saving fold models to {0} . . .'.format(cli_opts['output']))
+        rrclf.train_cv(model_dir=cli_opts['output'])
+        logger.info('Finished training.')
+        return
+    elif cli_opts['cv']:
         rrclf.train_cv()
     else:
         rrclf.train()
     logger.info('Finished training.')
     logger.info('Saving classifier to . . .')
-    if cli_opts['cv']:
+    # .npz output uses the portable flat array format
+    is_flat = cli_opts['output'].endswith('.npz')
+    if cli_opts['cv'] and is_flat:
+        rrclf.clf.save_flat_cv(cli_opts['output'])
+    elif cli_opts['cv']:
         rrclf.clf.save_cv(cli_opts['output'])
+    elif is_flat:
+        rrclf.clf.save_flat(cli_opts['output'])
     else:
         rrclf.clf.save(cli_opts['output'])
     logger.info('Finished saving classifier.')
@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+import scipy.optimize as optimize
 import bisect
 
 # genes to be removed from MLFC calc
@@ -35,33 +36,270 @@ mlfc_remove_genes = set([
 ])
 
 
+# score column and p-value column of each kind of null distribution
+score_pval_cols = [('oncogene score', 'oncogene p-value'),
+                   ('tsg score', 'tsg p-value'),
+                   ('driver score', 'driver p-value')]
+
+
 def compute_p_value(scores, null_p_values):
     """Get the p-value for each score by examining the list null distribution
     where scores are obtained by a certain probability.
 
-    NOTE: uses score2pval function
+    All scores are looked up at once with np.searchsorted, with the same
+    rules as score2pval: the p-value of the smallest null score above the
+    score, the last p-value for a score equal to the largest null score,
+    and a p-value of zero beyond the largest null score.
 
     Parameters
     ----------
     scores : pd.Series
         series of observed scores
     null_p_values: pd.Series
-        Empirical null distribution, index are scores and values are p values
+        Empirical null distribution, index are scores (in descending
+        order) and values are p values
 
     Returns
     -------
     pvals : pd.Series
         Series of p values for scores
     """
-    num_scores = len(scores)
-    pvals = pd.Series(np.zeros(num_scores))
-    null_p_val_scores = list(reversed(null_p_values.index.tolist()))
-    #null_p_values = null_p_values.ix[null_p_val_scores].copy()
-    null_p_values.sort_values(inplace=True, ascending=False)
-    pvals = scores.apply(lambda x: score2pval(x, null_p_val_scores, null_p_values))
+    # null scores in ascending order, with p-values in descending order
+    null_scores = np.asarray(null_p_values.index, dtype=float)[::-1]
+    null_pvals = -np.sort(-np.asarray(null_p_values, dtype=float))
+    num_null = len(null_scores)
+
+    # find position in simulated null distribution
+    score_array = np.asarray(scores, dtype=float)
+    pos = np.searchsorted(null_scores, score_array, side='right')
+    pvals = null_pvals[np.minimum(pos, num_null-1)]
+
+    # if the score is beyond any simulated values, then report
+    # a p-value of zero
+    pvals[(pos == num_null) & (score_array > null_scores[-1])] = 0
+    return pd.Series(pvals, index=scores.index)
+
+
+def compute_p_values(df, null_dist):
+    """Get the oncogene, tsg and driver p-values of each gene.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        oncogene, tsg and driver scores of each gene
+    null_dist : pd.DataFrame
+        dataframe relating scores to p values (index are scores)
+
+    Returns
+    -------
+    pvals : pd.DataFrame
+        oncogene, tsg and driver p-values (see compute_p_value)
+    """
+    pvals = pd.DataFrame(index=df.index)
+    for score_col, pval_col in score_pval_cols:
+        pvals[pval_col] = compute_p_value(df[score_col],
+                                          null_dist[pval_col].dropna())
     return pvals
 
 
+# smallest p-value given by extrapolate_tail
+min_tail_p_value = np.finfo(float).tiny
+
+
+class TailModel(object):
+    """Generalized Pareto distribution (GPD) fitted to the upper tail of an
+    empirical null distribution.
+
+    Null scores above the threshold are modelled as threshold + Y, where Y
+    follows a GPD with the given shape and scale. The p-value of a score s
+    above the threshold is then
+    tail_prob * (1 + shape * (s - threshold) / scale) ** (-1 / shape),
+    which gives small non-zero p-values to scores beyond the largest
+    simulated score, instead of zero (see extrapolate_tail). These p-values
+    are at most top_prob, so that they stay below the p-value of a score
+    tied with the largest null score.
+
+    Parameters
+    ----------
+    threshold : float
+        null score where the tail starts
+    tail_prob : float
+        fraction of null scores above the threshold
+    shape : float
+        shape of the GPD (negative values have an upper endpoint)
+    scale : float
+        scale of the GPD
+    ks_stat : float
+        largest difference between the empirical and fitted distribution
+        of the null scores above the threshold
+    num_scores : int
+        number of distinct null scores above the threshold
+    top_prob : float or None
+        fraction of null scores equal to the largest null score, i.e. the
+        smallest non-zero empirical p-value (tail_prob if None)
+    """
+
+    def __init__(self, threshold, tail_prob, shape, scale, ks_stat=np.nan,
+                 num_scores=0, top_prob=None):
+        self.threshold = threshold
+        self.tail_prob = tail_prob
+        self.top_prob = tail_prob if top_prob is None else top_prob
+        self.shape = shape
+        self.scale = scale
+        self.ks_stat = ks_stat
+        self.num_scores = num_scores
+
+    @classmethod
+    def fit(cls, null_p_values, tail_frac=.1, min_scores=5):
+        """Fit the tail model by weighted maximum likelihood.
+
+        Parameters
+        ----------
+        null_p_values : pd.Series
+            empirical null distribution, index are scores and values are
+            p values (same as compute_p_value)
+        tail_frac : float
+            largest fraction of the null scores used as the tail
+        min_scores : int
+            least number of distinct null scores in the tail
+
+        Returns
+        -------
+        tail_model : TailModel or None
+            None if the tail has too few distinct scores to fit
+        """
+        null_p_values = null_p_values.dropna().sort_index(ascending=False)
+        scores = np.asarray(null_p_values.index, dtype=float)
+        pvals = np.asarray(null_p_values, dtype=float)
+
+        # the tail is the highest scores, which have the smallest p-values,
+        # and the threshold is the next highest score
+        num_scores = int(np.sum(pvals <= tail_frac))
+        if num_scores < min_scores or num_scores == len(scores):
+            return None
+        threshold = scores[num_scores]
+        tail_prob = pvals[num_scores-1]
+
+        # fraction of the tail at each score, in ascending order
+        excess = (scores[:num_scores] - threshold)[::-1]
+        weights = (np.diff(np.concatenate([[0], pvals[:num_scores]])) / tail_prob)[::-1]
+        shape, scale = _fit_gpd(excess, weights)
+
+        tail_model = cls(threshold, tail_prob, shape, scale, num_scores=num_scores,
+                         top_prob=pvals[0])
+        fitted_cdf = 1 - tail_model.p_value(scores[:num_scores][::-1]) / tail_prob
+        tail_model.ks_stat = np.abs(np.cumsum(weights) - fitted_cdf).max()
+        return tail_model
+
+    def p_value(self, scores):
+        """P-value of scores above the threshold from the fitted GPD."""
+        excess = np.maximum(np.asarray(scores, dtype=float) - self.threshold, 0)
+        return self.tail_prob * _gpd_sf(excess, self.shape, self.scale)
+
+    def diagnostics(self):
+        """Fitted parameters and goodness of fit.
+
+        Returns
+        -------
+        diagnostics : dict
+            threshold, tail fraction, number of distinct tail scores, shape,
+            scale, upper endpoint (infinite for a non-negative shape) and
+            KS statistic of the fit
+        """
+        if self.shape < 0:
+            endpoint = self.threshold - self.scale / self.shape
+        else:
+            endpoint = np.inf
+        return {'threshold': self.threshold,
+                'tail fraction': self.tail_prob,
+                'num tail scores': self.num_scores,
+                'shape': self.shape,
+                'scale': self.scale,
+                'upper endpoint': endpoint,
+                'KS statistic': self.ks_stat}
+
+
+def fit_tail_models(null_dist, tail_frac=.1):
+    """Fit a tail model to the oncogene, tsg and driver null distributions.
+
+    Returns
+    -------
+    tail_models : dict
+        TailModel (or None if it could not be fit) of each p-value column
+    """
+    return {pval_col: TailModel.fit(null_dist[pval_col], tail_frac)
+            for score_col, pval_col in score_pval_cols}
+
+
+def extrapolate_tail(scores, pvals, tail_model):
+    """Replace p-values of zero, given to scores beyond the largest null
+    score, by the p-values of the tail model.
+
+    The extrapolated p-values are capped at the p-value of the largest null
+    score (tail_model.top_prob), so p-values never increase with the score,
+    and floored at min_tail_p_value, since a GPD with a negative shape gives
+    zero beyond its upper endpoint.
+
+    Parameters
+    ----------
+    scores : pd.Series
+        observed scores
+    pvals : pd.Series
+        empirical p-values of the scores
+    tail_model : TailModel or None
+        fitted tail model (p-values are unchanged if None)
+
+    Returns
+    -------
+    pvals : pd.Series
+        p-values with the tail extrapolated
+    """
+    if tail_model is None:
+        return pvals
+    pvals = pvals.copy()
+    is_beyond = np.asarray(pvals == 0)
+    tail_pvals = tail_model.p_value(np.asarray(scores)[is_beyond])
+    pvals[is_beyond] = np.clip(tail_pvals, min_tail_p_value, tail_model.top_prob)
+    return pvals
+
+
+def _gpd_sf(excess, shape, scale):
+    """Survival function of the generalized Pareto distribution."""
+    if abs(shape) < 1e-8:
+        return np.exp(-excess / scale)
+    z = 1 + shape * excess / scale
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(z > 0, np.abs(z) ** (-1 / shape), 0.)
+
+
+def _fit_gpd(excess, weights):
+    """Weighted maximum likelihood estimate of the GPD shape and scale.
+
+    The shape is kept above -1, where the likelihood is bounded.
+    """
+    mean = np.sum(weights * excess)
+    var = np.sum(weights * (excess - mean)**2)
+    # method of moments as the starting point
+    ratio = mean**2 / var if var > 0 else 1.
+    start = [max(.5 * (1 - ratio), -.5), np.log(max(.5 * mean * (ratio + 1), 1e-8))]
+
+    def neg_log_likelihood(params):
+        shape, log_scale = params
+        scale = np.exp(log_scale)
+        if shape <= -1:
+            return np.inf
+        if abs(shape) < 1e-8:
+            return np.sum(weights * (log_scale + excess / scale))
+        z = 1 + shape * excess / scale
+        if np.any(z <= 0):
+            return np.inf
+        return np.sum(weights * (log_scale + (1 + 1 / shape) * np.log(z)))
+
+    result = optimize.minimize(neg_log_likelihood, start, method='Nelder-Mead')
+    shape, log_scale = result.x
+    return shape, np.exp(log_scale)
+
+
 def score2pval(score, null_scores, null_pvals):
     """Looks up the P value from the empirical null distribution based on the provided
     score.
@@ -98,19 +336,21 @@ def score2pval(score, null_scores, null_pvals):
         return null_pvals.iloc[pos]
 
 
+# methods to adjust p-values for multiple testing (see fdr_adjust)
+fdr_methods = ['bh', 'storey']
+
+
 def cummin(x):
-    """A python implementation of the cummin function in R"""
-    for i in range(1, len(x)):
-        if x[i-1] < x[i]:
-            x[i] = x[i-1]
-    return x
+    """A vectorized implementation of the cummin function in R"""
+    return np.minimum.accumulate(x)
 
 
 def bh_fdr(pval):
     """A python implementation of the Benjamani-Hochberg FDR method.
 
     This code should always give precisely the same answer as using
-    p.adjust(pval, method="BH") in R.
+    p.adjust(pval, method="BH") in R. Like R, missing p-values are
+    left out of the adjustment and stay missing.
 
     Parameters
     ----------
@@ -122,17 +362,129 @@ def bh_fdr(pval):
     pval_adj : np.array
         adjusted p-values according the benjamani-hochberg method
     """
-    pval_array = np.array(pval)
-    sorted_order = np.argsort(pval_array)
+    return _step_up(pval)
+
+
+def estimate_pi0(pval, lambda_=.5):
+    """Storey's estimate of the proportion of true null hypotheses.
+
+    The p-values of true null hypotheses are uniformly distributed, so
+    pi0 is estimated from the p-values above lambda_:
+    #{p > lambda_} / (m * (1 - lambda_)), which is at most 1.
+
+    Parameters
+    ----------
+    pval : list or array
+        list/array of p-values
+    lambda_ : float
+        p-values above lambda_ are assumed to be mostly true nulls
+
+    Returns
+    -------
+    pi0 : float
+        estimated proportion of true null hypotheses
+    """
+    pval_array = np.asarray(pval, dtype=float)
+    pval_array = pval_array[~np.isnan(pval_array)]
+    if not len(pval_array):
+        return 1.0
+    pi0 = np.sum(pval_array > lambda_) / (len(pval_array) * (1 - lambda_))
+    return min(1.0, pi0)
+
+
+def storey_qvalue(pval, lambda_=.5, pi0=None):
+    """Storey's q-values, which are the Benjamani-Hochberg adjusted
+    p-values multiplied by the estimated proportion of true null
+    hypotheses (pi0). Gives more power than BH when many genes are
+    not null.
+
+    Parameters
+    ----------
+    pval : list or array
+        list/array of p-values
+    lambda_ : float
+        tuning parameter for estimate_pi0
+    pi0 : float or None
+        proportion of true null hypotheses, estimated if None
+
+    Returns
+    -------
+    qval : np.array
+        q-values
+    """
+    if pi0 is None:
+        pi0 = estimate_pi0(pval, lambda_)
+    return _step_up(pval, pi0)
+
+
+def fdr_adjust(pval, method='bh'):
+    """Adjust p-values for multiple testing.
+
+    Parameters
+    ----------
+    pval : list or array
+        list/array of p-values
+    method : str
+        'bh' (Benjamani-Hochberg) or 'storey' (Storey's q-values)
+
+    Returns
+    -------
+    qval : np.array
+        adjusted p-values
+    """
+    if method == 'bh':
+        return bh_fdr(pval)
+    elif method == 'storey':
+        return storey_qvalue(pval)
+    else:
+        raise ValueError('Unknown FDR method: {0}'.format(method))
+
+
+def grouped_fdr(pval, groups, method='bh'):
+    """Adjust p-values separately within each group (e.g. tumor type).
+
+    Parameters
+    ----------
+    pval : list or array
+        list/array of p-values
+    groups : list or array
+        group of each p-value
+    method : str
+        FDR method (see fdr_adjust)
+
+    Returns
+    -------
+    qval : np.array
+        p-values adjusted within their group
+    """
+    pval_array = np.asarray(pval, dtype=float)
+    groups = np.asarray(groups)
+    qval = np.empty(len(pval_array))
+    for group in pd.unique(groups):
+        is_group = groups == group
+        qval[is_group] = fdr_adjust(pval_array[is_group], method)
+    return qval
+
+
+def _step_up(pval, pi0=1.0):
+    """Benjamani-Hochberg step-up adjustment, in the same order of
+    operations as p.adjust in R, optionally multiplied by pi0."""
+    pval_array = np.array(pval, dtype=float)
+    pval_adj = np.full(len(pval_array), np.nan)
+    is_valid = ~np.isnan(pval_array)
+    valid_pval = pval_array[is_valid]
+    sorted_order = np.argsort(valid_pval)
     original_order = np.argsort(sorted_order)
-    pval_array = pval_array[sorted_order]
+    valid_pval = valid_pval[sorted_order]
 
     # calculate the needed alpha
-    n = float(len(pval))
-    pval_adj = np.zeros(int(n))
+    n = float(len(valid_pval))
     i = np.arange(1, int(n)+1, dtype=float)[::-1]  # largest to smallest
-    pval_adj = np.minimum(1, cummin(n/i * pval_array[::-1]))[::-1]
-    return pval_adj[original_order]
+    adj = cummin(n/i * valid_pval[::-1])
+    if pi0 != 1:
+        adj = pi0 * adj
+    pval_adj[is_valid] = np.minimum(1, adj)[::-1][original_order]
+    return pval_adj
 
 
 def mean_log_fold_change(data, genes):
@@ -0,0 +1,45 @@
+"""Derive independent random number streams from a single master seed.
+
+Each randomization, cross-validation fold and batch of trees gets its own
+seed by hashing the master seed together with keys that identify it
+(e.g. derive_seed(71, 'fold', 2, 5)). Seeds therefore do not depend on
+how many random numbers were drawn before, so folds can be run in any
+order or by any number of processes and still give identical results.
+"""
+import numpy as np
+import hashlib
+
+MAX_SEED = 2**31 - 1  # largest seed accepted by R's set.seed
+
+
+def master_seed(seed=None):
+    """Return the master seed, drawing a random one if seed is None."""
+    if seed is None:
+        return int(np.random.randint(0, MAX_SEED))
+    return int(seed)
+
+
+def derive_seed(master, *keys):
+    """Derive a seed from the master seed and the keys of a random stream.
+
+    Parameters
+    ----------
+    master : int
+        master random seed (e.g. --random-seed)
+    keys : str or int
+        identify the random stream, e.g. ('fold', iteration, fold)
+
+    Returns
+    -------
+    seed : int
+        seed between 0 and MAX_SEED
+    """
+    # str() gives the same text for python and numpy integers
+    text = '/'.join(str(k) for k in (master,) + keys)
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    return int(digest[:16], 16) % MAX_SEED
+
+
+def derive_prng(master, *keys):
+    """Random number generator of a stream (see derive_seed)."""
+    return np.random.RandomState(derive_seed(master, *keys))
@@ -8,6 +8,7 @@ import logging
 import os
 import sys
 import datetime
+import hashlib
 from functools import wraps
 import warnings
 
@@ -129,6 +130,28 @@ def keyboard_exit_wrapper(func):
     return wrap
 
 
+def file_hash(path, chunk_size=2**20):
+    """Compute the md5 hash of a file's contents.
+
+    Parameters
+    ----------
+    path : str
+        path to file
+    chunk_size : int
+        number of bytes read at a time
+
+    Returns
+    -------
+    hex_digest : str
+        md5 hash of the file
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
 def read_oncogenes():
     """Reads in the oncogenes from vogelsteins' science paper.
 
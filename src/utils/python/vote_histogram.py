@@ -0,0 +1,264 @@
+"""Empirical null distribution stored as integer vote-count histograms.
+
+A random forest score is a fraction of tree votes, i.e. votes / total
+votes of a gene (number of trees times number of predictions). The null
+distribution from classify --simulated is therefore kept as the number of
+simulated genes with each vote count, for the oncogene, tsg and driver
+(oncogene + tsg) votes. It is saved next to the null distribution text
+file (see sidecar_path).
+
+P-values are looked up by array indexing, and scores are compared exactly
+as fractions of integers, even if the observed genes have a different
+total number of votes than the simulated genes. The rules are the same as
+p_value.compute_p_value.
+
+Histograms of separate simulations are merged by adding their counts
+(see VoteHistogram.merge), so the null distribution can be built one
+simulation at a time, and extended later with more simulations.
+"""
+import numpy as np
+import pandas as pd
+import os
+
+# kinds of votes, and the p-value column of each in the null distribution
+vote_kinds = [('oncogene', 'oncogene p-value'),
+              ('tsg', 'tsg p-value'),
+              ('driver', 'driver p-value')]
+
+
+def sidecar_path(null_path):
+    """Path of the vote histograms saved alongside a null distribution file."""
+    return os.path.splitext(null_path)[0] + '.npz'
+
+
+def result_votes(result_df):
+    """Oncogene, tsg and driver votes, and the total votes, of each gene in
+    a classify result (None if it has no vote counts)."""
+    vote_cols = ['oncogene votes', 'tsg votes', 'other votes']
+    if not all(c in result_df.columns for c in vote_cols):
+        return None, None
+    onco, tsg, other = [result_df[c].values.astype(np.int64) for c in vote_cols]
+    votes = {'oncogene': onco, 'tsg': tsg, 'driver': onco + tsg}
+    return votes, onco + tsg + other
+
+
+class VoteHistogram(object):
+    """Number of simulated genes with each vote count.
+
+    Parameters
+    ----------
+    total_votes : int
+        total number of votes of every simulated gene
+    counts : dict
+        for each kind of vote (oncogene, tsg, driver), an array with the
+        number of genes having 0, 1, ..., total_votes votes
+    sources : list
+        names of the simulations counted in the histograms
+    """
+
+    def __init__(self, total_votes, counts, sources=()):
+        self.total_votes = int(total_votes)
+        self.counts = {kind: np.asarray(counts[kind], dtype=np.int64)
+                       for kind, _ in vote_kinds}
+        self.sources = list(sources)
+
+    @classmethod
+    def from_votes(cls, votes, total_votes, sources=()):
+        """Count the genes with each number of votes.
+
+        Parameters
+        ----------
+        votes : dict
+            votes of each simulated gene, for each kind of vote
+        total_votes : int
+            total number of votes of every gene
+        sources : list
+            names of the simulations the genes come from
+        """
+        counts = {kind: np.bincount(votes[kind], minlength=total_votes+1)
+                  for kind, _ in vote_kinds}
+        return cls(total_votes, counts, sources)
+
+    @classmethod
+    def from_result(cls, result_df, sources=()):
+        """Histograms of the vote counts of a classify result.
+
+        Returns None if the result has no vote counts, or the genes do
+        not all have the same total number of votes.
+        """
+        votes, total = result_votes(result_df)
+        if votes is None or not len(total) or (total != total[0]).any():
+            return None
+        return cls.from_votes(votes, total[0], sources)
+
+    @classmethod
+    def from_null_table(cls, null_df, total_votes=None, num_genes=None):
+        """Convert a null distribution text file (score index, p-value
+        columns) to vote histograms.
+
+        Parameters
+        ----------
+        null_df : pd.DataFrame
+            null distribution written by classify --simulated
+        total_votes : int or None
+            total number of votes of each gene (number of trees times number
+            of predictions). If None, the smallest total that turns every
+            score into an integer number of votes is used.
+        num_genes : int or None
+            number of simulated genes. If None, the smallest number that
+            turns every p-value into an integer number of genes is used.
+        """
+        scores = np.asarray(null_df.index, dtype=float)
+        if total_votes is None:
+            total_votes = _smallest_multiplier(scores, 1, 10**7)
+        if num_genes is None:
+            pvals = null_df.values[~np.isnan(null_df.values)]
+            smallest = pvals[pvals > 0].min()
+            num_genes = _smallest_multiplier(pvals, int(round(1 / smallest)), 10**8)
+
+        counts = {}
+        for kind, pval_col in vote_kinds:
+            pvals = null_df[pval_col].dropna().sort_index(ascending=False)
+            votes = np.rint(np.asarray(pvals.index, dtype=float) * total_votes).astype(np.int64)
+            cum_genes = np.rint(pvals.values * num_genes).astype(np.int64)
+            counts[kind] = np.zeros(total_votes+1, dtype=np.int64)
+            counts[kind][votes] = np.diff(np.concatenate([[0], cum_genes]))
+        return cls(total_votes, counts)
+
+    def rescale(self, total_votes):
+        """Same histograms counted in a multiple of the total votes."""
+        if total_votes % self.total_votes:
+            raise ValueError('{0} total votes is not a multiple of {1}'.format(
+                total_votes, self.total_votes))
+        factor = total_votes // self.total_votes
+        counts = {}
+        for kind, _ in vote_kinds:
+            counts[kind] = np.zeros(total_votes+1, dtype=np.int64)
+            counts[kind][::factor] = self.counts[kind]
+        return VoteHistogram(total_votes, counts, self.sources)
+
+    def merge(self, other):
+        """Histograms of the genes of both null distributions.
+
+        Histograms with different total votes are both counted in the least
+        common multiple of their totals, so scores remain exact. Merging is
+        associative and commutative.
+        """
+        overlap = set(self.sources) & set(other.sources)
+        if overlap:
+            raise ValueError('Simulations counted twice: {0}'.format(
+                ', '.join(sorted(overlap))))
+        total_votes = _lcm(self.total_votes, other.total_votes)
+        first, second = self.rescale(total_votes), other.rescale(total_votes)
+        counts = {kind: first.counts[kind] + second.counts[kind]
+                  for kind, _ in vote_kinds}
+        return VoteHistogram(total_votes, counts,
+                             sorted(self.sources + other.sources))
+
+    def to_null_table(self):
+        """Null distribution relating scores to p-values, in the same format
+        as the text file written by classify --simulated."""
+        scores = np.arange(self.total_votes+1) / float(self.total_votes)
+        null_df = pd.DataFrame(index=scores[::-1])
+        for kind, pval_col in vote_kinds:
+            counts = self.counts[kind][::-1]
+            pvals = np.cumsum(counts) / float(counts.sum())
+            null_df[pval_col] = np.where(counts > 0, pvals, np.nan)
+        return null_df.dropna(how='all')
+
+    def matches(self, null_df, tol=1e-6):
+        """Check that a null distribution text file has the same scores and
+        p-values as the histograms (i.e. the histograms belong to it)."""
+        expected = self.to_null_table()
+        cols = [pval_col for _, pval_col in vote_kinds]
+        if not all(c in null_df.columns for c in cols):
+            return False
+        null_df = null_df[cols].dropna(how='all').sort_index(ascending=False)
+        if null_df.shape != expected.shape:
+            return False
+        scores = np.asarray(null_df.index, dtype=float)
+        return (np.allclose(scores, expected.index.values, rtol=0, atol=tol) and
+                np.allclose(null_df.values.astype(float), expected.values,
+                            rtol=0, atol=tol, equal_nan=True))
+
+    def save(self, path):
+        """Save the histograms as a .npz file."""
+        np.savez_compressed(path, total_votes=self.total_votes,
+                            sources=np.array(self.sources, dtype=str),
+                            **self.counts)
+
+    @classmethod
+    def load(cls, path):
+        """Load histograms saved by save."""
+        with np.load(path) as arrays:
+            sources = arrays['sources'] if 'sources' in arrays.files else []
+            return cls(arrays['total_votes'],
+                       {kind: arrays[kind] for kind, _ in vote_kinds},
+                       [str(source) for source in sources])
+
+    def p_value(self, kind, votes, total_votes):
+        """P-value of genes with the given votes.
+
+        The p-value is the fraction of simulated genes with a higher score.
+        A score equal to the highest simulated score gets the fraction of
+        simulated genes with that score (same as p_value.score2pval).
+
+        Parameters
+        ----------
+        kind : str
+            oncogene, tsg or driver
+        votes : np.array
+            votes of each gene
+        total_votes : np.array
+            total number of votes of each gene
+
+        Returns
+        -------
+        pvals : np.array
+            p-value of each gene
+        """
+        counts = self.counts[kind]
+        num_genes = float(counts.sum())
+        votes = np.asarray(votes, dtype=np.int64)
+        total_votes = np.maximum(np.asarray(total_votes, dtype=np.int64), 1)
+
+        # number of simulated genes with more than each vote count
+        num_above = np.concatenate([np.cumsum(counts[::-1])[::-1][1:], [0]])
+
+        # largest simulated vote count with a score at most the gene's score
+        null_votes = (votes * self.total_votes) // total_votes
+        pvals = num_above[null_votes] / num_genes
+
+        # ties with the highest simulated score
+        max_votes = np.nonzero(counts)[0].max()
+        is_max = (null_votes == max_votes) & (null_votes * total_votes == votes * self.total_votes)
+        pvals[is_max] = counts[max_votes] / num_genes
+        return pvals
+
+    def p_values(self, df):
+        """Oncogene, tsg and driver p-values of each gene of a classify
+        result (None if it has no vote counts)."""
+        votes, total = result_votes(df)
+        if votes is None:
+            return None
+        pvals = pd.DataFrame(index=df.index)
+        for kind, pval_col in vote_kinds:
+            pvals[pval_col] = self.p_value(kind, votes[kind], total)
+        return pvals
+
+
+def _lcm(a, b):
+    """Least common multiple of two positive integers."""
+    x, y = a, b
+    while y:
+        x, y = y, x % y
+    return a // x * b
+
+
+def _smallest_multiplier(values, start, stop):
+    """Smallest integer from start that turns all values into integers."""
+    for multiplier in range(max(1, start), stop):
+        scaled = values * multiplier
+        if np.all(np.abs(scaled - np.rint(scaled)) < 1e-6):
+            return multiplier
+    raise ValueError('The values are not fractions of an integer below {0}'.format(stop))
@@ -0,0 +1,119 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+from src.classify.python.adaptive_null import NullMonitor, p_value_interval
+import src.classify.python.adaptive_null as adaptive_null
+from src.classify.python.null_distribution import simulation_name
+from src.utils.python.vote_histogram import VoteHistogram
+import pandas as pd
+import shutil
+import numpy as np
+
+
+def simulated_votes(prng, num_genes, total_votes, rate):
+    """Oncogene/tsg/other vote counts of genes."""
+    onco = prng.binomial(total_votes, rate, size=num_genes)
+    tsg = prng.binomial(total_votes - onco, rate)
+    return pd.DataFrame({'oncogene votes': onco,
+                         'tsg votes': tsg,
+                         'other votes': total_votes - onco - tsg})
+
+
+def test_null_monitor():
+    """Test that simulations stop once the significant genes are stable."""
+    prng = np.random.RandomState(3)
+    total_votes = 200
+    # null genes, and drivers with many more votes
+    observed_df = pd.concat([simulated_votes(prng, 500, total_votes, .05),
+                             simulated_votes(prng, 20, total_votes, .3)],
+                            ignore_index=True)
+    monitor = NullMonitor(observed_df, min_iter=3, patience=2, max_uncertain=.5)
+
+    null_hist = None
+    for i in range(20):
+        votes = simulated_votes(prng, 1000, total_votes, .05)
+        sim_hist = VoteHistogram.from_result(votes, sources=[str(i)])
+        null_hist = sim_hist if null_hist is None else null_hist.merge(sim_hist)
+        monitor.update(null_hist)
+        if monitor.is_stable():
+            break
+    assert monitor.is_stable()
+    assert 3 <= len(monitor.history) < 20
+
+    # drivers are significant
+    drivers = set(range(500, 520))
+    driver_genes = set(gene for pval_col, gene in monitor.significant[-1]
+                       if pval_col == 'driver p-value')
+    assert len(drivers & driver_genes) >= 18
+
+    # the confidence interval contains the p-value
+    pvals = np.array([0, .001, .01, .5, 1.])
+    lower, upper = p_value_interval(pvals, 1000)
+    assert np.all((lower <= pvals) & (pvals <= upper))
+
+
+def test_adaptive_resume():
+    """Test that a run resumed from a saved state adds one simulation per step."""
+    total_votes = 200
+    prng = np.random.RandomState(5)
+    observed_df = pd.concat([simulated_votes(prng, 500, total_votes, .05),
+                             simulated_votes(prng, 20, total_votes, .3)],
+                            ignore_index=True)
+    out_dir = os.path.join(file_dir, 'data/adaptive_null')
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    observed_path = os.path.join(out_dir, 'observed.txt')
+    observed_df.to_csv(observed_path, sep='\t')
+    feature_fmt = os.path.join(out_dir, 'sim{iter}.txt')
+    for i in range(1, 21):
+        with open(feature_fmt.format(iter=i), 'w') as handle:
+            handle.write('simulation {0}\n'.format(i))
+
+    scored = []
+
+    def score_simulation(feature_path, opts):
+        """Simulated vote counts instead of scoring with a classifier."""
+        scored.append(feature_path)
+        num_iter = int(os.path.basename(feature_path)[len('sim'):-len('.txt')])
+        votes = simulated_votes(np.random.RandomState(num_iter), 1000, total_votes, .05)
+        return VoteHistogram.from_result(votes, sources=[simulation_name(feature_path)])
+
+    state_path = os.path.join(out_dir, 'state.npz')
+    history_path = os.path.join(out_dir, 'history.txt')
+    opts = {'observed': observed_path, 'features': feature_fmt,
+            'simulate_cmd': None, 'state': state_path,
+            'null_distribution': os.path.join(out_dir, 'null_dist.txt'),
+            'history': history_path, 'q_value': .1, 'min_iter': 3,
+            'patience': 2, 'max_uncertain': .5, 'max_iter': 2}
+    original = adaptive_null.score_simulation
+    adaptive_null.score_simulation = score_simulation
+    try:
+        # interrupted after two simulations
+        adaptive_null.main(opts)
+        assert len(scored) == 2
+
+        # resumed run only scores new simulations, one per step
+        del scored[:]
+        opts['max_iter'] = 20
+        adaptive_null.main(opts)
+    finally:
+        adaptive_null.score_simulation = original
+    history = pd.read_csv(history_path, sep='\t')
+    assert history['simulations'].tolist() == list(range(2, 3 + len(scored)))
+    assert history['changed'].iloc[0] > 0
+    assert len(scored) >= 2
+    assert feature_fmt.format(iter=1) not in scored
+    assert len(VoteHistogram.load(state_path).sources) == 2 + len(scored)
+
+    # simulations are named by their content, not their file name
+    other_dir = os.path.join(out_dir, 'other')
+    os.makedirs(other_dir)
+    other_path = os.path.join(other_dir, 'sim1.txt')
+    with open(other_path, 'w') as handle:
+        handle.write('another simulation\n')
+    assert simulation_name(other_path) != simulation_name(feature_fmt.format(iter=1))
+    shutil.copy(feature_fmt.format(iter=2), other_path)
+    assert simulation_name(other_path) == simulation_name(feature_fmt.format(iter=2))
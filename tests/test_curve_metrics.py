@@ -0,0 +1,42 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+import src.classify.python.curve_metrics as curve_metrics
+import sklearn.metrics as metrics
+import numpy as np
+
+
+def test_curve_metrics():
+    """Test the vectorized metrics against sklearn for each iteration."""
+    prng = np.random.RandomState(71)
+    y_true = prng.randint(0, 2, size=(5, 200))
+    # round the scores so that there are ties
+    scores = np.round(prng.rand(5, 200), 2)
+    y_pred = (scores > .5).astype(int)
+    fpr_grid = np.linspace(0, 1, 100)
+    recall_grid = np.linspace(0, 1, 100)
+
+    sorted_scores = curve_metrics.SortedScores(y_true, scores)
+    tpr = sorted_scores.roc(fpr_grid)
+    pr_prec, pr_thresh = sorted_scores.precision_recall(recall_grid)
+    prec, recall, fscore = curve_metrics.binary_metrics(y_true, y_pred)
+    cut_prec, cut_recall, num_above = sorted_scores.cutoff(.5)
+    for i in range(len(y_true)):
+        fpr, expected_tpr, thresh = metrics.roc_curve(y_true[i], scores[i])
+        assert np.allclose(tpr[i], np.interp(fpr_grid, fpr, expected_tpr))
+        # same as interpolating the reversed precision_recall_curve
+        p, r, thresh = metrics.precision_recall_curve(y_true[i], scores[i])
+        full = np.nonzero(r == 1)[0].max()  # newer sklearn versions go past full recall
+        p, r, thresh = p[full:][::-1], r[full:][::-1], thresh[full:][::-1]
+        thresh = np.insert(thresh, 0, 1.0)
+        assert np.allclose(pr_prec[i], np.interp(recall_grid, r, p))
+        assert np.allclose(pr_thresh[i], np.interp(recall_grid, r, thresh))
+        assert np.isclose(prec[i], metrics.precision_score(y_true[i], y_pred[i]))
+        assert np.isclose(recall[i], metrics.recall_score(y_true[i], y_pred[i]))
+        assert np.isclose(fscore[i], metrics.f1_score(y_true[i], y_pred[i]))
+        assert np.isclose(cut_prec[i], prec[i])
+        assert np.isclose(cut_recall[i], recall[i])
+        assert num_above[i] == y_pred[i].sum()
@@ -0,0 +1,85 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+from src.classify.python.r_random_forest_clf import RRandomForest, MyClassifier
+from src.classify.python.native_random_forest_clf import NativeClassifier
+import src.train.python.train as train
+import pandas as pd
+import numpy as np
+
+
+def test_flat_forest():
+    """Test that models in the portable .npz format give the same predictions."""
+    example_features = os.path.join(file_dir, 'data/features_pancan_subset.txt')
+    test_train_cv = os.path.join(file_dir, 'data/test_train_cv.Rdata')
+    test_flat_cv = os.path.join(file_dir, 'data/test_train_cv.npz')
+    df = pd.read_csv(example_features, sep='\t', index_col=0)
+
+    # train the R model if the train test has not been run
+    if not os.path.exists(test_train_cv):
+        opts = {'features': example_features, 'driver_rate': .7,
+                'other_ratio': 1.0, 'ntrees': 200, 'min_count': 0,
+                'random_seed': 71, 'cv': True, 'output': test_train_cv}
+        train.main(opts)
+
+    # convert the R model
+    r_clf = MyClassifier()
+    r_clf.load_cv(test_train_cv)
+    r_clf.save_flat_cv(test_flat_cv)
+
+    # predictions without R
+    rrclf = RRandomForest(df, seed=71, engine='native')
+    flat_clf = NativeClassifier()
+    flat_clf.load_cv(test_flat_cv)
+    x = rrclf.x
+    for num_iter, num_fold in [(1, 1), (5, 10)]:
+        r_clf.set_model(num_iter, num_fold)
+        flat_clf.set_model(num_iter, num_fold)
+        r_prob = np.asarray(r_clf.predict_proba(x))
+        flat_prob = flat_clf.predict_proba(x)
+        assert np.allclose(r_prob, flat_prob)
+
+    # the R models are flattened to score all folds at once
+    assert np.allclose(r_clf.predict_proba_cv(x, 5), flat_clf.predict_proba_cv(x, 5))
+
+
+def test_flat_predict_cv():
+    """Test that scoring all folds at once matches predicting each fold's
+    held-out genes with its own model."""
+    example_features = os.path.join(file_dir, 'data/features_pancan_subset.txt')
+    test_flat_cv = os.path.join(file_dir, 'data/test_native_cv.npz')
+    df = pd.read_csv(example_features, sep='\t', index_col=0)
+    num_iter, k = 2, 5
+    rrclf = RRandomForest(df, ntrees=20, seed=71, total_iter=num_iter,
+                          engine='native')
+    rrclf.train_cv(k=k)
+    rrclf.clf.save_flat_cv(test_flat_cv)
+    flat_clf = NativeClassifier()
+    flat_clf.load_cv(test_flat_cv)
+
+    # genes never trained on are scored by the first fold
+    new_genes = rrclf.x.iloc[:7].copy()
+    new_genes.index = ['NEW{0}'.format(i) for i in range(len(new_genes))]
+    x = pd.concat([rrclf.x, new_genes])
+
+    # old predict_cv loop over the model of each fold
+    cv_folds = flat_clf.cv_folds
+    expected_proba = np.zeros((len(x), 3))
+    expected_votes = np.zeros((len(x), 3), dtype=int)
+    for i in range(num_iter):
+        gene_fold = cv_folds['X{0}'.format(i+1)].reindex(x.index).fillna(1).values
+        for j in range(k):
+            rows = np.nonzero(gene_fold == j+1)[0]
+            flat_clf.set_model(i+1, j+1)
+            expected_proba[rows] += flat_clf.predict_proba(x.iloc[rows])
+            expected_votes[rows] += flat_clf.rf.predict_votes(x.iloc[rows])
+    expected_proba /= num_iter
+
+    # chunks of a few genes
+    proba, votes = flat_clf.flat_cv.predict_proba_cv(x, num_iter, max_pairs=100,
+                                                     return_votes=True)
+    assert np.allclose(proba, expected_proba)
+    assert np.array_equal(votes, expected_votes)
@@ -0,0 +1,38 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+from src.classify.python.fold_plan import FoldPlan
+import src.features.python.feature_utils as futils
+import pandas as pd
+import numpy as np
+
+
+def test_fold_plan():
+    """Test that every gene is held-out once per iteration, and that a
+    saved plan gives the same folds."""
+    example_features = os.path.join(file_dir, 'data/features_pancan_subset.txt')
+    test_plan = os.path.join(file_dir, 'data/test_fold_plan.npz')
+    df = pd.read_csv(example_features, sep='\t', index_col=0).sort_index()
+    y = df.index.to_series().apply(futils.label_gene)
+    plan = FoldPlan.build(df.index, y.values, 3, 10, 71)
+
+    for i in range(plan.num_iter):
+        test_rows = np.concatenate([test_ix for train_ix, test_ix in plan.folds(i)])
+        assert np.array_equal(np.sort(test_rows), np.arange(len(df)))
+        for train_ix, test_ix in plan.folds(i):
+            assert len(train_ix) + len(test_ix) == len(df)
+    assert (plan.cv_folds().values > 0).all()
+
+    plan.save(test_plan)
+    saved = FoldPlan.load(test_plan)
+    assert saved.matches(df.index, y.values, 3, 10, 71)
+
+    # plans made with another seed or other labels are not reused
+    assert not saved.matches(df.index, y.values, 3, 10, 72)
+    assert not saved.matches(df.index, np.roll(y.values, 1), 3, 10, 71)
+    for i in range(plan.num_iter):
+        for (a, b), (c, d) in zip(plan.folds(i), saved.folds(i)):
+            assert np.array_equal(a, c) and np.array_equal(b, d)
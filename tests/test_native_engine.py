@@ -0,0 +1,110 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+from src.classify.python.r_random_forest_clf import RRandomForest
+import pandas as pd
+import numpy as np
+import scipy.stats as stats
+
+
+def cv_scores(engine):
+    """Run cross-validation with the given random forest engine."""
+    example_features = os.path.join(file_dir, 'data/features_pancan_subset.txt')
+    df = pd.read_csv(example_features, sep='\t', index_col=0)
+    rrclf = RRandomForest(df,
+                          other_sample_ratio=1.0,
+                          driver_sample=.7,
+                          ntrees=200,
+                          seed=71,
+                          engine=engine)
+    onco_prob, tsg_prob, other_prob = rrclf.kfold_validation()
+    return rrclf, 1 - other_prob
+
+
+def test_native_engine():
+    """Test that the native engine is statistically equivalent to R's randomForest."""
+    r_clf, r_driver = cv_scores('r')
+    native_clf, native_driver = cv_scores('native')
+    native_driver = native_driver[r_driver.index]
+
+    # driver scores should rank genes similarly
+    rho, pval = stats.spearmanr(r_driver, native_driver)
+    assert rho > .8
+
+    # the top ranked genes should largely agree
+    r_top = set(r_driver.sort_values(ascending=False).index[:50])
+    native_top = set(native_driver.sort_values(ascending=False).index[:50])
+    assert len(r_top & native_top) >= 40
+
+    # similar performance in cross-validation
+    assert abs(r_clf.driver_mean_roc_auc - native_clf.driver_mean_roc_auc) < .05
+    assert abs(r_clf.driver_mean_pr_auc - native_clf.driver_mean_pr_auc) < .1
+
+
+def test_parallel_reproducible():
+    """Test that parallel cross-validation matches a serial run exactly."""
+    example_features = os.path.join(file_dir, 'data/features_pancan_subset.txt')
+    df = pd.read_csv(example_features, sep='\t', index_col=0)
+    scores = []
+    for processes in [1, 3]:
+        rrclf = RRandomForest(df, ntrees=50, seed=71, total_iter=2,
+                              processes=processes, engine='native')
+        onco_prob, tsg_prob, other_prob = rrclf.kfold_validation()
+        scores.append(1 - other_prob)
+    assert np.array_equal(scores[0].sort_index(), scores[1].sort_index())
+
+
+def test_checkpoint_resume():
+    """Test that resuming from a partial checkpoint matches an
+    uninterrupted run exactly."""
+    example_features = os.path.join(file_dir, 'data/features_pancan_subset.txt')
+    checkpoint_dir = os.path.join(file_dir, 'data/test_checkpoint')
+    df = pd.read_csv(example_features, sep='\t', index_col=0)
+    scores = []
+    for resume in [False, True]:
+        rrclf = RRandomForest(df, ntrees=50, seed=71, total_iter=2, engine='native',
+                              checkpoint=checkpoint_dir, resume=resume)
+        onco_prob, tsg_prob, other_prob = rrclf.kfold_validation()
+        scores.append(1 - other_prob)
+        params = rrclf._checkpoint_params()
+        assert params['engine'] == 'native' and params['driver_sample_rate'] == .7
+
+        # interrupted run, where some folds were not finished
+        for fold in range(1, 6):
+            os.remove(os.path.join(checkpoint_dir,
+                                   'validation_iter2_fold{0}.npz'.format(fold)))
+    assert np.array_equal(scores[0].sort_index(), scores[1].sort_index())
+
+    # folds saved with other features or settings are not reused
+    df_changed = df.copy()
+    df_changed.iloc[:, 0] = df_changed.iloc[:, 0] * 2
+    for opts in [{'df': df, 'ntrees': 20}, {'df': df_changed, 'ntrees': 50}]:
+        expected = RRandomForest(opts['df'], ntrees=opts['ntrees'], seed=71,
+                                 total_iter=2, engine='native')
+        resumed = RRandomForest(opts['df'], ntrees=opts['ntrees'], seed=71,
+                                total_iter=2, engine='native',
+                                checkpoint=checkpoint_dir, resume=True)
+        expected_other = expected.kfold_validation()[2]
+        resumed_other = resumed.kfold_validation()[2]
+        assert np.array_equal(expected_other.sort_index(), resumed_other.sort_index())
+
+
+def test_oob_validation():
+    """Test that out-of-bag scores come with their out-of-bag vote counts."""
+    example_features = os.path.join(file_dir, 'data/features_pancan_subset.txt')
+    df = pd.read_csv(example_features, sep='\t', index_col=0)
+    rrclf = RRandomForest(df, ntrees=100, seed=71, total_iter=1, engine='native')
+    onco_prob, tsg_prob, other_prob = rrclf.oob_validation()
+    assert onco_prob.index.is_monotonic_increasing
+    assert set(onco_prob.index) == set(df.index)
+
+    # one forest, so the scores are the fractions of out-of-bag votes
+    pred_df = rrclf.prediction_df
+    total = pred_df[['oncogene votes', 'tsg votes', 'other votes']].sum(axis=1)
+    is_oob = pred_df['num predictions'] > 0
+    assert is_oob.mean() > .9 and (total[is_oob] > 0).all()
+    assert np.allclose(onco_prob[is_oob], pred_df['oncogene votes'][is_oob] / total[is_oob])
+    assert np.allclose(tsg_prob[is_oob], pred_df['tsg votes'][is_oob] / total[is_oob])
@@ -0,0 +1,63 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+import src.classify.python.null_cache as null_cache
+from src.utils.python.vote_histogram import sidecar_path
+import shutil
+import time
+
+
+def write_file(path, text):
+    with open(path, 'w') as handle:
+        handle.write(text)
+
+
+def test_null_cache():
+    """Test that cached null distributions are keyed by their inputs and
+    evicted by age and size."""
+    cache_dir = os.path.join(file_dir, 'data/null_cache')
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    model_path = os.path.join(file_dir, 'data/null_cache_model.txt')
+    feature_path = os.path.join(file_dir, 'data/null_cache_features.txt')
+    null_path = os.path.join(file_dir, 'data/null_cache_null_dist.txt')
+    write_file(model_path, 'model')
+    write_file(feature_path, 'features')
+
+    # keys depend on the classifier, the features and the --cv option
+    key = null_cache.cache_key(model_path, feature_path, True)
+    assert key == null_cache.cache_key(model_path, feature_path, True)
+    assert key != null_cache.cache_key(model_path, feature_path, False)
+    assert key != null_cache.cache_key(model_path, feature_path, True, kind='state')
+    write_file(feature_path, 'other features')
+    assert key != null_cache.cache_key(model_path, feature_path, True)
+
+    # stored null distribution and vote histograms are copied back
+    assert not null_cache.fetch_null(cache_dir, key, null_path)
+    write_file(null_path, 'null distribution')
+    write_file(sidecar_path(null_path), 'votes')
+    null_cache.store_null(cache_dir, key, null_path)
+    os.remove(null_path)
+    os.remove(sidecar_path(null_path))
+    assert null_cache.fetch_null(cache_dir, key, null_path)
+    assert open(null_path).read() == 'null distribution'
+    assert open(sidecar_path(null_path)).read() == 'votes'
+
+    # evict entries not used for a day, then the least recently used
+    old_key = null_cache.cache_key(model_path, feature_path, False)
+    null_cache.store_null(cache_dir, old_key, null_path)
+    two_days_ago = time.time() - 2 * 86400
+    os.utime(os.path.join(cache_dir, old_key), (two_days_ago, two_days_ago))
+    assert null_cache.evict(cache_dir, max_age=86400) == 1
+    assert null_cache.fetch(cache_dir, old_key, [null_cache.NULL_TEXT]) is None
+    assert null_cache.fetch(cache_dir, key, [null_cache.NULL_TEXT]) is not None
+    assert null_cache.evict(cache_dir, max_size=1) == 1
+    assert not os.listdir(cache_dir)
+
+    # entries are evicted by default age when no limits are given
+    null_cache.store_null(cache_dir, old_key, null_path)
+    long_ago = time.time() - (null_cache.DEFAULT_MAX_AGE + 1) * 86400
+    os.utime(os.path.join(cache_dir, old_key), (long_ago, long_ago))
+    assert null_cache.evict_cache({'null_cache': cache_dir}) == 1
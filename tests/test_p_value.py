@@ -0,0 +1,89 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+import src.utils.python.p_value as p_value
+import pandas as pd
+import numpy as np
+
+
+def test_compute_p_value():
+    """Test that the vectorized p-value lookup matches score2pval."""
+    null_pvals = pd.Series([.01, .1, .4, 1.], index=[.9, .6, .3, 0.])
+    null_scores = list(reversed(null_pvals.index.tolist()))
+    sorted_pvals = null_pvals.sort_values(ascending=False)
+    scores = pd.Series([.95, .9, .7, .6, .45, .3, .1, 0.])
+    pvals = p_value.compute_p_value(scores, null_pvals)
+    expected = [p_value.score2pval(s, null_scores, sorted_pvals) for s in scores]
+    assert np.array_equal(pvals.values, expected)
+    assert pvals.iloc[0] == 0  # beyond the largest null score
+    assert pvals.iloc[1] == .01  # tie with the largest null score
+
+
+def test_tail_model():
+    """Test that the tail model extrapolates calibrated p-values beyond
+    the largest null score."""
+    prng = np.random.RandomState(5)
+    # exponential null scores, which have a generalized pareto tail
+    null_scores = np.round(prng.exponential(.05, size=5000), 3)
+    cts = pd.Series(null_scores).value_counts().sort_index(ascending=False)
+    null_pvals = cts.cumsum() / float(cts.sum())
+
+    tail_model = p_value.TailModel.fit(null_pvals)
+    assert abs(tail_model.shape) < .2
+    assert tail_model.diagnostics()['KS statistic'] < .1
+
+    # within a factor of two of the true p-values beyond the null scores
+    scores = pd.Series(null_scores.max() + np.array([.02, .05, .1]))
+    pvals = p_value.compute_p_value(scores, null_pvals)
+    assert (pvals == 0).all()
+    pvals = p_value.extrapolate_tail(scores, pvals, tail_model)
+    true_pvals = np.exp(-scores / .05)
+    assert np.all((pvals > true_pvals / 2) & (pvals < true_pvals * 2))
+
+    # p-values never increase with the score across the largest null score
+    scores = pd.Series(np.linspace(null_scores.max() - .05, null_scores.max() + .5, 200))
+    pvals = p_value.extrapolate_tail(scores, p_value.compute_p_value(scores, null_pvals),
+                                     tail_model)
+    assert np.all(np.diff(pvals.values) <= 0)
+    assert (pvals > 0).all()
+
+    # a negative shape has an upper endpoint, beyond which p-values stay
+    # positive, and p-values are capped by the largest null score's p-value
+    bounded = p_value.TailModel(tail_model.threshold, tail_model.tail_prob, -.5,
+                                tail_model.scale, top_prob=1e-6)
+    endpoint = bounded.diagnostics()['upper endpoint']
+    scores = pd.Series([null_scores.max() + .001, endpoint, endpoint + 1])
+    pvals = p_value.extrapolate_tail(scores, pd.Series(np.zeros(3)), bounded)
+    assert (pvals > 0).all() and (pvals <= 1e-6).all()
+    assert np.all(np.diff(pvals.values) <= 0)
+
+
+def test_fdr():
+    """Test BH adjustment against R's p.adjust, and Storey and grouped q-values."""
+    # p.adjust(c(.01, .04, .04, .03, .2, NA, .5, .001), method="BH") in R
+    pval = [.01, .04, .04, .03, .2, np.nan, .5, .001]
+    r_bh = [0.035, 0.056, 0.056, 0.056, 0.2333333, np.nan, 0.5, 0.007]
+    qval = p_value.bh_fdr(pval)
+    assert np.isnan(qval[5])
+    assert np.allclose(qval, r_bh, atol=1e-7, equal_nan=True)
+
+    # Storey's q-values are BH scaled by pi0 <= 1
+    prng = np.random.RandomState(7)
+    pval = np.concatenate([prng.uniform(size=900), prng.uniform(0, .001, size=100)])
+    pi0 = p_value.estimate_pi0(pval)
+    assert .8 < pi0 <= 1
+    bh = p_value.bh_fdr(pval)
+    qval = p_value.storey_qvalue(pval)
+    assert np.all(qval <= bh)
+    assert np.allclose(qval, pi0 * bh)
+    assert p_value.estimate_pi0(np.ones(10)) == 1
+
+    # grouped adjustment is BH within each group
+    groups = prng.choice(['BRCA', 'LUAD', 'SKCM'], size=len(pval))
+    qval = p_value.grouped_fdr(pval, groups)
+    for group in ['BRCA', 'LUAD', 'SKCM']:
+        is_group = groups == group
+        assert np.array_equal(qval[is_group], p_value.bh_fdr(pval[is_group]))
@@ -0,0 +1,47 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+import src.classify.python.r_worker as r_worker
+from multiprocessing.connection import Client
+import threading
+import stat
+
+
+def test_model_cache():
+    """Test that only the most recently used models are kept."""
+    cache = r_worker.ModelCache(max_models=2)
+    assert cache.put('a', 1) == 0
+    assert cache.put('b', 2) == 0
+    assert cache.get('a') == 1  # b is now the least recently used
+    assert cache.put('c', 3) == 1
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.get('b') is None
+    assert len(cache) == 2
+
+
+def test_worker_authentication():
+    """Test that the worker only serves clients with its key."""
+    address = os.path.join(file_dir, 'data/test_r_worker.sock')
+    thread = threading.Thread(target=r_worker.serve, args=(address,))
+    thread.start()
+    try:
+        conn = r_worker.connect(address)
+        conn.close()
+        mode = stat.S_IMODE(os.stat(r_worker.key_path(address)).st_mode)
+        assert mode == 0o600
+        mode = stat.S_IMODE(os.stat(address).st_mode)
+        assert not mode & 0o077
+
+        # a client without the key is rejected
+        try:
+            Client(address, family='AF_UNIX', authkey=b'wrong key').send(('shutdown',))
+        except Exception:
+            pass
+    finally:
+        r_worker.shutdown(address)
+        thread.join(10)
+    assert not thread.is_alive()
+    assert not os.path.exists(r_worker.key_path(address))
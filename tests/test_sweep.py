@@ -0,0 +1,31 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+import src.classify.python.sweep as sweep
+import pandas as pd
+
+
+def test_sweep():
+    """Test a small sweep of random forest settings."""
+    example_features = os.path.join(file_dir, 'data/features_pancan_subset.txt')
+    test_sweep = os.path.join(file_dir, 'data/test_sweep.txt')
+    opts = {
+        'features': example_features,
+        'ntrees': [20, 40],
+        'driver_rate': [.7],
+        'other_ratio': [.5, 1.],
+        'iterations': 2,
+        'random_seed': 71,
+        'processes': 2,
+        'engine': 'native',
+        'fold_plan': None,
+        'null_distribution': None,
+        'output': test_sweep
+    }
+    sweep.main(opts)
+    result = pd.read_csv(test_sweep, sep='\t')
+    assert len(result) == 4
+    assert (result['driver ROC AUC'] > .5).all()
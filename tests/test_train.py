@@ -30,3 +30,9 @@ def test_training():
     opts['cv'] = True
     opts['output'] = test_train_cv
     train.main(opts)
+
+    # train cross-validated, writing each fold model as it is trained
+    opts['sharded'] = True
+    opts['output'] = os.path.join(file_dir, 'data/test_train_cv_sharded')
+    train.main(opts)
+    assert os.path.exists(os.path.join(opts['output'], 'manifest.txt'))
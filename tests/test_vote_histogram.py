@@ -0,0 +1,93 @@
+# fix problems with pythons terrible import system
+import os
+import sys
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(file_dir, '..'))
+
+from src.utils.python.vote_histogram import VoteHistogram, sidecar_path
+import src.utils.python.p_value as p_value
+import pandas as pd
+import numpy as np
+
+
+def simulated_result(prng, num_genes, total_votes):
+    """Classify result with random vote counts."""
+    onco = prng.binomial(total_votes, .1, size=num_genes)
+    tsg = prng.binomial(total_votes - onco, .1)
+    df = pd.DataFrame({'oncogene votes': onco,
+                       'tsg votes': tsg,
+                       'other votes': total_votes - onco - tsg})
+    df['oncogene score'] = onco / float(total_votes)
+    df['tsg score'] = tsg / float(total_votes)
+    df['driver score'] = (onco + tsg) / float(total_votes)
+    return df
+
+
+def null_table(result_df):
+    """Null distribution text file as written by classify --simulated."""
+    null_df = pd.DataFrame()
+    for score_col, pval_col in p_value.score_pval_cols:
+        cts = result_df[score_col].value_counts().sort_index(ascending=False)
+        null_df = null_df.join(pd.DataFrame({pval_col: cts.cumsum() / float(cts.sum())}),
+                               how='outer')
+    return null_df.sort_index(ascending=False)
+
+
+def test_vote_histogram():
+    """Test exact p-values against the score lookup."""
+    prng = np.random.RandomState(11)
+    sim_df = simulated_result(prng, 2000, 250)
+    null_hist = VoteHistogram.from_result(sim_df)
+    null_df = null_table(sim_df)
+
+    # same and different total votes than the null distribution
+    for total_votes in [250, 1000, 333]:
+        obs_df = simulated_result(prng, 500, total_votes)
+        expected = p_value.compute_p_values(obs_df, null_df)
+        pvals = null_hist.p_values(obs_df)
+        for _, pval_col in p_value.score_pval_cols:
+            assert np.allclose(pvals[pval_col], expected[pval_col])
+
+    # converted null distribution text file, saved and loaded
+    path = os.path.join(file_dir, 'data/null_dist.txt')
+    converted = VoteHistogram.from_null_table(null_df)
+    converted.save(sidecar_path(path))
+    converted = VoteHistogram.load(sidecar_path(path))
+    assert converted.total_votes == 250
+    for kind in ['oncogene', 'tsg', 'driver']:
+        assert np.array_equal(converted.counts[kind], null_hist.counts[kind])
+
+    # histograms only match the null distribution they were made from
+    null_df.to_csv(path, sep='\t', index_label='score')
+    saved_df = pd.read_csv(path, sep='\t', index_col=0)
+    assert null_hist.matches(saved_df)
+    other_hist = VoteHistogram.from_result(simulated_result(prng, 2000, 250))
+    assert not other_hist.matches(saved_df)
+
+
+def test_merge():
+    """Test that merging histograms is exact and does not depend on order."""
+    prng = np.random.RandomState(13)
+    hists = [VoteHistogram.from_result(simulated_result(prng, 300, total_votes),
+                                       sources=[str(i)])
+             for i, total_votes in enumerate([250, 250, 100])]
+    left = hists[0].merge(hists[1]).merge(hists[2])
+    right = hists[0].merge(hists[2].merge(hists[1]))
+    assert left.total_votes == right.total_votes == 500
+    assert left.sources == right.sources == ['0', '1', '2']
+    for kind in ['oncogene', 'tsg', 'driver']:
+        assert np.array_equal(left.counts[kind], right.counts[kind])
+
+    # p-values are the same as a null distribution of all genes
+    obs_df = simulated_result(prng, 200, 333)
+    expected = p_value.compute_p_values(obs_df, left.to_null_table())
+    pvals = left.p_values(obs_df)
+    for _, pval_col in p_value.score_pval_cols:
+        assert np.allclose(pvals[pval_col], expected[pval_col])
+
+    # the same simulation can not be counted twice
+    try:
+        left.merge(hists[0])
+        assert False
+    except ValueError:
+        pass